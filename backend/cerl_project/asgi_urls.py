@@ -0,0 +1,13 @@
+"""URL configuration under ASGI: async views first, then ``cerl_project.urls``"""
+from django.urls import path
+
+from core_resources import async_views as resource_views
+from user_alerts import async_views as alert_views
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('api/resources/', resource_views.resource_list, name='resource-list'),
+    path('api/resources/nearby/', resource_views.resource_nearby, name='resource-nearby'),
+    path('api/alerts/active/', alert_views.active, name='alert-active'),
+] + wsgi_urlpatterns
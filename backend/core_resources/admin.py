@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Resource, ResourceUpdate
+from .models import User, Resource, ResourceUpdate, CapacityRollup, DuplicateCandidate, Job
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -25,3 +25,21 @@ class ResourceUpdateAdmin(admin.ModelAdmin):
     list_display = ['resource', 'coordinator', 'timestamp', 'previous_capacity', 'new_capacity']
     list_filter = ['timestamp']
     readonly_fields = ['timestamp']
+
+@admin.register(CapacityRollup)
+class CapacityRollupAdmin(admin.ModelAdmin):
+    list_display = ['series', 'resolution', 'bucket', 'min_available', 'max_available', 'last_available', 'update_count']
+    list_filter = ['resolution']
+    search_fields = ['series']
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+    list_display = ['resource', 'duplicate_of', 'score', 'distance_m', 'status', 'created_at']
+    list_filter = ['status']
+    raw_id_fields = ['resource', 'duplicate_of']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'priority', 'attempts', 'run_at', 'worker', 'created_at', 'finished_at']
+    list_filter = ['status', 'task']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
@@ -0,0 +1,248 @@
+"""Evacuee-to-shelter allocation as a min-cost flow.
+
+Demand points (pickup locations with a number of people) are linked to
+the ``CANDIDATES`` nearest shelters within ``max_distance_km``, found
+through a bucketed spatial index. The transportation problem on that
+sparse graph is solved with successive shortest paths: each demand point
+runs Dijkstra with node potentials over the residual graph until it
+reaches a shelter that still has room, so a path may move earlier groups
+to other shelters when that shortens total travel. Costs are integer
+metres, which keeps the potentials exact.
+
+Solve time grows with congestion: when nearby shelters are nearly full
+each new group displaces others along longer chains.
+
+When capacity runs short, demand points listed earlier are served first.
+"""
+import heapq
+import itertools
+import math
+import time
+
+from . import shards
+from .coverage import KM_PER_DEGREE
+from .models import Resource
+
+CANDIDATES = 12
+MAX_DISTANCE_KM = 30
+MAX_DEMAND_POINTS = 5000
+
+
+class AllocationError(ValueError):
+    pass
+
+
+class Projection:
+    """Equirectangular projection (km) centred on a set of points"""
+
+    def __init__(self, latitudes, longitudes):
+        self.lat0 = (min(latitudes) + max(latitudes)) / 2
+        self.lon0 = (min(longitudes) + max(longitudes)) / 2
+        self.km_per_lon = KM_PER_DEGREE * math.cos(math.radians(self.lat0))
+
+    def __call__(self, lat, lon):
+        return (lon - self.lon0) * self.km_per_lon, (lat - self.lat0) * KM_PER_DEGREE
+
+
+def candidate_arcs(demand_xy, shelter_xy, max_distance_km, candidates):
+    """For each demand point, ``[(shelter_index, metres), ...]`` nearest first"""
+    size = max(max_distance_km / 2, 0.5)
+    buckets = {}
+    for index, (x, y) in enumerate(shelter_xy):
+        buckets.setdefault((int(x // size), int(y // size)), []).append(index)
+    reach = int(math.ceil(max_distance_km / size))
+
+    arcs = []
+    for x, y in demand_xy:
+        bx, by = int(x // size), int(y // size)
+        found = []
+        for i in range(bx - reach, bx + reach + 1):
+            for j in range(by - reach, by + reach + 1):
+                for index in buckets.get((i, j), ()):
+                    sx, sy = shelter_xy[index]
+                    d = math.hypot(sx - x, sy - y)
+                    if d <= max_distance_km:
+                        found.append((d, index))
+        found = heapq.nsmallest(candidates, found)
+        arcs.append([(index, int(round(d * 1000))) for d, index in found])
+    return arcs
+
+
+def solve(people, capacity, arcs):
+    """Min-cost allocation on a sparse bipartite graph.
+
+    ``people[i]`` is the demand at point ``i``, ``capacity[j]`` the room
+    at shelter ``j`` and ``arcs[i]`` the ``(j, cost)`` pairs point ``i``
+    may use. Returns ``{(i, j): people}``.
+    """
+    n = len(people)
+    spare = list(capacity)
+    remaining = list(people)
+    costs = [dict(point_arcs) for point_arcs in arcs]
+    reverse_arcs = [[] for _ in capacity]
+    for i, point_arcs in enumerate(arcs):
+        for j, cost in point_arcs:
+            reverse_arcs[j].append((i, cost))
+    # incoming[j][i] is the flow from point i to shelter j; every entry is
+    # also a residual arc j -> i, listed per point in outgoing[i]
+    incoming = [dict() for _ in capacity]
+    outgoing = [set() for _ in people]
+    potential = [0] * (n + len(capacity))
+    # Nodes that cannot reach a shelter with room; augmentations never
+    # change that, so searches skip them
+    dead = set()
+    pop, push = heapq.heappop, heapq.heappush
+
+    def send(source, target, prev):
+        """Push people along the tree path; True if a residual arc ran dry"""
+        path = []
+        v = target
+        while v != source:
+            path.append((prev[v], v))
+            v = prev[v]
+        amount = min(remaining[source], spare[target - n])
+        for u, v in path:
+            if u >= n:
+                amount = min(amount, incoming[u - n][v])
+        emptied = False
+        for u, v in path:
+            if u < n:
+                flows = incoming[v - n]
+                flows[u] = flows.get(u, 0) + amount
+                outgoing[u].add(v - n)
+            else:
+                flows = incoming[u - n]
+                flows[v] -= amount
+                if not flows[v]:
+                    del flows[v]
+                    outgoing[v].discard(u - n)
+                    emptied = True
+        remaining[source] -= amount
+        spare[target - n] -= amount
+        return emptied
+
+    def search(source):
+        """One Dijkstra over reduced costs from ``source``"""
+        dist = {source: 0}
+        prev = {}
+        settled = []
+        # Ties pop newest first, so the search runs depth-first down
+        # zero-cost arcs instead of sweeping the whole tie
+        order = itertools.count(0, -1)
+        heap = [(0, 0, source)]
+        while heap:
+            d, _, u = pop(heap)
+            if d > dist[u]:
+                continue
+            settled.append(u)
+            pu = potential[u]
+            if u >= n:
+                j = u - n
+                if spare[j] > 0 and (send(source, u, prev) or not remaining[source]):
+                    # Reduced costs stay non-negative with potentials capped at d
+                    for v in settled:
+                        potential[v] += dist[v] - d
+                    return
+                # Either full, or it just filled without breaking the tree:
+                # carry on towards the next shelter with room
+                for v in incoming[j]:
+                    if v in dead:
+                        continue
+                    nd = d - costs[v][j] + pu - potential[v]
+                    if nd < dist.get(v, nd + 1):
+                        dist[v] = nd
+                        prev[v] = u
+                        push(heap, (nd, next(order), v))
+            else:
+                for j, cost in arcs[u]:
+                    v = n + j
+                    if v in dead:
+                        continue
+                    nd = d + cost + pu - potential[v]
+                    if nd < dist.get(v, nd + 1):
+                        dist[v] = nd
+                        prev[v] = u
+                        push(heap, (nd, next(order), v))
+        dead.update(settled)
+
+    for source in range(n):
+        while remaining[source] > 0 and source not in dead:
+            search(source)
+
+    return {
+        (i, j): flow
+        for j, flows in enumerate(incoming)
+        for i, flow in flows.items()
+    }
+
+
+def parse_demand(items):
+    """Validate request demand points into ``(key, lat, lon, people)`` tuples"""
+    if not isinstance(items, list) or not items:
+        raise AllocationError('demand must be a non-empty list')
+    if len(items) > MAX_DEMAND_POINTS:
+        raise AllocationError(f'At most {MAX_DEMAND_POINTS} demand points per request')
+    demand = []
+    for position, item in enumerate(items):
+        try:
+            lat, lon = float(item['latitude']), float(item['longitude'])
+            people = int(item['people'])
+        except (KeyError, TypeError, ValueError):
+            raise AllocationError(f'demand[{position}] needs numeric latitude, longitude and people')
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or people < 0:
+            raise AllocationError(f'demand[{position}] is out of range')
+        demand.append((item.get('id', position), lat, lon, people))
+    return demand
+
+
+def allocate(demand, types=('shelter',), max_distance_km=MAX_DISTANCE_KM, candidates=CANDIDATES):
+    """Assign parsed demand points to open resources of ``types`` with free capacity"""
+    started = time.perf_counter()
+    latitudes = [lat for _, lat, _, _ in demand]
+    longitudes = [lon for _, _, lon, _ in demand]
+    project = Projection(latitudes, longitudes)
+    margin_lat = max_distance_km / KM_PER_DEGREE
+    margin_lon = max_distance_km / project.km_per_lon
+    queryset = Resource.objects.filter(
+        type__in=types, status='open', available_capacity__gt=0,
+        latitude__range=(min(latitudes) - margin_lat, max(latitudes) + margin_lat),
+        longitude__range=(min(longitudes) - margin_lon, max(longitudes) + margin_lon),
+    ).order_by('id').values_list('id', 'name', 'latitude', 'longitude', 'available_capacity')
+    # Shards come back in id order, so the shelters stay sorted by id
+    shelters = shards.gather_list(queryset)
+
+    arcs = candidate_arcs(
+        [project(lat, lon) for _, lat, lon, _ in demand],
+        [project(float(lat), float(lon)) for _, _, lat, lon, _ in shelters],
+        max_distance_km, candidates,
+    )
+    people = [count for *_, count in demand]
+    flows = solve(people, [room for *_, room in shelters], arcs)
+
+    assigned = [0] * len(demand)
+    assignments = []
+    total_metres = 0
+    for (i, j), count in sorted(flows.items()):
+        metres = dict(arcs[i])[j]
+        assigned[i] += count
+        total_metres += metres * count
+        assignments.append({
+            'demand': demand[i][0],
+            'resource': shelters[j][0],
+            'resource_name': shelters[j][1],
+            'people': count,
+            'distance_km': round(metres / 1000, 3),
+        })
+    return {
+        'assignments': assignments,
+        'unassigned': [
+            {'demand': key, 'people': count - assigned[i]}
+            for i, (key, _, _, count) in enumerate(demand) if count > assigned[i]
+        ],
+        'total_people': sum(people),
+        'assigned_people': sum(assigned),
+        'total_person_km': round(total_metres / 1000, 1),
+        'shelters_considered': len(shelters),
+        'shelters_used': len({j for _, j in flows}),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000),
+    }
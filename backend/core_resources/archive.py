@@ -0,0 +1,326 @@
+"""Retention for the ``resource_updates`` audit log.
+
+Rows older than the retention period are moved into gzip files
+partitioned by month (``<root>/<YYYY>/<MM>/updates-<first>-<last>.jsonl.gz``).
+Each file stores one gzip member per resource, and a small sidecar
+index (``.idx.json``) records where each member starts, so reading one
+resource's history decompresses only that resource's rows. ``catalog.json``
+lists every file with its time range.
+
+A file is added to the catalog as ``pending`` before its rows are
+deleted and marked ``done`` afterwards; an interrupted run is finished
+by the next one, and readers drop the duplicate rows in between.
+"""
+import gzip
+import heapq
+import json
+import os
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import shards
+from .audit import _pid_alive
+from .models import ResourceUpdate, RollupCursor
+from .rollups import CURSOR_NAME as ROLLUP_CURSOR
+
+CATALOG_NAME = 'catalog.json'
+LOCK_NAME = 'archive.lock'
+DELETE_CHUNK_SIZE = 1000
+
+FIELDS = [
+    'id', 'resource_id', 'coordinator_id', 'timestamp',
+    'change_log', 'previous_capacity', 'new_capacity',
+]
+
+
+class ArchiveBusy(Exception):
+    """Another archive run holds the lock"""
+
+
+def _root():
+    if shards.enabled():
+        # Each shard keeps its own catalog; audit ids are only unique per shard range
+        return os.path.join(str(settings.AUDIT_ARCHIVE_ROOT), shards.current() or 'unsharded')
+    return str(settings.AUDIT_ARCHIVE_ROOT)
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def read_catalog():
+    try:
+        with open(os.path.join(_root(), CATALOG_NAME)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {'files': []}
+
+
+def _save_catalog(catalog):
+    _write_atomic(
+        os.path.join(_root(), CATALOG_NAME),
+        json.dumps(catalog, indent=1, sort_keys=True).encode(),
+    )
+
+
+_index_cache = {}
+
+
+def _load_index(entry):
+    path = os.path.join(_root(), entry['index'])
+    mtime = os.path.getmtime(path)
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as fh:
+            cached = (mtime, json.load(fh))
+        _index_cache[path] = cached
+    return cached[1]
+
+
+def _decode(line):
+    row = json.loads(line)
+    row['timestamp'] = parse_datetime(row['timestamp'])
+    return row
+
+
+def _member_rows(entry, member):
+    offset, length = member[0], member[1]
+    with open(os.path.join(_root(), entry['file']), 'rb') as fh:
+        fh.seek(offset)
+        data = gzip.decompress(fh.read(length))
+    return [_decode(line) for line in data.splitlines()]
+
+
+def _overlaps(low, high, start, end):
+    return (end is None or low < end) and (start is None or high >= start)
+
+
+def _members(resource_id, start=None, end=None):
+    """``(entry, member)`` pairs that may hold rows for ``resource_id`` in range"""
+    key = str(resource_id)
+    for entry in read_catalog()['files']:
+        if not _overlaps(parse_datetime(entry['min_ts']), parse_datetime(entry['max_ts']), start, end):
+            continue
+        member = _load_index(entry).get(key)
+        if member and _overlaps(parse_datetime(member[3]), parse_datetime(member[4]), start, end):
+            yield entry, member
+
+
+def _in_range(row, start, end):
+    return (start is None or row['timestamp'] >= start) and (end is None or row['timestamp'] < end)
+
+
+def iter_archived(resource_id, start=None, end=None):
+    """Archived rows for one resource in ``[start, end)``, ordered by ``(timestamp, id)``.
+
+    Each gzip member is sorted, so files are merged lazily: only one
+    member per overlapping file is decompressed at a time.
+    """
+    def rows(entry, member):
+        for row in _member_rows(entry, member):
+            if _in_range(row, start, end):
+                yield row
+
+    streams = [rows(entry, member) for entry, member in _members(resource_id, start, end)]
+    yield from heapq.merge(*streams, key=lambda row: (row['timestamp'], row['id']))
+
+
+def archived_by_resource(resource_ids, start=None, end=None):
+    """``{resource_id: rows}`` in ``[start, end)`` for several resources, each ordered by ``(timestamp, id)``.
+
+    The catalog is read once and only files overlapping the range are opened.
+    """
+    found = {}
+    for entry in read_catalog()['files']:
+        if not _overlaps(parse_datetime(entry['min_ts']), parse_datetime(entry['max_ts']), start, end):
+            continue
+        index = _load_index(entry)
+        for resource_id in resource_ids:
+            member = index.get(str(resource_id))
+            if member and _overlaps(parse_datetime(member[3]), parse_datetime(member[4]), start, end):
+                found.setdefault(resource_id, []).extend(
+                    row for row in _member_rows(entry, member) if _in_range(row, start, end)
+                )
+    for rows in found.values():
+        rows.sort(key=lambda row: (row['timestamp'], row['id']))
+    return found
+
+
+def count_archived(resource_id, start=None, end=None):
+    total = 0
+    for entry, member in _members(resource_id, start, end):
+        low, high = parse_datetime(member[3]), parse_datetime(member[4])
+        if (start is None or low >= start) and (end is None or high < end):
+            total += member[2]
+        else:
+            total += sum(1 for row in _member_rows(entry, member) if _in_range(row, start, end))
+    return total
+
+
+def recent_archived(resource_id, limit):
+    """The ``limit`` newest archived rows for one resource, newest first"""
+    members = sorted(_members(resource_id), key=lambda pair: pair[1][4], reverse=True)
+    rows = []
+    for entry, member in members:
+        if len(rows) >= limit and parse_datetime(member[4]) < rows[limit - 1]['timestamp']:
+            break
+        rows.extend(_member_rows(entry, member))
+        rows.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+        del rows[limit:]
+    return rows
+
+
+def _write_partition(month, rows):
+    """Write one month of rows; returns the catalog entry"""
+    rows.sort(key=lambda row: (row[1], row[3], row[0]))
+    first_id = min(row[0] for row in rows)
+    last_id = max(row[0] for row in rows)
+    name = f'{month[:4]}/{month[5:]}/updates-{first_id}-{last_id}'
+    os.makedirs(os.path.join(_root(), os.path.dirname(name)), exist_ok=True)
+
+    chunks, index, offset = [], {}, 0
+    start = 0
+    while start < len(rows):
+        resource_id = rows[start][1]
+        stop = start
+        while stop < len(rows) and rows[stop][1] == resource_id:
+            stop += 1
+        group = rows[start:stop]
+        payload = ''.join(
+            json.dumps(dict(zip(FIELDS, row)), default=str) + '\n' for row in group
+        ).encode()
+        member = gzip.compress(payload, mtime=0)
+        index[str(resource_id)] = [
+            offset, len(member), len(group),
+            group[0][3].isoformat(), group[-1][3].isoformat(),
+        ]
+        chunks.append(member)
+        offset += len(member)
+        start = stop
+
+    _write_atomic(os.path.join(_root(), name + '.jsonl.gz'), b''.join(chunks))
+    _write_atomic(os.path.join(_root(), name + '.idx.json'), json.dumps(index).encode())
+    timestamps = [row[3] for row in rows]
+    return {
+        'file': name + '.jsonl.gz',
+        'index': name + '.idx.json',
+        'month': month,
+        'min_ts': min(timestamps).isoformat(),
+        'max_ts': max(timestamps).isoformat(),
+        'first_id': first_id,
+        'last_id': last_id,
+        'rows': len(rows),
+        'state': 'pending',
+    }
+
+
+def _delete(ids):
+    for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+        with transaction.atomic(using=shards.db()):
+            ResourceUpdate.objects.filter(id__in=ids[i:i + DELETE_CHUNK_SIZE]).delete()
+
+
+def _finish_pending(catalog):
+    """Delete the rows of files whose run was interrupted before cleanup"""
+    for entry in catalog['files']:
+        if entry['state'] != 'pending':
+            continue
+        with open(os.path.join(_root(), entry['file']), 'rb') as fh:
+            lines = gzip.decompress(fh.read()).splitlines()
+        _delete([json.loads(line)['id'] for line in lines])
+        entry['state'] = 'done'
+        _save_catalog(catalog)
+
+
+class _Lock:
+    def __init__(self):
+        self.path = os.path.join(_root(), LOCK_NAME)
+
+    def __enter__(self):
+        os.makedirs(_root(), exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(self.path) as fh:
+                    owner = int(fh.read() or 0)
+            except (OSError, ValueError):
+                owner = 0
+            if owner and _pid_alive(owner):
+                raise ArchiveBusy(f'archive run already in progress (pid {owner})')
+            os.remove(self.path)
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return self
+
+    def __exit__(self, *exc):
+        os.remove(self.path)
+
+
+def _archive_rows(catalog, rows):
+    """Write ``rows`` to month files and delete them; returns the number of files"""
+    months = {}
+    for row in rows:
+        months.setdefault(row[3].astimezone(dt_timezone.utc).strftime('%Y-%m'), []).append(row)
+    entries = [_write_partition(month, group) for month, group in sorted(months.items())]
+    catalog['files'].extend(entries)
+    _save_catalog(catalog)
+    _delete([row[0] for row in rows])
+    for entry in entries:
+        entry['state'] = 'done'
+    _save_catalog(catalog)
+    return len(entries)
+
+
+def archive_updates(retention_days, batch_size=50000):
+    """Move audit rows older than ``retention_days`` into archive files.
+
+    Rows the rollup cursor has not folded yet are left in place.
+    Returns ``(rows_archived, files_written)``.
+    """
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    archived = files = 0
+    with _Lock():
+        catalog = read_catalog()
+        _finish_pending(catalog)
+
+        queryset = ResourceUpdate.objects.filter(timestamp__lt=cutoff)
+        rollup = RollupCursor.objects.filter(name=ROLLUP_CURSOR).first()
+        if rollup is not None:
+            queryset = queryset.filter(id__lte=rollup.position)
+        queryset = queryset.order_by('id').values_list(*FIELDS)
+
+        last_id = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            files += _archive_rows(catalog, rows)
+            archived += len(rows)
+    return archived, files
+
+
+def archive_resource(resource_id):
+    """Move all audit rows of one resource into archive files, whatever their age.
+
+    Used before a resource is deleted, so its history stays readable by
+    its id. Returns the number of rows archived.
+    """
+    with _Lock():
+        catalog = read_catalog()
+        _finish_pending(catalog)
+        rows = list(ResourceUpdate.objects.filter(resource_id=resource_id).order_by('id').values_list(*FIELDS))
+        if rows:
+            _archive_rows(catalog, rows)
+    return len(rows)
@@ -0,0 +1,106 @@
+"""Async versions of the hottest read endpoints, served under ASGI.
+
+``cerl_project.asgi`` routes ``GET /api/resources/``,
+``/api/resources/nearby/`` and ``/api/alerts/active/`` here. Anonymous
+requests are answered with the async ORM, so a worker keeps serving
+other clients while queries and slow clients are pending. Everything
+these views do not cover (authenticated users, ``as_of``, sharding, the
+browsable API, other methods) goes to the regular DRF view unchanged.
+"""
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import resolve
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import shards
+from .models import Resource
+from .nearby import NearbyError, arank_nearby, parse_params as parse_nearby
+from .serializers import ResourceSerializer
+from .views import filter_resources
+
+PAGE_QUERY_PARAM = 'page'
+
+
+def needs_drf(request):
+    """Whether only the DRF view can answer ``request`` exactly"""
+    return (
+        request.method != 'GET'
+        # JWT authentication (and coordinator filtering) is DRF's
+        or 'HTTP_AUTHORIZATION' in request.META
+        or 'format' in request.GET
+        or 'text/html' in request.headers.get('Accept', '')
+    )
+
+
+async def fallback(request):
+    """Serve ``request`` with the view the WSGI urlconf maps it to"""
+    match = resolve(request.path_info, urlconf=settings.ROOT_URLCONF)
+    return await sync_to_async(match.func)(request, *match.args, **match.kwargs)
+
+
+def json_response(data, status=200):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+    response['Vary'] = 'Accept'
+    return response
+
+
+def _serialize(request, resources):
+    context = {'request': request, 'thumbnails': True}
+    return ResourceSerializer(resources, many=True, context=context).data
+
+
+def _resources():
+    return Resource.objects.select_related('coordinator', 'verified_by')
+
+
+@csrf_exempt
+async def resource_list(request):
+    """``ResourceViewSet.list`` for anonymous clients"""
+    page = request.GET.get(PAGE_QUERY_PARAM, '1')
+    if needs_drf(request) or shards.enabled() or 'as_of' in request.GET or not page.isdigit():
+        return await fallback(request)
+    page = int(page)
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    queryset = filter_resources(_resources(), request.GET)
+    count = await queryset.acount()
+    if page < 1 or page > max(math.ceil(count / page_size), 1):
+        return json_response({'detail': 'Invalid page.'}, status=404)
+    resources = [resource async for resource in queryset[(page - 1) * page_size:page * page_size]]
+
+    url = request.build_absolute_uri()
+    previous = None
+    if page == 2:
+        previous = remove_query_param(url, PAGE_QUERY_PARAM)
+    elif page > 2:
+        previous = replace_query_param(url, PAGE_QUERY_PARAM, page - 1)
+    return json_response({
+        'count': count,
+        'next': replace_query_param(url, PAGE_QUERY_PARAM, page + 1) if page * page_size < count else None,
+        'previous': previous,
+        'results': _serialize(request, resources),
+    })
+
+
+@csrf_exempt
+async def resource_nearby(request):
+    """``ResourceViewSet.nearby`` for anonymous clients"""
+    if needs_drf(request) or shards.enabled():
+        return await fallback(request)
+    try:
+        options = parse_nearby(request.GET)
+    except NearbyError as exc:
+        return json_response({'error': str(exc)}, status=400)
+
+    ranked = await arank_nearby(filter_resources(Resource.objects.all(), request.GET), options)
+    resources = await _resources().ain_bulk([pk for pk, _ in ranked])
+    nearby_resources = []
+    for pk, distance in ranked:
+        resource = resources[pk]
+        resource.distance = distance
+        nearby_resources.append(resource)
+    return json_response(_serialize(request, nearby_resources))
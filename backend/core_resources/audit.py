@@ -0,0 +1,262 @@
+"""Write-behind sink for ResourceUpdate audit rows.
+
+When ``AUDIT_JOURNAL_DIR`` is set, audit rows are appended to a local
+append-only journal instead of being inserted inside the request, and a
+background thread flushes them to the database with ``bulk_create``.
+Each process owns one journal segment plus an ``.offset`` sidecar that
+records how far the segment has been flushed, so segments left behind
+by a crashed or restarted worker are replayed on the next start.
+Delivery is at-least-once: a crash between a batch commit and the
+offset write replays that batch.
+
+An entry is appended once the capacity change has committed, so a crash
+between that commit and the append loses the audit row. Nothing repairs
+it; it shows up as a break in the ``previous_capacity`` ->
+``new_capacity`` chain of the resource's history.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import shards
+from .models import Resource, ResourceUpdate, User
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid):
+    if pid == os.getpid() or os.name == 'nt':
+        # os.kill(pid, 0) terminates the process on Windows; orphaned
+        # segments there are replayed with `manage.py flush_audit_journal`.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _row(entry):
+    return ResourceUpdate(
+        resource_id=entry['resource_id'],
+        coordinator_id=entry['coordinator_id'],
+        change_log=entry['change_log'],
+        previous_capacity=entry['previous_capacity'],
+        new_capacity=entry['new_capacity'],
+        timestamp=parse_datetime(entry['timestamp']),
+    )
+
+
+def _insert(entries):
+    """bulk_create a batch, dropping rows whose resource or user is gone"""
+    if shards.enabled():
+        by_shard = {}
+        for entry in entries:
+            by_shard.setdefault(shards.shard_for_id(entry['resource_id']), []).append(entry)
+        written = 0
+        for alias, shard_entries in by_shard.items():
+            if alias is None:
+                continue  # not a resource id on any shard
+            with shards.use(alias):
+                written += _insert_rows([_row(e) for e in shard_entries])
+        return written
+    return _insert_rows([_row(e) for e in entries])
+
+
+def _insert_rows(rows):
+    try:
+        with transaction.atomic(using=shards.db()):
+            ResourceUpdate.objects.bulk_create(rows)
+    except IntegrityError:
+        resources = set(Resource.objects.filter(
+            pk__in={r.resource_id for r in rows}).values_list('pk', flat=True))
+        users = set(User.objects.filter(
+            pk__in={r.coordinator_id for r in rows}).values_list('pk', flat=True))
+        rows = [r for r in rows if r.resource_id in resources and r.coordinator_id in users]
+        ResourceUpdate.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _read_offset(path):
+    try:
+        with open(path + '.offset') as fh:
+            return int(fh.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _write_offset(path, offset):
+    tmp = f'{path}.offset.tmp'
+    with open(tmp, 'w') as fh:
+        fh.write(str(offset))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path + '.offset')
+
+
+def drain_segment(path, batch_size):
+    """Flush a journal segment from its recorded offset; returns rows written"""
+    offset = _read_offset(path)
+    written = 0
+    with open(path, 'rb') as fh:
+        fh.seek(offset)
+        while True:
+            batch, end = [], offset
+            for line in fh:
+                if not line.endswith(b'\n'):
+                    break  # torn tail from a crash mid-write
+                end += len(line)
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                break
+            written += _insert(batch)
+            offset = end
+            _write_offset(path, offset)
+            fh.seek(offset)
+    return written, offset
+
+
+class JournalAuditSink:
+    """Append audit rows to a local journal and flush them in batches"""
+
+    def __init__(self, directory, interval=1.0, batch_size=500):
+        self.directory = directory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.path = os.path.join(directory, f'audit-{os.getpid()}.jsonl')
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = 0
+        self._thread = None
+        self._fh = None
+
+    def _start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._fh = open(self.path, 'ab')
+        self._thread = threading.Thread(target=self._run, name='audit-journal', daemon=True)
+        self._thread.start()
+
+    def append(self, **entry):
+        entry['timestamp'] = entry.get('timestamp', timezone.now()).isoformat()
+        line = (json.dumps(entry) + '\n').encode()
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._wakeup.set()
+
+    def replay_orphans(self, include_live=False):
+        """Flush segments left by processes that are no longer running"""
+        with self._flush_lock:
+            return self._replay_orphans(include_live)
+
+    def _replay_orphans(self, include_live):
+        written = 0
+        for path in glob.glob(os.path.join(self.directory, 'audit-*.jsonl')):
+            try:
+                pid = int(os.path.basename(path)[len('audit-'):-len('.jsonl')])
+            except ValueError:
+                continue
+            if pid == os.getpid() or (_pid_alive(pid) and not include_live):
+                continue
+            written += drain_segment(path, self.batch_size)[0]
+            for leftover in (path, path + '.offset'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return written
+
+    def flush(self):
+        """Write everything journalled so far to the database"""
+        if self._thread is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                self._pending = 0
+            written, offset = drain_segment(self.path, self.batch_size)
+            with self._lock:
+                # Only this process appends to the segment, so once it is
+                # fully flushed it can be truncated instead of growing forever.
+                if offset and offset == self._fh.tell():
+                    self._fh.truncate(0)
+                    self._fh.seek(0)
+                    _write_offset(self.path, 0)
+        return written
+
+    def _run(self):
+        try:
+            try:
+                self.replay_orphans()
+            except Exception:
+                logger.exception('Audit journal replay failed')
+            while True:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    # Rows stay in the journal and are retried next round
+                    logger.exception('Audit journal flush failed')
+                    connections.close_all()
+        finally:
+            connections.close_all()
+
+
+_sink = None
+if getattr(settings, 'AUDIT_JOURNAL_DIR', ''):
+    _sink = JournalAuditSink(
+        str(settings.AUDIT_JOURNAL_DIR),
+        interval=settings.AUDIT_FLUSH_INTERVAL,
+        batch_size=settings.AUDIT_BATCH_SIZE,
+    )
+    atexit.register(_sink.flush)
+
+
+def record(resource_id, coordinator, change_log, previous, new):
+    """Record an audit row through the journal, or insert it directly"""
+    if _sink is None:
+        return ResourceUpdate.objects.create(
+            resource_id=resource_id,
+            coordinator=coordinator,
+            change_log=change_log,
+            previous_capacity=previous,
+            new_capacity=new,
+        )
+    entry = dict(
+        resource_id=resource_id,
+        coordinator_id=coordinator.pk,
+        change_log=change_log,
+        previous_capacity=previous,
+        new_capacity=new,
+        timestamp=timezone.now(),
+    )
+    # Journal only once the capacity change itself has committed
+    transaction.on_commit(lambda: _sink.append(**entry), using=shards.db())
+    return None
+
+
+def flush(include_live=False):
+    """Flush the journal synchronously (no-op without a journal).
+
+    ``include_live`` also drains segments owned by other processes; only
+    use it while the application servers are stopped.
+    """
+    if _sink is None:
+        return 0
+    return _sink.replay_orphans(include_live) + _sink.flush()
@@ -0,0 +1,281 @@
+"""Atomic capacity bookkeeping for resources.
+
+Capacity changes are applied with database-side expressions so that
+concurrent check-ins and check-outs from several volunteers can never
+overwrite each other, and only the affected columns are written.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest, Least
+from django.db.models.lookups import Exact
+from django.utils import timezone
+
+from . import audit, shards, snapshots
+from .models import Resource
+
+logger = logging.getLogger(__name__)
+# Longest wait before retrying a coalesced write that failed (seconds)
+RETRY_MAX_DELAY = 60
+
+
+def bounded_capacity(expression):
+    """Clamp an available_capacity expression to [0, capacity]"""
+    return Greatest(Least(expression, F('capacity')), Value(0))
+
+
+def status_for(new_capacity):
+    """Status expression mirroring the auto-status rules of update_capacity"""
+    return Case(
+        When(Exact(new_capacity, 0), then=Value('full')),
+        When(status='full', then=Value('open')),
+        default=F('status'),
+    )
+
+
+def _apply(resource_id, new_capacity, coordinator, change_log):
+    """Apply a capacity expression and audit it inside one transaction.
+
+    The row is locked before the pre-image is read, and the new value is
+    computed by the database from the current row, so the audit trail
+    always chains previous -> new without gaps. ``new_capacity`` may also
+    be a callable computing the value from the locked row's
+    ``(available_capacity, capacity)``.
+    """
+    now = timezone.now()
+    using = shards.db()
+    with transaction.atomic(using=using):
+        if not connections[using].features.has_select_for_update:
+            # SQLite ignores FOR UPDATE; writing first takes the database
+            # write lock up front instead of failing on lock upgrade.
+            Resource.objects.filter(pk=resource_id).update(updated_at=now)
+        previous, capacity, region = (
+            Resource.objects.select_for_update()
+            .filter(pk=resource_id)
+            .values_list('available_capacity', 'capacity', 'region')
+            .get()
+        )
+        if callable(new_capacity):
+            new_capacity = Value(new_capacity(previous, capacity))
+        # status is listed first so every backend evaluates it against the
+        # pre-update row (MySQL applies SET assignments left to right).
+        Resource.objects.filter(pk=resource_id).update(
+            status=status_for(new_capacity),
+            available_capacity=new_capacity,
+            updated_at=now,
+        )
+        current = Resource.objects.filter(pk=resource_id).values_list(
+            'available_capacity', flat=True
+        ).get()
+        audit.record(resource_id, coordinator, change_log, previous, current)
+    snapshots.mark_dirty(region)
+    return previous, current
+
+
+def apply_capacity_delta(resource_id, delta, coordinator, change_log):
+    """Add a signed delta to available_capacity, bounded to [0, capacity].
+
+    Returns a ``(previous, new)`` tuple of available capacity values.
+    """
+    new_capacity = bounded_capacity(F('available_capacity') + Value(int(delta)))
+    return _apply(resource_id, new_capacity, coordinator, change_log)
+
+
+def set_available_capacity(resource_id, value, coordinator, change_log):
+    """Set available_capacity to an absolute value, bounded to [0, capacity]"""
+    new_capacity = bounded_capacity(Value(int(value)))
+    return _apply(resource_id, new_capacity, coordinator, change_log)
+
+
+def _clamp(available, capacity):
+    return min(max(available, 0), capacity)
+
+
+def _predict_status(status, available):
+    """Python twin of status_for, used by the read overlay"""
+    if available == 0:
+        return 'full'
+    if status == 'full':
+        return 'open'
+    return status
+
+
+class _Pending:
+    """Capacity changes for one resource waiting to be written"""
+
+    def __init__(self, base, capacity, status, coordinator, change_log):
+        self.capacity = capacity
+        self.status = status
+        self.available = base
+        self.value = None
+        self.deltas = []  # since the last absolute value
+        self.count = 0
+        self.coordinators = []
+        self.coordinator = coordinator
+        self.change_log = change_log
+        self.failures = 0
+
+    def add(self, delta, value, coordinator, change_log):
+        if value is not None:
+            self.value, self.deltas = int(value), []
+            self.available = _clamp(self.value, self.capacity)
+        else:
+            self.deltas.append(int(delta))
+            self.available = _clamp(self.available + int(delta), self.capacity)
+        self.status = _predict_status(self.status, self.available)
+        self.count += 1
+        if coordinator not in self.coordinators:
+            self.coordinators.append(coordinator)
+        self.coordinator = coordinator
+        self.change_log = change_log
+
+    def follow(self, earlier):
+        """Put the steps of ``earlier``, a burst whose write failed, before this one's"""
+        if self.value is None:
+            self.value, self.deltas = earlier.value, earlier.deltas + self.deltas
+        self.count += earlier.count
+        self.coordinators = earlier.coordinators + [
+            user for user in self.coordinators if user not in earlier.coordinators
+        ]
+        self.failures = max(self.failures, earlier.failures)
+
+    def replay(self, available, capacity):
+        """Apply the burst to a row's values, clamping after every step as ``add`` does"""
+        if self.value is not None:
+            available = _clamp(self.value, capacity)
+        for delta in self.deltas:
+            available = _clamp(available + delta, capacity)
+        return available
+
+
+class CapacityCoalescer:
+    """Collapse bursts of capacity updates into one database write.
+
+    Updates for the same resource that arrive within ``window`` seconds
+    are merged into one write through the atomic path above, with a
+    single summary audit row naming every coordinator involved. Each
+    step is clamped to [0, capacity] as it would be on its own, both in
+    the value readers in this process see through :meth:`peek` and in
+    the value written. A write that fails is logged and retried with
+    backoff, ahead of any changes queued meanwhile.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def submit(self, resource, coordinator, change_log, delta=0, value=None):
+        """Queue a change and return the predicted ``(available, status)``"""
+        with self._lock:
+            entry = self._pending.get(resource.pk)
+            if entry is None:
+                # Chain onto a write that is still in flight, if any.
+                inflight = self._flushing.get(resource.pk)
+                if inflight is not None:
+                    base, current_status = inflight.available, inflight.status
+                else:
+                    base, current_status = resource.available_capacity, resource.status
+                entry = _Pending(base, resource.capacity, current_status, coordinator, change_log)
+                self._pending[resource.pk] = entry
+                self._schedule(resource.pk, self.window)
+            entry.add(delta, value, coordinator, change_log)
+            return entry.available, entry.status
+
+    def _schedule(self, resource_id, delay):
+        timer = threading.Timer(delay, self._flush_and_close, args=(resource_id,))
+        timer.daemon = True
+        timer.start()
+
+    def peek(self, resource_id):
+        """Latest ``(available, status)`` not yet visible in the database"""
+        entry = self._pending.get(resource_id) or self._flushing.get(resource_id)
+        if entry is None:
+            return None
+        return entry.available, entry.status
+
+    def flush(self, resource_id=None):
+        """Write pending changes now (all resources when no id is given)"""
+        ids = [resource_id] if resource_id is not None else list(self._pending)
+        for rid in ids:
+            with self._lock:
+                entry = self._pending.pop(rid, None)
+                if entry is None:
+                    continue
+                self._flushing[rid] = entry
+            committed = []
+
+            def replay(available, capacity):
+                # Runs inside the write's transaction; tells a failure
+                # after the commit (journal, snapshots) from a lost write
+                transaction.on_commit(lambda: committed.append(True), using=shards.db())
+                return entry.replay(available, capacity)
+
+            try:
+                change_log = entry.change_log
+                if entry.count > 1:
+                    names = ', '.join(user.username for user in entry.coordinators)
+                    change_log = f'{change_log} (coalesced {entry.count} updates by {names})'
+                # Timer threads have no shard selected; the burst is
+                # replayed on the locked row so a write from another
+                # worker meanwhile is kept
+                with shards.use_for_id(rid):
+                    _apply(rid, replay, entry.coordinator, change_log)
+            except Resource.DoesNotExist:
+                logger.error('Dropped %d coalesced capacity updates for deleted resource %s', entry.count, rid)
+            except Exception:
+                if committed:
+                    logger.exception('Coalesced capacity write for resource %s committed, but a later step failed', rid)
+                else:
+                    logger.exception('Coalesced capacity write for resource %s failed; retrying', rid)
+                    self._retry(rid, entry)
+            finally:
+                with self._lock:
+                    if self._flushing.get(rid) is entry:
+                        del self._flushing[rid]
+
+    def _retry(self, resource_id, entry):
+        entry.failures += 1
+        with self._lock:
+            later = self._pending.get(resource_id)
+            if later is not None:
+                # Its own timer writes both
+                later.follow(entry)
+                return
+            self._pending[resource_id] = entry
+        self._schedule(resource_id, min(self.window * 2 ** entry.failures, RETRY_MAX_DELAY))
+
+    def _flush_and_close(self, resource_id):
+        try:
+            self.flush(resource_id)
+        finally:
+            connections.close_all()
+
+
+coalescer = CapacityCoalescer(getattr(settings, 'CAPACITY_COALESCE_WINDOW', 0))
+atexit.register(coalescer.flush)
+
+
+def submit_capacity_delta(resource, delta, coordinator, change_log):
+    """Apply a delta now, or coalesce it when coalescing is enabled"""
+    if coalescer.enabled:
+        coalescer.submit(resource, coordinator, change_log, delta=delta)
+    else:
+        apply_capacity_delta(resource.pk, delta, coordinator, change_log)
+
+
+def submit_available_capacity(resource, value, coordinator, change_log):
+    """Set an absolute value now, or coalesce it when coalescing is enabled"""
+    if coalescer.enabled:
+        coalescer.submit(resource, coordinator, change_log, value=value)
+    else:
+        set_available_capacity(resource.pk, value, coordinator, change_log)
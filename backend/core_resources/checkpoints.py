@@ -0,0 +1,164 @@
+"""Point-in-time reconstruction of resource capacity.
+
+``checkpoint_capacity`` periodically records every resource's available
+capacity and status. The state at an earlier moment is the nearest
+checkpoint before it with the audit rows in between replayed on top, so
+the cost of a lookup depends on the checkpoint interval rather than on
+how long ago the moment was. A page of resources is rebuilt with a
+fixed number of queries: its checkpoint entries, the audit rows in
+between, and a lookup for resources the checkpoint does not cover.
+"""
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import shards
+from .archive import archived_by_resource
+from .models import CapacityCheckpoint, CapacityCheckpointEntry, Resource, ResourceUpdate
+
+CHECKPOINT_CHUNK_SIZE = 5000
+# Archive bounds are half-open; this makes the end inclusive
+_INCLUSIVE = timedelta(microseconds=1)
+
+
+def parse_as_of(params):
+    """The ``as_of`` query parameter as an aware datetime, or ``None``"""
+    value = params.get('as_of')
+    if not value:
+        return None
+    as_of = parse_datetime(value)
+    if as_of is None:
+        raise ValueError('as_of must be an ISO 8601 timestamp')
+    if timezone.is_naive(as_of):
+        as_of = timezone.make_aware(as_of)
+    return as_of
+
+
+def take_checkpoint():
+    taken_at = timezone.now()
+    with transaction.atomic(using=shards.db()):
+        checkpoint = CapacityCheckpoint.objects.create(taken_at=taken_at)
+        rows = Resource.objects.values_list('id', 'available_capacity', 'status').iterator(
+            chunk_size=CHECKPOINT_CHUNK_SIZE
+        )
+        while chunk := list(islice(rows, CHECKPOINT_CHUNK_SIZE)):
+            CapacityCheckpointEntry.objects.bulk_create([
+                CapacityCheckpointEntry(
+                    checkpoint=checkpoint, resource_id=pk, available_capacity=available, status=status,
+                )
+                for pk, available, status in chunk
+            ])
+    _thin(taken_at - timedelta(days=settings.AUDIT_RETENTION_DAYS))
+    return checkpoint
+
+
+def _thin(cutoff):
+    """Keep only the first checkpoint of each day before ``cutoff``"""
+    days, drop = set(), []
+    for pk, taken_at in CapacityCheckpoint.objects.filter(taken_at__lt=cutoff).order_by(
+        'taken_at'
+    ).values_list('id', 'taken_at'):
+        day = timezone.localdate(taken_at)
+        if day in days:
+            drop.append(pk)
+        days.add(day)
+    CapacityCheckpoint.objects.filter(id__in=drop).delete()
+
+
+def _next_status(status, available):
+    """Status after a capacity update (mirrors ``capacity.status_for``)"""
+    if available == 0:
+        return 'full'
+    if status == 'full':
+        return 'open'
+    return status
+
+
+def _updates_between(resource_ids, start, end):
+    """``{resource_id: [new_capacity, ...]}`` of audit rows in ``[start, end]``, oldest first"""
+    merged = {
+        resource_id: [(row['timestamp'], row['id'], row['new_capacity']) for row in rows]
+        for resource_id, rows in archived_by_resource(resource_ids, start, end + _INCLUSIVE).items()
+    }
+    for resource_id, timestamp, row_id, value in ResourceUpdate.objects.filter(
+        resource_id__in=resource_ids, timestamp__gte=start, timestamp__lte=end
+    ).values_list('resource_id', 'timestamp', 'id', 'new_capacity'):
+        merged.setdefault(resource_id, []).append((timestamp, row_id, value))
+    values = {}
+    for resource_id, rows in merged.items():
+        rows.sort()
+        previous_id = None
+        for _, row_id, value in rows:
+            # A row can be in both while an archive run is cleaning up
+            if row_id != previous_id:
+                values.setdefault(resource_id, []).append(value)
+            previous_id = row_id
+    return values
+
+
+def _seek(resources, as_of):
+    """State of resources no checkpoint covers, from the audit rows around ``as_of``"""
+    updates = ResourceUpdate.objects.filter(resource_id=OuterRef('pk'))
+    before = updates.filter(timestamp__lte=as_of).order_by('-timestamp', '-id').values('new_capacity')[:1]
+    after = updates.filter(timestamp__gt=as_of).order_by('timestamp', 'id').values('previous_capacity')[:1]
+    live = {
+        pk: (last_before, first_after)
+        for pk, last_before, first_after in Resource.objects.filter(pk__in=[r.pk for r in resources]).annotate(
+            before=Subquery(before), after=Subquery(after)
+        ).values_list('pk', 'before', 'after')
+    }
+    unknown = [pk for pk, (last_before, _) in live.items() if last_before is None]
+    archived_before = archived_by_resource(unknown, None, as_of + _INCLUSIVE) if unknown else {}
+    unknown = [pk for pk in unknown if pk not in archived_before]
+    archived_after = archived_by_resource(unknown, as_of + _INCLUSIVE) if unknown else {}
+
+    result = {}
+    for resource in resources:
+        last_before, first_after = live.get(resource.pk, (None, None))
+        if last_before is not None:
+            row = last_before
+        elif resource.pk in archived_before:
+            row = archived_before[resource.pk][-1]['new_capacity']
+        elif resource.pk in archived_after:
+            # Nothing recorded yet: the value before the first later update
+            row = archived_after[resource.pk][0]['previous_capacity']
+        else:
+            row = first_after
+        if row is None:
+            result[resource.pk] = (resource.available_capacity, resource.status)
+        else:
+            result[resource.pk] = (row, _next_status(resource.status, row))
+    return result
+
+
+def capacity_as_of(resources, as_of):
+    """``{resource_id: (available_capacity, status)}`` at ``as_of``"""
+    resources = list(resources)
+    checkpoint = CapacityCheckpoint.objects.filter(taken_at__lte=as_of).values_list(
+        'id', 'taken_at'
+    ).first()
+    saved = {}
+    if checkpoint:
+        saved = {
+            resource_id: (available, current_status)
+            for resource_id, available, current_status in CapacityCheckpointEntry.objects.filter(
+                checkpoint_id=checkpoint[0], resource_id__in=[resource.pk for resource in resources]
+            ).values_list('resource_id', 'available_capacity', 'status')
+        }
+
+    result = {}
+    if saved:
+        replay = _updates_between(list(saved), checkpoint[1], as_of)
+        for resource_id, (available, current_status) in saved.items():
+            for value in replay.get(resource_id, ()):
+                available, current_status = value, _next_status(current_status, value)
+            result[resource_id] = (available, current_status)
+    missing = [resource for resource in resources if resource.pk not in result]
+    if missing:
+        result.update(_seek(missing, as_of))
+    return result
@@ -0,0 +1,309 @@
+"""Coverage grids: distance from each cell of a region to the nearest open resource.
+
+A region is rasterized into square cells on an equirectangular
+projection centred on it, which is accurate to well under 1% at city and
+district scale. Qualifying resources are bucketed into a coarse spatial
+index; a build searches outward ring by ring once per index bucket and
+then compares each cell against that bucket's few candidates only.
+
+Grids are cached per process for each (region, types, status, cell
+size). On every read, resources whose ``updated_at`` moved since the
+last sync are applied incrementally: a new site only lowers distances
+within its search radius, and a removed or moved site only forces the
+cells it was nearest to be searched again.
+"""
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Resource
+from .snapshots import region_key
+
+KM_PER_DEGREE = 6371 * math.pi / 180
+MAX_DISTANCE_KM = 50
+MAX_CELLS = 250000
+CACHE_SIZE = 16
+DEFAULT_TYPES = ('hospital', 'shelter')
+# Overlap between syncs, for transactions that commit after their
+# updated_at timestamp; re-applying a change is harmless
+SYNC_OVERLAP = timedelta(seconds=60)
+
+INFINITY = float('inf')
+
+
+class CoverageError(ValueError):
+    pass
+
+
+def qualifies(status_filter, row):
+    if row['status'] != status_filter:
+        return False
+    # An open resource only covers an area if it can take people
+    return status_filter != 'open' or row['available_capacity'] > 0
+
+
+class CoverageGrid:
+    def __init__(self, region, types, status_filter, cell_km):
+        self.region = region_key(region)
+        self.types = types
+        self.status_filter = status_filter
+        self.cell_km = cell_km
+        self.lock = threading.Lock()
+        self.synced_at = None
+
+        names = [
+            name for name in Resource.objects.values_list('region', flat=True).order_by().distinct()
+            if region_key(name) == self.region
+        ]
+        bounds = Resource.objects.filter(region__in=names).aggregate(
+            south=Min('latitude'), north=Max('latitude'), west=Min('longitude'), east=Max('longitude'),
+        )
+        if bounds['south'] is None:
+            raise CoverageError(f'No resources in region "{region}"')
+
+        self.lat0 = float(bounds['south'] + bounds['north']) / 2
+        self.lon0 = float(bounds['west'] + bounds['east']) / 2
+        self.km_per_lon = KM_PER_DEGREE * math.cos(math.radians(self.lat0))
+        # One empty cell of margin on every side
+        west, south = self.project(float(bounds['south']), float(bounds['west']))
+        east, north = self.project(float(bounds['north']), float(bounds['east']))
+        self.x_min = west - cell_km
+        self.y_min = south - cell_km
+        self.cols = int((east - west) / cell_km) + 3
+        self.rows = int((north - south) / cell_km) + 3
+        if self.rows * self.cols > MAX_CELLS:
+            raise CoverageError(
+                f'Grid would have {self.rows * self.cols} cells (max {MAX_CELLS}); use a larger cell_km'
+            )
+
+        self.bucket_km = max(cell_km * 4, 2.0)
+        self.buckets = {}
+        self.sites = {}
+        self.distance = array('d', [INFINITY]) * (self.rows * self.cols)
+        self.nearest = array('q', [-1]) * (self.rows * self.cols)
+        # Cell centre coordinates, reused by every distance computation
+        self.xs = [self.x_min + (col + 0.5) * cell_km for col in range(self.cols)]
+        self.ys = [self.y_min + (row + 0.5) * cell_km for row in range(self.rows)]
+
+    def project(self, lat, lon):
+        return (lon - self.lon0) * self.km_per_lon, (lat - self.lat0) * KM_PER_DEGREE
+
+    def _bucket(self, x, y):
+        return int(math.floor(x / self.bucket_km)), int(math.floor(y / self.bucket_km))
+
+    def _candidates(self):
+        """Resources of the grid's types that could be nearest to some cell"""
+        margin_lat = MAX_DISTANCE_KM / KM_PER_DEGREE
+        margin_lon = MAX_DISTANCE_KM / self.km_per_lon
+        south = self.lat0 + self.y_min / KM_PER_DEGREE
+        west = self.lon0 + self.x_min / self.km_per_lon
+        north = south + self.rows * self.cell_km / KM_PER_DEGREE
+        east = west + self.cols * self.cell_km / self.km_per_lon
+        return Resource.objects.filter(
+            type__in=self.types,
+            latitude__range=(south - margin_lat, north + margin_lat),
+            longitude__range=(west - margin_lon, east + margin_lon),
+        )
+
+    def _insert(self, resource_id, x, y):
+        self.sites[resource_id] = (x, y)
+        self.buckets.setdefault(self._bucket(x, y), []).append(resource_id)
+
+    def _discard(self, resource_id):
+        x, y = self.sites.pop(resource_id)
+        key = self._bucket(x, y)
+        self.buckets[key].remove(resource_id)
+        if not self.buckets[key]:
+            del self.buckets[key]
+        return x, y
+
+    def _search(self, x, y, limit=MAX_DISTANCE_KM):
+        """Nearest site within ``limit`` km of ``(x, y)``: ``(distance, id)``"""
+        bx, by = self._bucket(x, y)
+        best, best_id = INFINITY, -1
+        for ring in range(int(limit / self.bucket_km) + 2):
+            # Every site in this ring is at least (ring - 1) buckets away
+            if best <= (ring - 1) * self.bucket_km:
+                break
+            for i in range(bx - ring, bx + ring + 1):
+                for j in range(by - ring, by + ring + 1):
+                    if ring and bx - ring < i < bx + ring and by - ring < j < by + ring:
+                        continue
+                    for site in self.buckets.get((i, j), ()):
+                        sx, sy = self.sites[site]
+                        d = math.hypot(sx - x, sy - y)
+                        if d < best:
+                            best, best_id = d, site
+        if best > limit:
+            return INFINITY, -1
+        return best, best_id
+
+    def _sites_within(self, x, y, radius):
+        bx, by = self._bucket(x, y)
+        reach = int(radius / self.bucket_km) + 1
+        found = []
+        for i in range(bx - reach, bx + reach + 1):
+            for j in range(by - reach, by + reach + 1):
+                for site in self.buckets.get((i, j), ()):
+                    sx, sy = self.sites[site]
+                    if math.hypot(sx - x, sy - y) <= radius:
+                        found.append((sx, sy, site))
+        return found
+
+    def _window(self, x, y):
+        """Row and column ranges of cells within MAX_DISTANCE_KM of ``(x, y)``"""
+        reach = MAX_DISTANCE_KM / self.cell_km
+        col = (x - self.x_min) / self.cell_km
+        row = (y - self.y_min) / self.cell_km
+        return (
+            range(max(0, int(row - reach)), min(self.rows, int(row + reach) + 1)),
+            range(max(0, int(col - reach)), min(self.cols, int(col + reach) + 1)),
+        )
+
+    def build(self):
+        synced_at = timezone.now()
+        for row in self._candidates().values('id', 'latitude', 'longitude', 'status', 'available_capacity'):
+            if qualifies(self.status_filter, row):
+                self._insert(row['id'], *self.project(float(row['latitude']), float(row['longitude'])))
+
+        # Search once per index bucket rather than once per cell: any cell
+        # in a bucket has its nearest site within (d0 + bucket diagonal) of
+        # the bucket centre, where d0 is the centre's own nearest distance.
+        if not self.sites:
+            self.synced_at = synced_at
+            return
+        b = self.bucket_km
+        diagonal = b * math.sqrt(2)
+        cols_by_bucket, rows_by_bucket = {}, {}
+        for c, x in enumerate(self.xs):
+            cols_by_bucket.setdefault(int(math.floor(x / b)), []).append(c)
+        for r, y in enumerate(self.ys):
+            rows_by_bucket.setdefault(int(math.floor(y / b)), []).append(r)
+
+        for j, rows in rows_by_bucket.items():
+            cy = (j + 0.5) * b
+            for i, cols in cols_by_bucket.items():
+                cx = (i + 0.5) * b
+                d0, _ = self._search(cx, cy, MAX_DISTANCE_KM + diagonal)
+                if d0 == INFINITY:
+                    continue
+                candidates = self._sites_within(cx, cy, d0 + diagonal)
+                for r in rows:
+                    y = self.ys[r]
+                    base = r * self.cols
+                    for c in cols:
+                        x = self.xs[c]
+                        best, best_id = INFINITY, -1
+                        for sx, sy, site in candidates:
+                            d = (sx - x) ** 2 + (sy - y) ** 2
+                            if d < best:
+                                best, best_id = d, site
+                        best = math.sqrt(best)
+                        if best <= MAX_DISTANCE_KM:
+                            self.distance[base + c], self.nearest[base + c] = best, best_id
+        self.synced_at = synced_at
+
+    def _add(self, resource_id, x, y):
+        self._insert(resource_id, x, y)
+        rows, cols = self._window(x, y)
+        dx2 = [(self.xs[c] - x) ** 2 for c in cols]
+        limit = MAX_DISTANCE_KM ** 2
+        for r in rows:
+            dy2 = (self.ys[r] - y) ** 2
+            base = r * self.cols
+            for c, d2 in zip(cols, dx2):
+                d2 += dy2
+                if d2 <= limit:
+                    d = math.sqrt(d2)
+                    if d < self.distance[base + c]:
+                        self.distance[base + c], self.nearest[base + c] = d, resource_id
+
+    def _remove(self, resource_id):
+        x, y = self._discard(resource_id)
+        rows, cols = self._window(x, y)
+        for r in rows:
+            base = r * self.cols
+            for c in cols:
+                if self.nearest[base + c] == resource_id:
+                    self.distance[base + c], self.nearest[base + c] = self._search(self.xs[c], self.ys[r])
+
+    def sync(self):
+        """Apply resource changes since the last sync; returns the number applied"""
+        now = timezone.now()
+        candidates = self._candidates()
+        changed = candidates.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP).values(
+            'id', 'latitude', 'longitude', 'status', 'available_capacity'
+        )
+        applied = 0
+        for row in changed:
+            position = self.project(float(row['latitude']), float(row['longitude']))
+            current = self.sites.get(row['id'])
+            keep = qualifies(self.status_filter, row)
+            if current is not None and (not keep or current != position):
+                self._remove(row['id'])
+                applied += 1
+            if keep and current != position:
+                self._add(row['id'], *position)
+                applied += 1
+        # Deleted resources (or ones moved out of range) leave no updated_at trail
+        present = set(candidates.filter(id__in=list(self.sites)).values_list('id', flat=True))
+        for resource_id in set(self.sites) - present:
+            self._remove(resource_id)
+            applied += 1
+        self.synced_at = now
+        return applied
+
+    def as_dict(self, threshold_km=None):
+        distances = [None if d == INFINITY else round(d, 2) for d in self.distance]
+        data = {
+            'region': self.region,
+            'types': list(self.types),
+            'status': self.status_filter,
+            'cell_km': self.cell_km,
+            'max_distance_km': MAX_DISTANCE_KM,
+            'origin': {
+                'latitude': round(self.lat0 + self.y_min / KM_PER_DEGREE, 6),
+                'longitude': round(self.lon0 + self.x_min / self.km_per_lon, 6),
+            },
+            'lat_step': self.cell_km / KM_PER_DEGREE,
+            'lon_step': self.cell_km / self.km_per_lon,
+            'rows': self.rows,
+            'cols': self.cols,
+            'sites': len(self.sites),
+            'synced_at': self.synced_at,
+            'distances': distances,
+        }
+        if threshold_km is not None:
+            data['threshold_km'] = threshold_km
+            data['uncovered_cells'] = sum(1 for d in self.distance if d > threshold_km)
+        return data
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+cache_stats = {'hit': 0, 'miss': 0}  # for /metrics
+
+
+def get_grid(region, types=DEFAULT_TYPES, status_filter='open', cell_km=1.0):
+    """Cached, freshly synced coverage grid (rows run south to north)"""
+    key = (region_key(region), tuple(sorted(types)), status_filter, cell_km)
+    with _cache_lock:
+        grid = _cache.get(key)
+        cache_stats['hit' if grid is not None else 'miss'] += 1
+        if grid is None:
+            grid = CoverageGrid(region, key[1], status_filter, cell_km)
+            _cache[key] = grid
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        _cache.move_to_end(key)
+    with grid.lock:
+        if grid.synced_at is None:
+            grid.build()
+        else:
+            grid.sync()
+    return grid
@@ -0,0 +1,204 @@
+"""Near-duplicate detection for resources.
+
+Two resources are candidates when they have the same type, lie within
+``DEDUP_RADIUS_M`` of each other and their normalized names share enough
+character trigrams (Dice coefficient of at least ``DEDUP_THRESHOLD``).
+
+A new resource is checked with one bounding-box query. The batch scan
+streams the table in latitude order into a grid of cells one radius
+wide, so each resource is compared only with the few others in its
+neighbouring cells, and only the two latitude bands around the current
+row are kept in memory. Trigram sets are built lazily, for resources
+that actually have a neighbour.
+"""
+import math
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import transaction
+
+from . import audit, shards
+from .archive import archive_resource
+from .capacity import coalescer
+from .coverage import KM_PER_DEGREE
+from .models import DuplicateCandidate, Resource
+from .nearby import bounding_box, haversine_distance
+
+STOPWORDS = {'the', 'of', 'and', 'at', 'for'}
+ABBREVIATIONS = {
+    'govt': 'government',
+    'hosp': 'hospital',
+    'dist': 'district',
+    'ctr': 'centre',
+    'center': 'centre',
+}
+# Fields a merge copies from the duplicate when the kept resource has none
+FILL_FIELDS = ['description', 'address', 'helpline', 'image', 'external_id']
+FLAG_BATCH_SIZE = 1000
+
+
+def normalize(name):
+    text = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    words = re.findall(r'[a-z0-9]+', text)
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words if word not in STOPWORDS)
+
+
+def trigrams(name):
+    padded = f'  {normalize(name)} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a, b):
+    """Dice coefficient of two trigram sets"""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def candidates_for(resource, radius_m=None, threshold=None):
+    """Other resources ``resource`` likely duplicates: ``[(id, score, metres)]``"""
+    radius_m = radius_m or settings.DEDUP_RADIUS_M
+    threshold = threshold or settings.DEDUP_THRESHOLD
+    lat, lon = float(resource.latitude), float(resource.longitude)
+    south, north, west, east = bounding_box(lat, lon, radius_m / 1000)
+    queryset = Resource.objects.filter(type=resource.type, latitude__range=(south, north))
+    if -180 < west and east < 180:
+        queryset = queryset.filter(longitude__range=(west, east))
+
+    mine = trigrams(resource.name)
+    found = []
+    for pk, name, latitude, longitude in queryset.exclude(pk=resource.pk).values_list(
+        'id', 'name', 'latitude', 'longitude'
+    ):
+        metres = haversine_distance(lat, lon, latitude, longitude) * 1000
+        if metres <= radius_m:
+            score = similarity(mine, trigrams(name))
+            if score >= threshold:
+                found.append((pk, score, metres))
+    return found
+
+
+def flag(pairs):
+    """Record ``(resource_id, duplicate_of_id, score, metres)`` pairs.
+
+    Pairs already on record keep their status, so dismissed ones stay
+    dismissed.
+    """
+    DuplicateCandidate.objects.bulk_create(
+        [
+            DuplicateCandidate(resource_id=a, duplicate_of_id=b, score=round(score, 3), distance_m=round(metres, 1))
+            for a, b, score, metres in pairs
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def flag_resource(resource):
+    """Flag likely duplicates of a newly created resource; returns their ids"""
+    found = candidates_for(resource)
+    flag([(resource.pk, pk, score, metres) for pk, score, metres in found])
+    return [pk for pk, _, _ in found]
+
+
+def scan(radius_m=None, threshold=None, queryset=None):
+    """Yield ``(newer_id, older_id, score, metres)`` for every near-duplicate pair"""
+    radius_m = radius_m or settings.DEDUP_RADIUS_M
+    threshold = threshold or settings.DEDUP_THRESHOLD
+    if queryset is None:
+        queryset = Resource.objects.all()
+    band_deg = radius_m / 1000 / KM_PER_DEGREE
+    # Slightly wider columns absorb the change of scale within a band
+    col_deg = band_deg * 1.01
+    scales = {}
+    cells = {}
+    grams = {}
+    current = None
+
+    def scale(band):
+        if band not in scales:
+            scales[band] = math.cos(math.radians(min((band + 0.5) * band_deg, 89.99)))
+        return scales[band]
+
+    def grams_for(pk, name):
+        if pk not in grams:
+            grams[pk] = trigrams(name)
+        return grams[pk]
+
+    rows = queryset.order_by('latitude', 'id').values_list(
+        'id', 'type', 'name', 'latitude', 'longitude'
+    ).iterator(chunk_size=5000)
+    for pk, resource_type, name, lat, lon in rows:
+        lat, lon = float(lat), float(lon)
+        band = math.floor(lat / band_deg)
+        if band != current:
+            # Rows more than one band south can no longer have neighbours
+            for key in [key for key in cells if key[1] < band - 1]:
+                for row in cells.pop(key):
+                    grams.pop(row[0], None)
+            for old in [old for old in scales if old < band - 1]:
+                del scales[old]
+            current = band
+
+        for near_band in (band - 1, band):
+            col = math.floor(lon * scale(near_band) / col_deg)
+            for near_col in (col - 1, col, col + 1):
+                for other, other_lat, other_lon, other_name in cells.get((resource_type, near_band, near_col), ()):
+                    metres = haversine_distance(lat, lon, other_lat, other_lon) * 1000
+                    if metres > radius_m:
+                        continue
+                    score = similarity(grams_for(pk, name), grams_for(other, other_name))
+                    if score >= threshold:
+                        yield max(pk, other), min(pk, other), score, metres
+
+        key = (resource_type, band, math.floor(lon * scale(band) / col_deg))
+        cells.setdefault(key, []).append((pk, lat, lon, name))
+
+
+def flag_all(radius_m=None, threshold=None):
+    """Run the batch scan and record every pair; returns the number found"""
+    found, batch = 0, []
+    for pair in scan(radius_m, threshold):
+        batch.append(pair)
+        if len(batch) >= FLAG_BATCH_SIZE:
+            flag(batch)
+            found += len(batch)
+            batch = []
+    flag(batch)
+    return found + len(batch)
+
+
+def merge(duplicate, into, merged_by):
+    """Fold ``duplicate`` into ``into`` and delete it.
+
+    Empty fields on the kept resource are filled from the duplicate, and
+    verification and coordinator carry over when it lacks them. Capacity
+    stays as recorded on ``into``. The duplicate's audit rows are moved to
+    the archive under its own id rather than mixed into ``into``'s
+    history, which gets one audit row noting the merge.
+    """
+    for pk in (duplicate.pk, into.pk):
+        coalescer.flush(pk)
+    audit.flush()
+    archive_resource(duplicate.pk)
+    with transaction.atomic(using=shards.db()):
+        # Locked and reloaded: capacity writes may have landed since it was read
+        into = Resource.objects.select_for_update().get(pk=into.pk)
+        changed = []
+        for field in FILL_FIELDS:
+            if not getattr(into, field) and getattr(duplicate, field):
+                setattr(into, field, getattr(duplicate, field))
+                changed.append(field)
+        if duplicate.verified and not into.verified:
+            into.verified, into.verified_by = True, duplicate.verified_by
+            changed += ['verified', 'verified_by']
+        if into.coordinator_id is None and duplicate.coordinator_id is not None:
+            into.coordinator_id = duplicate.coordinator_id
+            changed.append('coordinator')
+        note = f'Merged duplicate resource #{duplicate.pk} ({duplicate.name})'
+        # external_id is unique, so the duplicate has to go first
+        duplicate.delete()
+        if changed:
+            into.save(update_fields=changed + ['updated_at'])
+        audit.record(into.pk, merged_by, note, into.available_capacity, into.available_capacity)
+    return into
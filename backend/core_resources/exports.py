@@ -0,0 +1,134 @@
+"""Streaming resource exports (CSV, NDJSON, GeoJSON).
+
+Each exporter is a generator of text chunks meant for a
+``StreamingHttpResponse``, so memory use stays flat however large the
+resources table gets.
+"""
+import csv
+import json
+
+from . import shards
+from .models import User
+
+EXPORT_CHUNK_SIZE = 2000
+
+FIELDS = [
+    'pk', 'external_id', 'name', 'type', 'status', 'latitude', 'longitude', 'region',
+    'capacity', 'available_capacity', 'verified',
+    'coordinator__first_name', 'coordinator__last_name', 'coordinator__username',
+]
+
+SHARD_FIELDS = [field for field in FIELDS if not field.startswith('coordinator__')] + ['coordinator_id']
+
+CSV_HEADER = [
+    'Name', 'Type', 'Status', 'Latitude', 'Longitude', 'Region',
+    'Capacity', 'Available', 'Verified', 'Coordinator',
+]
+
+
+class Echo:
+    """File-like object whose write() just returns the value (for csv.writer)"""
+
+    def write(self, value):
+        return value
+
+
+def iter_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of value dicts from ``queryset`` in primary-key keyset chunks.
+
+    Keyset pagination keeps every query small and bounded on all backends;
+    MySQL drivers otherwise buffer the full result of ``iterator()`` on
+    the client.
+    """
+    sharded = shards.enabled()
+    # Users are not on the shards, so coordinator names cannot be joined there
+    queryset = queryset.order_by('pk').values(*(SHARD_FIELDS if sharded else FIELDS))
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        if sharded:
+            _add_coordinators(rows)
+        yield rows
+        last_pk = rows[-1]['pk']
+
+
+def _add_coordinators(rows):
+    users = User.objects.in_bulk({row['coordinator_id'] for row in rows if row['coordinator_id']})
+    for row in rows:
+        user = users.get(row.pop('coordinator_id'))
+        row['coordinator__first_name'] = user.first_name if user else None
+        row['coordinator__last_name'] = user.last_name if user else None
+        row['coordinator__username'] = user.username if user else None
+
+
+def iter_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield value dicts from ``queryset`` in id order, reading every shard in parallel"""
+    for rows in shards.stream(iter_chunks, queryset, chunk_size):
+        yield from rows
+
+
+def _coordinator(row):
+    full_name = f"{row['coordinator__first_name'] or ''} {row['coordinator__last_name'] or ''}".strip()
+    return full_name or ''
+
+
+def _properties(row):
+    return {
+        'id': row['pk'],
+        'external_id': row['external_id'],
+        'name': row['name'],
+        'type': row['type'],
+        'status': row['status'],
+        'region': row['region'],
+        'capacity': row['capacity'],
+        'available_capacity': row['available_capacity'],
+        'verified': row['verified'],
+        'coordinator': _coordinator(row) or row['coordinator__username'],
+    }
+
+
+def stream_csv(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in iter_rows(queryset):
+        yield writer.writerow([
+            row['name'], row['type'], row['status'], row['latitude'], row['longitude'],
+            row['region'], row['capacity'], row['available_capacity'], row['verified'],
+            _coordinator(row),
+        ])
+
+
+def stream_ndjson(queryset):
+    for row in iter_rows(queryset):
+        record = _properties(row)
+        record['latitude'] = float(row['latitude'])
+        record['longitude'] = float(row['longitude'])
+        yield json.dumps(record) + '\n'
+
+
+def stream_geojson(queryset):
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ''
+    for row in iter_rows(queryset):
+        feature = {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [float(row['longitude']), float(row['latitude'])],
+            },
+            'properties': _properties(row),
+        }
+        yield separator + json.dumps(feature)
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+EXPORTERS = {
+    # format: (generator, content type, file name)
+    'csv': (stream_csv, 'text/csv', 'resources.csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson', 'resources.ndjson'),
+    'geojson': (stream_geojson, 'application/geo+json', 'resources.geojson'),
+}
@@ -0,0 +1,153 @@
+"""Capacity history reads and chart downsampling.
+
+History is read in ``(timestamp, id)`` keyset chunks over the
+``(resource, timestamp)`` index and downsampled with
+Largest-Triangle-Three-Buckets while it streams, so a month of updates
+for a busy hospital never sits in memory at once. Rows moved out by
+the retention job are read back from the archive files and merged in.
+"""
+import heapq
+from itertools import islice
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .archive import count_archived, iter_archived
+from .models import ResourceUpdate
+
+HISTORY_CHUNK_SIZE = 5000
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+
+
+def _range(resource_id, start, end):
+    queryset = ResourceUpdate.objects.filter(resource_id=resource_id)
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+    return queryset
+
+
+def parse_bounds(params):
+    """Read optional ``start``/``end`` query parameters; ``end`` defaults to now"""
+    bounds = []
+    for name in ('start', 'end'):
+        value = params.get(name)
+        if not value:
+            bounds.append(None)
+            continue
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f'{name} must be an ISO 8601 timestamp')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        bounds.append(parsed)
+    start, end = bounds
+    # Pin the upper bound so the count and the streamed rows agree
+    end = end or timezone.now()
+    if start is not None and start > end:
+        raise ValueError('start must not be after end')
+    return start, end
+
+
+def count_history(resource_id, start=None, end=None):
+    return _range(resource_id, start, end).count() + count_archived(resource_id, start, end)
+
+
+def _iter_live(resource_id, start, end, chunk_size):
+    queryset = _range(resource_id, start, end).order_by('timestamp', 'id').values_list(
+        'timestamp', 'id', 'new_capacity'
+    )
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = queryset.filter(
+                Q(timestamp__gt=last[0]) | Q(timestamp=last[0], id__gt=last[1])
+            )
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][:2]
+
+
+def iter_history(resource_id, start=None, end=None, chunk_size=HISTORY_CHUNK_SIZE):
+    """Yield ``(timestamp, available_capacity)`` oldest first, archive included"""
+    archived = (
+        (row['timestamp'], row['id'], row['new_capacity'])
+        for row in iter_archived(resource_id, start, end)
+    )
+    live = _iter_live(resource_id, start, end, chunk_size)
+    previous_id = None
+    for timestamp, row_id, value in heapq.merge(archived, live):
+        # A row can be in both while an archive run is cleaning up
+        if row_id != previous_id:
+            yield timestamp, value
+        previous_id = row_id
+
+
+def lttb(points, total, threshold):
+    """Downsample an iterator of ``(timestamp, value)`` to ``threshold`` points.
+
+    ``total`` is the number of points the iterator will produce. Only the
+    bucket being decided and the one after it are held in memory.
+    """
+    if threshold >= total or threshold < 3:
+        yield from points
+        return
+
+    points = iter(points)
+    every = (total - 2) / (threshold - 2)
+
+    def x(point):
+        return point[0].timestamp()
+
+    def read_bucket(index):
+        # Bucket ``index`` (1-based) covers source positions [lo, hi)
+        lo = int((index - 1) * every) + 1
+        hi = min(int(index * every) + 1, total - 1)
+        return list(islice(points, hi - lo))
+
+    selected = next(points, None)
+    if selected is None:
+        return
+    yield selected
+    current = read_bucket(1)
+    last = None
+    for index in range(1, threshold - 1):
+        if index < threshold - 2:
+            following = read_bucket(index + 1)
+        else:
+            following = []
+        if following:
+            avg_x = sum(x(p) for p in following) / len(following)
+            avg_y = sum(p[1] for p in following) / len(following)
+        else:
+            # Final bucket: the next anchor is the last point. Rows added
+            # since the count was taken are absorbed rather than dropped.
+            for last in points:
+                pass
+            if last is None:
+                last = current.pop() if current else None
+            if last is None:
+                return
+            avg_x, avg_y = x(last), last[1]
+        if not current:
+            break
+
+        ax, ay = x(selected), selected[1]
+        best, best_area = current[0], -1.0
+        for point in current:
+            area = abs((ax - avg_x) * (point[1] - ay) - (ax - x(point)) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = point, area
+        selected = best
+        yield selected
+        current = following
+        if not following:
+            break
+    if last is not None:
+        yield last
@@ -0,0 +1,159 @@
+"""Resized, metadata-free variants of resource photos.
+
+Uploads are processed by the ``process_resource_image`` background job.
+Files are stored under the SHA-256 of the uploaded bytes
+(``images/ab/abcd.../``), so identical uploads share one set of files and
+are processed once. Every size in ``IMAGE_VARIANTS`` is written as WebP
+and as JPEG (PNG when the image has transparency). The original is
+re-encoded at full size, which drops EXIF (including GPS), XMP and
+comments, and replaces the raw upload.
+"""
+import hashlib
+import io
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import shards
+from .jobs import enqueue
+from .models import Resource
+from .snapshots import mark_dirty
+
+ROOT = 'images'
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+ORIGINAL_QUALITY = 90
+
+Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+
+
+def variants():
+    """``[(name, longest side in pixels)]`` from ``IMAGE_VARIANTS``, largest first"""
+    sizes = [item.split('=', 1) for item in settings.IMAGE_VARIANTS if '=' in item]
+    return sorted(((name.strip(), int(size)) for name, size in sizes), key=lambda item: -item[1])
+
+
+def image_dir(digest):
+    return posixpath.join(ROOT, digest[:2], digest)
+
+
+def fallback_format(resource):
+    """``'png'`` or ``'jpeg'``, matching the processed original's format"""
+    return 'png' if resource.image.name.endswith('.png') else 'jpeg'
+
+
+def variant_urls(resource):
+    """``{variant: {'webp': url, 'jpeg' or 'png': url}}``, or ``None`` until processed"""
+    if not resource.image_hash or not resource.image.name.startswith(ROOT + '/'):
+        return None
+    folder = image_dir(resource.image_hash)
+    fallback = fallback_format(resource)
+    extension = 'png' if fallback == 'png' else 'jpg'
+    return {
+        name: {
+            'webp': default_storage.url(f'{folder}/{name}.webp'),
+            fallback: default_storage.url(f'{folder}/{name}.{extension}'),
+        }
+        for name, _ in variants()
+    }
+
+
+def _encode(image, fmt):
+    out = io.BytesIO()
+    if fmt == 'webp':
+        image.save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+    elif fmt == 'png':
+        image.save(out, 'PNG', optimize=True)
+    else:
+        image.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _store(name, data):
+    if default_storage.exists(name):
+        return
+    saved = default_storage.save(name, ContentFile(data))
+    if saved != name:
+        # Another worker wrote the same content first
+        default_storage.delete(saved)
+
+
+def _load(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    # Bake the EXIF orientation into the pixels before the EXIF is dropped
+    image = ImageOps.exif_transpose(image)
+    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if transparent else 'RGB'), transparent
+
+
+def process_bytes(data):
+    """Write the original and every variant for ``data``; returns ``(digest, original name)``"""
+    digest = hashlib.sha256(data).hexdigest()
+    folder = image_dir(digest)
+    sizes = variants()
+    smallest = sizes[-1][0] if sizes else None
+    for extension in ('jpg', 'png'):
+        original = f'{folder}/original.{extension}'
+        # The smallest variant is written last, so its presence means done
+        if default_storage.exists(original) and (
+            smallest is None or default_storage.exists(f'{folder}/{smallest}.webp')
+        ):
+            return digest, original
+
+    image, transparent = _load(data)
+    fallback, extension = ('png', 'png') if transparent else ('jpeg', 'jpg')
+    original = f'{folder}/original.{extension}'
+    out = io.BytesIO()
+    if transparent:
+        image.save(out, 'PNG', optimize=True)
+    else:
+        image.save(out, 'JPEG', quality=ORIGINAL_QUALITY, optimize=True)
+    _store(original, out.getvalue())
+
+    # Each size is scaled down from the previous, larger one
+    resized = image
+    for name, size in sizes:
+        resized = resized.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        _store(f'{folder}/{name}.{extension}', _encode(resized, fallback))
+        _store(f'{folder}/{name}.webp', _encode(resized, 'webp'))
+    return digest, original
+
+
+def process_resource(resource_id):
+    """Process a resource's uploaded image; returns the content hash or ``None``"""
+    with shards.use_for_id(resource_id):
+        return _process_resource(resource_id)
+
+
+def _process_resource(resource_id):
+    resource = Resource.objects.filter(pk=resource_id).only('image', 'image_hash', 'region').first()
+    if resource is None or not resource.image:
+        return None
+    uploaded = resource.image.name
+    if uploaded.startswith(ROOT + '/'):
+        return resource.image_hash  # already processed
+
+    with resource.image.open('rb') as fh:
+        data = fh.read()
+    digest, original = process_bytes(data)
+
+    # Skip if a newer upload replaced the image while this one was processed
+    changed = Resource.objects.filter(pk=resource_id, image=uploaded).update(
+        image=original, image_hash=digest, updated_at=timezone.now(),
+    )
+    if changed:
+        if not Resource.objects.filter(image=uploaded).exists():
+            default_storage.delete(uploaded)
+        mark_dirty(resource.region)
+    return digest
+
+
+def queue(resource):
+    """Process the resource's image in a background job"""
+    return enqueue('process_resource_image', {'resource': resource.pk}, unique_key=f'resource-image:{resource.pk}')
@@ -0,0 +1,266 @@
+"""Streaming readers and batch upserts for bulk resource imports.
+
+Readers yield ``(line_number, row_dict)`` pairs without loading the whole
+file, so facility registries with hundreds of thousands of rows can be
+imported with constant memory. A row a reader cannot decode is passed on
+as an ``InvalidRow`` and rejected like any other bad row.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import shards
+from .models import Resource
+
+TYPES = {choice for choice, _ in Resource.TYPE_CHOICES}
+STATUSES = {choice for choice, _ in Resource.STATUS_CHOICES}
+
+# Columns written on update; ownership fields (coordinator, verified_by)
+# are never touched by an import.
+UPDATE_FIELDS = [
+    'name', 'type', 'description', 'latitude', 'longitude', 'address', 'region',
+    'capacity', 'available_capacity', 'status', 'contact', 'helpline', 'verified',
+    'updated_at',
+]
+
+
+class InvalidRow:
+    """Placeholder for an undecodable row; ``validate_row`` rejects it"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_csv(fh):
+    reader = csv.DictReader(fh)
+    for line, row in enumerate(reader, start=2):
+        yield line, row
+
+
+def read_ndjson(fh):
+    for line, text in enumerate(fh, start=1):
+        text = text.strip()
+        if text:
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as exc:
+                row = InvalidRow(f'invalid JSON: {exc.msg} (column {exc.colno})')
+            yield line, row
+
+
+def _feature_row(feature):
+    row = dict(feature.get('properties') or {})
+    geometry = feature.get('geometry') or {}
+    if geometry.get('type') == 'Point':
+        row['longitude'], row['latitude'] = geometry['coordinates'][:2]
+    return row
+
+
+def read_geojson(fh, chunk_size=1 << 16):
+    """Yield features of a FeatureCollection one at a time.
+
+    Only the ``features`` array is walked, decoding one feature per
+    ``raw_decode`` call, so the collection is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    eof = False
+
+    def fill():
+        nonlocal buf, eof
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf += chunk
+
+    while True:
+        start = buf.find('"features"')
+        if start >= 0 and buf.find('[', start) >= 0:
+            buf = buf[buf.find('[', start) + 1:]
+            break
+        if eof:
+            raise ValueError('No "features" array found')
+        fill()
+
+    index = 0
+    while True:
+        buf = buf.lstrip().lstrip(',').lstrip()
+        if buf.startswith(']'):
+            return
+        if not buf:
+            if eof:
+                raise ValueError('Unexpected end of GeoJSON')
+            fill()
+            continue
+        try:
+            feature, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        index += 1
+        buf = buf[end:]
+        if not isinstance(feature, dict):
+            yield index, InvalidRow('feature must be a JSON object')
+            continue
+        yield index, _feature_row(feature)
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+    'geojson': read_geojson,
+}
+
+
+def _decimal(value, low, high, field):
+    try:
+        number = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'{field} must be a number')
+    if not low <= number <= high:
+        raise ValueError(f'{field} must be between {low} and {high}')
+    return number.quantize(Decimal('0.00000001'))
+
+
+def _int(value, field):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'{field} must be an integer')
+    if number < 0:
+        raise ValueError(f'{field} cannot be negative')
+    return number
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def validate_row(row, id_field='external_id'):
+    """Return a dict of model field values, or raise ValueError"""
+    if isinstance(row, InvalidRow):
+        raise ValueError(row.error)
+    if not isinstance(row, dict):
+        raise ValueError('row must be a JSON object')
+    external_id = str(row.get(id_field) or '').strip()
+    if not external_id:
+        raise ValueError(f'{id_field} is required')
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    resource_type = str(row.get('type') or '').strip().lower()
+    if resource_type not in TYPES:
+        raise ValueError(f'type must be one of {", ".join(sorted(TYPES))}')
+    resource_status = str(row.get('status') or 'open').strip().lower()
+    if resource_status not in STATUSES:
+        raise ValueError(f'status must be one of {", ".join(sorted(STATUSES))}')
+
+    capacity = _int(row.get('capacity', 0) or 0, 'capacity')
+    available = row.get('available_capacity')
+    available = capacity if available in (None, '') else _int(available, 'available_capacity')
+    if available > capacity:
+        raise ValueError('Available capacity cannot exceed total capacity')
+
+    return {
+        'external_id': external_id[:100],
+        'name': name[:255],
+        'type': resource_type,
+        'description': str(row.get('description') or ''),
+        'latitude': _decimal(row.get('latitude'), -90, 90, 'latitude'),
+        'longitude': _decimal(row.get('longitude'), -180, 180, 'longitude'),
+        'address': str(row.get('address') or ''),
+        'region': str(row.get('region') or '').strip()[:100],
+        'capacity': capacity,
+        'available_capacity': available,
+        'status': resource_status,
+        'contact': str(row.get('contact') or '')[:15],
+        'helpline': str(row.get('helpline') or '')[:15],
+        'verified': _bool(row.get('verified', False)),
+    }
+
+
+def _upsert(values):
+    compare = [f for f in UPDATE_FIELDS if f != 'updated_at']
+    existing = {
+        row['external_id']: row
+        for row in Resource.objects.filter(external_id__in=values.keys()).values(
+            'id', 'external_id', *compare
+        )
+    }
+    to_create, to_update = [], []
+    unchanged = 0
+    now = timezone.now()
+    for external_id, fields in values.items():
+        current = existing.get(external_id)
+        if current is None:
+            to_create.append(Resource(**fields))
+        elif all(current[f] == fields[f] for f in compare):
+            # Re-imports of a registry are mostly unchanged rows; skipping
+            # them avoids bulk_update's per-row CASE expressions.
+            unchanged += 1
+        else:
+            to_update.append(Resource(id=current['id'], updated_at=now, **fields))
+    with transaction.atomic(using=shards.db()):
+        Resource.objects.bulk_create(to_create)
+        Resource.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=100)
+    return len(to_create), len(to_update), unchanged
+
+
+def import_batch(rows, id_field='external_id'):
+    """Validate and upsert one batch of ``(line, row)`` pairs.
+
+    Returns ``(created, updated, unchanged, rejected)`` where ``rejected``
+    is a list of ``(line, error)`` tuples.
+    """
+    values, lines, rejected = {}, {}, []
+    for line, row in rows:
+        try:
+            fields = validate_row(row, id_field)
+        except (ValueError, TypeError) as exc:
+            rejected.append((line, str(exc)))
+            continue
+        # Later rows win when an ID repeats inside one batch
+        values[fields['external_id']] = fields
+        lines[fields['external_id']] = line
+    if not values:
+        return 0, 0, 0, rejected
+    if not shards.enabled():
+        return (*_upsert_retrying(values), rejected)
+
+    by_shard = {}
+    for external_id, fields in values.items():
+        by_shard.setdefault(shards.shard_for_region(fields['region']), {})[external_id] = fields
+    # A resource cannot move between shards by changing its region
+    for alias, found in shards.gather(_existing_ids, list(values)):
+        for external_id in found:
+            fields = values[external_id]
+            target = shards.shard_for_region(fields['region'])
+            if target != alias and external_id in by_shard.get(target, {}):
+                del by_shard[target][external_id]
+                rejected.append((lines[external_id], 'region belongs to another shard than the existing resource'))
+    totals = [0, 0, 0]
+    for alias, shard_values in by_shard.items():
+        if shard_values:
+            with shards.use(alias):
+                totals = [t + c for t, c in zip(totals, _upsert_retrying(shard_values))]
+    return (*totals, rejected)
+
+
+def _existing_ids(external_ids):
+    return set(Resource.objects.filter(external_id__in=external_ids).values_list('external_id', flat=True))
+
+
+def _upsert_retrying(values):
+    try:
+        return _upsert(values)
+    except IntegrityError:
+        # Another worker created some of these IDs concurrently; the
+        # second pass sees them as existing rows and updates them.
+        return _upsert(values)
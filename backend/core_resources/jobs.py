@@ -0,0 +1,250 @@
+"""Background jobs with the database as the broker.
+
+Tasks are plain functions registered with ``@task`` in an app's
+``tasks`` module. ``enqueue`` stores a ``Job`` row and ``run_jobs``
+worker processes claim and run them, highest priority first.
+
+Where the backend supports it (PostgreSQL, MySQL 8) a claim is
+``SELECT ... FOR UPDATE SKIP LOCKED``, so workers never wait on each
+other. Elsewhere (SQLite) a worker reads a few due rows and takes one
+with an UPDATE conditioned on the values it read; only one worker's
+UPDATE can match. A running job holds a lease that a heartbeat thread
+keeps extending; if the worker dies the lease runs out and the job is
+claimed again as a new attempt. Failures are retried with exponential
+backoff up to ``max_attempts``.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_MAX = 3600  # seconds
+
+TASKS = {}
+_loaded = False
+
+
+class JobError(ValueError):
+    pass
+
+
+class Task:
+    def __init__(self, name, func, priority, max_attempts):
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+def task(name=None, priority=0, max_attempts=3):
+    """Register a function as a job task; its keyword arguments come from ``Job.args``"""
+    def register(func):
+        TASKS[name or func.__name__] = Task(name or func.__name__, func, priority, max_attempts)
+        return func
+    return register
+
+
+def load_tasks():
+    """Import every installed app's ``tasks`` module once"""
+    global _loaded
+    if not _loaded:
+        autodiscover_modules('tasks')
+        _loaded = True
+    return TASKS
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(name, args=None, priority=None, delay=0, user=None, unique_key=None, max_attempts=None):
+    """Queue a job and return it.
+
+    While a job with ``unique_key`` is still queued, enqueueing the same
+    key returns that job instead of adding another.
+    """
+    registered = load_tasks().get(name)
+    if registered is None:
+        raise JobError(f'Unknown task "{name}"')
+    args = args or {}
+    if not isinstance(args, dict):
+        raise JobError('args must be an object')
+    try:
+        json.dumps(args)
+    except (TypeError, ValueError):
+        raise JobError('args must be JSON serializable')
+
+    fields = dict(
+        task=name,
+        args=args,
+        priority=registered.priority if priority is None else priority,
+        max_attempts=max_attempts or registered.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        unique_key=unique_key,
+        created_by=user,
+    )
+    if unique_key is None:
+        return Job.objects.create(**fields)
+    existing = Job.objects.filter(unique_key=unique_key, status='queued').first()
+    if existing:
+        return existing
+    try:
+        with transaction.atomic():
+            return Job.objects.create(**fields)
+    except IntegrityError:
+        # Another process queued it between the check and the insert
+        return Job.objects.get(unique_key=unique_key)
+
+
+def _lease():
+    return timezone.now() + timedelta(seconds=settings.JOB_LEASE)
+
+
+def _due(now):
+    # A running job whose lease ran out lost its worker
+    return Job.objects.filter(
+        Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+    ).order_by('-priority', 'run_at', 'id')
+
+
+def _claimed(now, worker):
+    return dict(
+        status='running', worker=worker, locked_until=_lease(), started_at=now,
+        attempts=F('attempts') + 1, unique_key=None,
+    )
+
+
+def _give_up_abandoned(now):
+    Job.objects.filter(
+        status='running', locked_until__lt=now, attempts__gte=F('max_attempts'),
+    ).update(status='failed', locked_until=None, finished_at=now, error='Worker stopped before the job finished')
+
+
+def claim(worker=None):
+    """Take the next due job for this worker, or return ``None``"""
+    worker = worker or worker_name()
+    now = timezone.now()
+    _give_up_abandoned(now)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = _due(now).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(**_claimed(now, worker))
+    else:
+        for row in _due(now).values('id', 'status', 'attempts', 'locked_until')[:10]:
+            # Only one worker's UPDATE matches the values it read
+            if Job.objects.filter(**row).update(**_claimed(now, worker)):
+                job = Job(pk=row['id'])
+                break
+        else:
+            return None
+    job.refresh_from_db()
+    return job
+
+
+def _backoff(attempt):
+    return timedelta(seconds=min(settings.JOB_RETRY_BACKOFF * 2 ** (attempt - 1), BACKOFF_MAX))
+
+
+class _Heartbeat:
+    """Extend the job's lease from a side thread while it runs"""
+
+    def __init__(self, job):
+        self.job = job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f'job-{job.pk}-heartbeat', daemon=True)
+
+    def _run(self):
+        try:
+            while not self.stopped.wait(settings.JOB_LEASE / 3):
+                Job.objects.filter(pk=self.job.pk, attempts=self.job.attempts, status='running').update(
+                    locked_until=_lease()
+                )
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run(job):
+    """Run a claimed job and record the outcome; returns the final status"""
+    registered = load_tasks().get(job.task)
+    # Updates only apply while this worker still holds the job
+    mine = Job.objects.filter(pk=job.pk, attempts=job.attempts, status='running')
+    started = time.perf_counter()
+    try:
+        if registered is None:
+            raise JobError(f'Unknown task "{job.task}"')
+        with _Heartbeat(job):
+            result = registered.func(**job.args)
+        result = json.loads(json.dumps(result, default=str))
+    except Exception as exc:
+        now = timezone.now()
+        error = traceback.format_exc()[-4000:]
+        if job.attempts < job.max_attempts and registered is not None:
+            mine.update(status='queued', run_at=now + _backoff(job.attempts), locked_until=None, error=error)
+            outcome = 'queued'
+        else:
+            mine.update(status='failed', locked_until=None, finished_at=now, error=error)
+            outcome = 'failed'
+        logger.warning('Job %s (%s) attempt %s failed: %s', job.pk, job.task, job.attempts, exc)
+        return outcome
+
+    mine.update(status='succeeded', result=result, locked_until=None, finished_at=timezone.now(), error='')
+    logger.info('Job %s (%s) finished in %.2fs', job.pk, job.task, time.perf_counter() - started)
+    return 'succeeded'
+
+
+def cancel(job):
+    """Cancel a job that has not started; returns whether it was cancelled"""
+    return bool(Job.objects.filter(pk=job.pk, status='queued').update(
+        status='cancelled', unique_key=None, finished_at=timezone.now(),
+    ))
+
+
+def retry(job):
+    """Queue a failed or cancelled job again with a fresh set of attempts"""
+    return bool(Job.objects.filter(pk=job.pk, status__in=['failed', 'cancelled']).update(
+        status='queued', attempts=0, run_at=timezone.now(), finished_at=None, error='', result=None,
+    ))
+
+
+def work(worker=None, burst=False, stop=None):
+    """Claim and run jobs until ``stop`` is set (or the queue is empty in burst mode)"""
+    worker = worker or worker_name()
+    stop = stop or threading.Event()
+    load_tasks()
+    done = 0
+    while not stop.is_set():
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            connection.close_if_unusable_or_obsolete()
+            stop.wait(settings.JOB_POLL_INTERVAL)
+            continue
+        run(job)
+        done += 1
+    return done
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core_resources import shards
+from core_resources.archive import ArchiveBusy, archive_updates
+
+
+class Command(BaseCommand):
+    help = 'Move ResourceUpdate rows older than the retention period into compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_RETENTION_DAYS,
+                            help='Retention period (default: AUDIT_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        try:
+            results = shards.each(archive_updates, options['days'], options['batch_size'])
+        except ArchiveBusy as exc:
+            raise CommandError(str(exc))
+        archived = sum(result[0] for _, result in results)
+        files = sum(result[1] for _, result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} audit rows into {files} files under {settings.AUDIT_ARCHIVE_ROOT}'
+        ))
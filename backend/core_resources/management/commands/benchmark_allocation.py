@@ -0,0 +1,85 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core_resources.allocation import CANDIDATES, MAX_DISTANCE_KM, candidate_arcs, solve
+
+
+def _greedy(people, capacity, arcs):
+    """Baseline: each point in turn fills its nearest shelters with room"""
+    spare = list(capacity)
+    cost = assigned = 0
+    for i, count in enumerate(people):
+        for j, metres in arcs[i]:
+            take = min(count, spare[j])
+            spare[j] -= take
+            count -= take
+            assigned += take
+            cost += take * metres
+            if not count:
+                break
+    return assigned, cost
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the evacuee allocation solver on synthetic instances (no database access)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=2000, help='Demand points per instance')
+        parser.add_argument('--shelters', type=int, default=800)
+        parser.add_argument('--instances', type=int, default=3)
+        parser.add_argument('--area-km', type=float, default=60, help='Side of the square area')
+        parser.add_argument('--load', type=float, default=0.8, help='Total demand as a fraction of total capacity')
+        parser.add_argument('--candidates', type=int, default=CANDIDATES)
+        parser.add_argument('--max-distance', type=float, default=MAX_DISTANCE_KM)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['points'] < 1 or options['shelters'] < 1:
+            raise CommandError('--points and --shelters must be positive')
+        rng = random.Random(options['seed'])
+        area = options['area_km']
+
+        for instance in range(options['instances']):
+            shelter_xy = [(rng.uniform(0, area), rng.uniform(0, area)) for _ in range(options['shelters'])]
+            capacity = [rng.randint(20, 400) for _ in shelter_xy]
+            # Demand clusters around a few flooded zones
+            zones = [(rng.uniform(0, area), rng.uniform(0, area)) for _ in range(6)]
+            demand_xy = []
+            for _ in range(options['points']):
+                zx, zy = rng.choice(zones)
+                demand_xy.append((
+                    min(max(rng.gauss(zx, area / 10), 0), area),
+                    min(max(rng.gauss(zy, area / 10), 0), area),
+                ))
+            weights = [rng.uniform(0.2, 1.8) for _ in demand_xy]
+            scale = sum(capacity) * options['load'] / sum(weights)
+            people = [max(1, int(w * scale)) for w in weights]
+
+            started = time.perf_counter()
+            arcs = candidate_arcs(demand_xy, shelter_xy, options['max_distance'], options['candidates'])
+            indexed = time.perf_counter()
+            flows = solve(people, capacity, arcs)
+            solved = time.perf_counter()
+
+            used = [0] * len(capacity)
+            served = [0] * len(people)
+            cost = 0
+            for (i, j), count in flows.items():
+                used[j] += count
+                served[i] += count
+                cost += count * dict(arcs[i])[j]
+            if any(u > c for u, c in zip(used, capacity)) or any(s > p for s, p in zip(served, people)):
+                raise CommandError(f'Instance {instance}: allocation violates capacity or demand')
+
+            greedy_assigned, greedy_cost = _greedy(people, capacity, arcs)
+            assigned = sum(served)
+            self.stdout.write(
+                f'instance {instance}: {len(people)} points, {len(capacity)} shelters, '
+                f'{sum(len(a) for a in arcs)} arcs | index {indexed - started:.2f}s, '
+                f'solve {solved - indexed:.2f}s | assigned {assigned}/{sum(people)} people, '
+                f'{cost / 1000 / max(assigned, 1):.2f} km/person '
+                f'(greedy: {greedy_assigned} people, '
+                f'{greedy_cost / 1000 / max(greedy_assigned, 1):.2f} km/person)'
+            )
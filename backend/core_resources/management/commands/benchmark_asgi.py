@@ -0,0 +1,219 @@
+import asyncio
+import io
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core_resources import shards, singleflight
+from core_resources.models import Resource
+
+REGION = 'benchmark-asgi'
+CENTRE = (0.5, 0.5)  # open sea, away from real resources
+TYPES = [choice for choice, _ in Resource.TYPE_CHOICES]
+STATUSES = [choice for choice, _ in Resource.STATUS_CHOICES]
+NEARBY = f'lat={CENTRE[0]}&lon={CENTRE[1]}&max_distance=25'
+ENDPOINTS = [
+    ('/api/resources/', f'region={REGION}'),
+    ('/api/resources/nearby/', f'{NEARBY}&limit=20'),
+    ('/api/alerts/active/', f'lat={CENTRE[0]}&lon={CENTRE[1]}'),
+]
+# Both handlers must answer these identically before anything is timed
+PARITY = ENDPOINTS + [
+    ('/api/resources/', f'region={REGION}&type=hospital&status=open'),
+    ('/api/resources/nearby/', f'{NEARBY}&type=hospital'),
+    ('/api/resources/nearby/', f'{NEARBY}&status=closed&rank=best'),
+    ('/api/resources/nearby/', f'{NEARBY}&region={REGION}&search=Benchmark+1&limit=50'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent-client throughput of the WSGI handler (a pool of sync workers) with the '
+        'ASGI application (one event loop) on the list, nearby and active alert endpoints'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=10, help='Requests per client')
+        parser.add_argument('--workers', type=int, default=4, help='WSGI sync workers (gunicorn --workers)')
+        parser.add_argument(
+            '--client-latency', type=float, default=50,
+            help='Milliseconds a client takes to receive a response; a sync worker is held meanwhile',
+        )
+        parser.add_argument('--resources', type=int, default=2000, help='Scratch resources to create')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch resources afterwards')
+
+    def handle(self, *args, **options):
+        if min(options['clients'], options['requests'], options['workers']) < 1 or options['resources'] < 0:
+            raise CommandError('--clients, --requests and --workers must be positive')
+        if shards.enabled():
+            self.stdout.write(self.style.WARNING('Sharding is on: the async views fall back to the DRF views'))
+
+        with shards.use_for_region(REGION):
+            self._fill(options['resources'])
+        try:
+            # Imported late: it sets up the ASGI handler and its urlconf
+            from cerl_project.asgi import application
+
+            total = options['clients'] * options['requests']
+            latency = options['client_latency'] / 1000
+            self.stdout.write(
+                f'{total} requests from {options["clients"]} clients, {options["client_latency"]:.0f}ms '
+                f'client latency, {options["resources"]} benchmark resources'
+            )
+            self._parity(application)
+            self._report(f'WSGI ({options["workers"]} workers)', *self._wsgi(options, latency))
+            self._report('ASGI (1 event loop)', *self._asgi(application, options, latency))
+            shared = sum(counts['shared'] + counts['shared_across_workers'] for counts in singleflight.stats().values())
+            self.stdout.write(f'{shared} responses were shared by single-flight coalescing (SINGLE_FLIGHT_ROUTES)')
+        finally:
+            if not options['keep']:
+                with shards.use_for_region(REGION):
+                    Resource.objects.filter(region=REGION).delete()
+
+    def _fill(self, count):
+        rng = random.Random(1)
+        existing = Resource.objects.filter(region=REGION).count()
+        Resource.objects.bulk_create([
+            Resource(
+                name=f'Benchmark {i}', type=rng.choice(TYPES), description='benchmark',
+                latitude=round(CENTRE[0] + rng.uniform(-0.3, 0.3), 6),
+                longitude=round(CENTRE[1] + rng.uniform(-0.3, 0.3), 6),
+                address='-', region=REGION, capacity=100, available_capacity=rng.randint(0, 100),
+                status=rng.choice(STATUSES), verified=True, contact='-',
+            )
+            for i in range(existing, count)
+        ], batch_size=1000)
+
+    def _report(self, label, elapsed, timings):
+        timings.sort()
+        self.stdout.write(
+            f'{label}: {len(timings) / elapsed:.0f} req/s, p50 {statistics.median(timings) * 1000:.0f}ms, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.0f}ms'
+        )
+
+    def _check(self, status, path):
+        if status != 200:
+            raise CommandError(f'{path} returned {status}')
+
+    def _parity(self, application):
+        """Fail unless WSGI and ASGI return the same data for every ``PARITY`` request"""
+        handler = WSGIHandler()
+        for path, query in PARITY:
+            wsgi = self._wsgi_get(handler, path, query)
+            asgi = asyncio.run(self._asgi_get(application, path, query, 0))
+            if wsgi[0] != asgi[0] or json.loads(wsgi[1]) != json.loads(asgi[1]):
+                raise CommandError(f'WSGI and ASGI responses differ for {path}?{query}')
+        connections.close_all()
+        self.stdout.write(f'WSGI and ASGI responses match for {len(PARITY)} requests')
+
+    def _wsgi_get(self, handler, path, query):
+        """``(status, body)`` of a GET through the WSGI handler"""
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+        }
+        status = []
+        body = handler(environ, lambda line, headers, exc_info=None: status.append(int(line[:3])))
+        try:
+            return status[0], b''.join(body)
+        finally:
+            body.close()
+
+    async def _asgi_get(self, application, path, query, latency):
+        """``(status, body)`` of a GET through the ASGI application"""
+        received = asyncio.Event()
+        status, chunks = [], []
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        body = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if body:
+                return body.pop()
+            await received.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                # The event loop serves other clients meanwhile
+                await asyncio.sleep(latency)
+                received.set()
+
+        await application(scope, receive, send)
+        return status[0], b''.join(chunks)
+
+    def _wsgi(self, options, latency):
+        handler = WSGIHandler()
+        workers = threading.Semaphore(options['workers'])
+        timings, errors = [], []
+
+        def request(path, query):
+            status, _ = self._wsgi_get(handler, path, query)
+            # A sync worker writes the response to the client itself
+            time.sleep(latency)
+            self._check(status, path)
+
+        def client(index):
+            try:
+                for i in range(options['requests']):
+                    started = time.perf_counter()
+                    with workers:
+                        request(*ENDPOINTS[(index + i) % len(ENDPOINTS)])
+                    timings.append(time.perf_counter() - started)
+            except Exception as exc:  # surfaced after join
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        for endpoint in ENDPOINTS:
+            request(*endpoint)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(options['clients'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'{len(errors)} client(s) failed: {errors[0]!r}')
+        return elapsed, timings
+
+    def _asgi(self, application, options, latency):
+        timings = []
+
+        async def request(path, query):
+            status, _ = await self._asgi_get(application, path, query, latency)
+            self._check(status, path)
+
+        async def client(index):
+            for i in range(options['requests']):
+                started = time.perf_counter()
+                await request(*ENDPOINTS[(index + i) % len(ENDPOINTS)])
+                timings.append(time.perf_counter() - started)
+
+        async def run():
+            for endpoint in ENDPOINTS:
+                await request(*endpoint)
+            started = time.perf_counter()
+            await asyncio.gather(*(client(i) for i in range(options['clients'])))
+            return time.perf_counter() - started
+
+        return asyncio.run(run()), timings
@@ -0,0 +1,154 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core_resources import shards
+from core_resources.exports import iter_chunks
+from core_resources.models import Resource, User
+from core_resources.views import ResourceViewSet, resource_counts
+
+TYPES = [choice for choice, _ in Resource.TYPE_CHOICES]
+STATUSES = ['open', 'open', 'open', 'full', 'closed']
+
+
+def _add_database(alias, path):
+    configured = connections.configure_settings({
+        'default': connections.settings['default'],
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path},
+    })
+    connections.settings[alias] = configured[alias]
+
+
+def _drop_database(alias):
+    connections[alias].close()
+    del connections.settings[alias]
+    try:
+        delattr(connections._connections, alias)
+    except AttributeError:
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark scatter-gather stats and CSV export on 1, 2, 4... local SQLite shards holding the same data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resources', type=int, default=100000, help='Resources in total, split over the shards')
+        parser.add_argument('--shards', default='1,2,4', help='Shard counts to compare')
+        parser.add_argument('--regions', type=int, default=64)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the best is reported')
+        parser.add_argument('--dir', help='Where to create the SQLite files (default: a temporary directory)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            counts = [int(n) for n in options['shards'].split(',')]
+        except ValueError:
+            raise CommandError('--shards must be a comma separated list of numbers')
+        if not counts or min(counts) < 1 or options['resources'] < 1:
+            raise CommandError('--shards and --resources must be positive')
+
+        root = options['dir'] or tempfile.mkdtemp(prefix='cerl-shards-')
+        os.makedirs(root, exist_ok=True)
+        try:
+            template = self._template(root)
+            self.stdout.write(
+                f'{options["resources"]} resources on {os.cpu_count()} CPU(s); "slowest shard" is the '
+                'response time when every shard has its own server'
+            )
+            baseline = None
+            for count in counts:
+                timings = self._run(root, template, count, options)
+                baseline = baseline or timings
+                stats, stats_shard, export, export_shard = timings
+                self.stdout.write(
+                    f'{count} shard(s): stats {stats * 1000:.1f}ms, slowest shard {stats_shard * 1000:.1f}ms '
+                    f'({baseline[1] / stats_shard:.2f}x) | export_csv {export:.2f}s '
+                    f'({options["resources"] / export:.0f} rows/s), slowest shard {export_shard:.2f}s '
+                    f'({baseline[3] / export_shard:.2f}x)'
+                )
+        finally:
+            if not options['dir']:
+                shutil.rmtree(root, ignore_errors=True)
+
+    def _template(self, root):
+        """An empty, migrated database copied for every shard"""
+        path = os.path.join(root, 'template.sqlite3')
+        _add_database('bench_template', path)
+        try:
+            call_command('migrate', database='bench_template', verbosity=0)
+        finally:
+            _drop_database('bench_template')
+        return path
+
+    def _run(self, root, template, count, options):
+        aliases = [f'bench_{count}_{i}' for i in range(count)]
+        for alias in aliases:
+            path = os.path.join(root, f'{alias}.sqlite3')
+            shutil.copyfile(template, path)
+            _add_database(alias, path)
+        try:
+            with override_settings(DATABASE_SHARDS=aliases, SHARD_REGIONS={}):
+                for alias in aliases:
+                    shards.start_ids(alias)
+                self._fill(options)
+                stats = self._best(options['repeat'], self._request, 'stats')
+                export = self._best(options['repeat'], self._request, 'export_csv')
+                stats_shard = export_shard = 0
+                for alias in aliases:
+                    with shards.use(alias):
+                        stats_shard = max(stats_shard, self._best(options['repeat'], resource_counts))
+                        export_shard = max(export_shard, self._best(options['repeat'], self._read_all))
+        finally:
+            for alias in aliases:
+                _drop_database(alias)
+        return stats, stats_shard, export, export_shard
+
+    def _fill(self, options):
+        rng = random.Random(options['seed'])
+        regions = [f'Region {i}' for i in range(options['regions'])]
+        rows = {}
+        for i in range(options['resources']):
+            region = rng.choice(regions)
+            capacity = rng.randint(10, 500)
+            rows.setdefault(shards.shard_for_region(region), []).append(Resource(
+                name=f'Facility {i}', type=rng.choice(TYPES), description='benchmark',
+                latitude=round(rng.uniform(8, 30), 6), longitude=round(rng.uniform(70, 90), 6),
+                address='-', region=region, capacity=capacity, available_capacity=rng.randint(0, capacity),
+                status=rng.choice(STATUSES), verified=rng.random() < 0.9, contact='-',
+            ))
+        for alias, resources in rows.items():
+            with shards.use(alias):
+                Resource.objects.bulk_create(resources, batch_size=2000)
+
+    def _request(self, action):
+        request = APIRequestFactory().get(f'/api/resources/{action}/', HTTP_HOST='localhost')
+        force_authenticate(request, user=User(username='benchmark', role='admin'))
+        response = ResourceViewSet.as_view({'get': action})(request)
+        if response.status_code != 200:
+            raise CommandError(f'{action} returned {response.status_code}')
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        else:
+            response.render()
+
+    def _read_all(self):
+        for _ in iter_chunks(Resource.objects.all()):
+            pass
+
+    def _best(self, repeat, func, *args):
+        best = None
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
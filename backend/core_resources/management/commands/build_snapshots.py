@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core_resources.snapshots import build_snapshots, region_key
+
+
+class Command(BaseCommand):
+    help = 'Build the per-region offline snapshot bundles and manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--region', action='append', help='Only rebuild this region (repeatable)')
+
+    def handle(self, *args, **options):
+        keys = {region_key(r) for r in options['region']} if options['region'] else None
+        changed = build_snapshots(keys)
+        if changed:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(changed)} bundle(s): {", ".join(changed)}'))
+        else:
+            self.stdout.write('All bundles up to date')
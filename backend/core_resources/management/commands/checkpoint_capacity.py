@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core_resources import shards
+from core_resources.checkpoints import take_checkpoint
+
+
+class Command(BaseCommand):
+    help = 'Record a capacity checkpoint used to answer as_of queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, metavar='SECONDS', help='Keep running, checkpointing at this interval')
+
+    def handle(self, *args, **options):
+        while True:
+            for alias, checkpoint in shards.each(take_checkpoint):
+                where = f' on {alias}' if alias else ''
+                self.stdout.write(
+                    f'Checkpointed {checkpoint.entries.count()} resources{where} at {checkpoint.taken_at:%Y-%m-%d %H:%M:%S}'
+                )
+            if not options['loop']:
+                return
+            connections.close_all()
+            time.sleep(options['loop'])
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core_resources import audit
+
+
+class Command(BaseCommand):
+    help = 'Replay the write-behind audit journal into the resource_updates table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Also replay segments of processes that still look alive (run with servers stopped)',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.AUDIT_JOURNAL_DIR:
+            raise CommandError('AUDIT_JOURNAL_DIR is not configured')
+        written = audit.flush(include_live=options['all'])
+        self.stdout.write(self.style.SUCCESS(f'Replayed {written} audit rows'))
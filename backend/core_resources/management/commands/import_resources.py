@@ -0,0 +1,115 @@
+import json
+import multiprocessing
+import time
+from collections import deque
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core_resources import shards
+from core_resources.duplicates import flag_all
+from core_resources.importers import READERS, import_batch
+
+
+def _init_worker():
+    # Spawned workers (Windows, macOS) start without Django configured;
+    # forked ones must not reuse the parent's database connections.
+    django.setup()
+    connections.close_all()
+
+
+def _run_batch(args):
+    rows, id_field = args
+    return import_batch(rows, id_field)
+
+
+def _bounded_map(pool, batches, window):
+    """Like imap, but keeps at most ``window`` batches in flight.
+
+    Pool.imap drains its input eagerly, which would read the whole file
+    into the task queue.
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(_run_batch, (batch,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _batches(rows, size, id_field):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch, id_field
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV, NDJSON or GeoJSON facility registry into resources, upserting on external_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS), help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=1, help='Parallel worker processes')
+        parser.add_argument('--id-field', default='external_id', help='Column/property holding the external ID')
+        parser.add_argument('--rejects', help='Write rejected rows as NDJSON to this file')
+        parser.add_argument('--find-duplicates', action='store_true',
+                            help='Flag near-duplicate resources once the import is done')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if fmt == 'json':
+            fmt = 'geojson'
+        if fmt not in READERS:
+            raise CommandError(f'Unknown format "{fmt}", use --format')
+
+        rejected = []
+        started = time.perf_counter()
+
+        with open(path, newline='', encoding='utf-8-sig') as fh:
+            batches = _batches(READERS[fmt](fh), options['batch_size'], options['id_field'])
+            if options['workers'] > 1:
+                connections.close_all()
+                with multiprocessing.Pool(options['workers'], initializer=_init_worker) as pool:
+                    results = _bounded_map(pool, batches, options['workers'] * 2)
+                    counts = self._collect(results, rejected, started)
+            else:
+                results = (_run_batch(batch) for batch in batches)
+                counts = self._collect(results, rejected, started)
+
+        created, updated, unchanged = counts
+        elapsed = time.perf_counter() - started
+        total = created + updated + unchanged + len(rejected)
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s): '
+            f'{created} created, {updated} updated, {unchanged} unchanged, {len(rejected)} rejected'
+        ))
+
+        if rejected and options['rejects']:
+            with open(options['rejects'], 'w', encoding='utf-8') as out:
+                for line, error in sorted(rejected):
+                    out.write(json.dumps({'line': line, 'error': error}) + '\n')
+        elif rejected:
+            for line, error in sorted(rejected)[:20]:
+                self.stderr.write(f'  line {line}: {error}')
+
+        if options['find_duplicates']:
+            flagged = sum(count for _, count in shards.each(flag_all))
+            self.stdout.write(f'{flagged} near-duplicate pairs flagged')
+
+    def _collect(self, results, rejected, started):
+        counts = [0, 0, 0]
+        for *batch_counts, batch_rejected in results:
+            counts = [a + b for a, b in zip(counts, batch_counts)]
+            rejected.extend(batch_rejected)
+            done = sum(counts) + len(rejected)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{done} rows processed ({done / elapsed:.0f} rows/s)')
+        return counts
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core_resources import shards
+
+
+class Command(BaseCommand):
+    help = "Create the tables on every shard database and move each shard's ids into its own range"
+
+    def handle(self, *args, **options):
+        if not shards.enabled():
+            raise CommandError('No shards configured; set DB_SHARD_URLS')
+        for alias in shards.aliases():
+            call_command('migrate', database=alias, verbosity=0)
+            try:
+                start, end = shards.start_ids(alias)
+            except shards.ShardError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f'{alias}: ids {start} to {end - 1}')
+        self.stdout.write(self.style.SUCCESS(f'{len(shards.aliases())} shards ready'))
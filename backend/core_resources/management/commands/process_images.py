@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core_resources import shards
+from core_resources.images import ROOT, process_resource, queue
+from core_resources.models import Resource
+
+
+class Command(BaseCommand):
+    help = 'Build thumbnails and WebP variants for resource images that have not been processed yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inline', action='store_true',
+                            help='Process here instead of queueing jobs for run_jobs workers')
+
+    def handle(self, *args, **options):
+        pending = Resource.objects.exclude(image='').exclude(image__isnull=True).exclude(
+            image__startswith=ROOT + '/'
+        ).values_list('id', flat=True)
+        started = time.perf_counter()
+        count = 0
+        for resource_id in shards.gather_list(pending):
+            if options['inline']:
+                process_resource(resource_id)
+            else:
+                queue(Resource(pk=resource_id))
+            count += 1
+        verb = 'Processed' if options['inline'] else 'Queued'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {count} images in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core_resources import shards
+from core_resources.rollups import update_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold new ResourceUpdate rows into the capacity time-series rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--loop', type=float, metavar='SECONDS', help='Keep running, polling at this interval')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = sum(count for _, count in shards.each(update_rollups, options['batch_size']))
+            if processed or not options['loop']:
+                self.stdout.write(f'Folded {processed} audit rows into rollups')
+            if not options['loop']:
+                return
+            connections.close_all()
+            time.sleep(options['loop'])
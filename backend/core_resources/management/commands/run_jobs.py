@@ -0,0 +1,72 @@
+import multiprocessing
+import signal
+import threading
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core_resources.jobs import load_tasks, work, worker_name
+
+
+def _stop_on_signals(stop):
+    # Finish the current job, then exit
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+
+
+def _worker_main(burst):
+    # Spawned workers (Windows, macOS) start without Django configured;
+    # forked ones must not reuse the parent's database connections.
+    django.setup()
+    connections.close_all()
+    stop = threading.Event()
+    _stop_on_signals(stop)
+    work(worker_name(), burst=burst, stop=stop)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Worker processes (1 runs in this process)')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue has no due jobs')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Tasks: {", ".join(sorted(load_tasks()))}')
+        started = time.perf_counter()
+        if options['processes'] <= 1:
+            stop = threading.Event()
+            _stop_on_signals(stop)
+            done = work(burst=options['burst'], stop=stop)
+            self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs in {time.perf_counter() - started:.1f}s'))
+            return
+
+        stop = threading.Event()
+        _stop_on_signals(stop)
+        connections.close_all()
+        pool = [self._start(options['burst']) for _ in range(options['processes'])]
+        while pool and not stop.is_set():
+            for i, process in enumerate(pool):
+                process.join(timeout=0.5 / len(pool))
+                if process.is_alive():
+                    continue
+                if options['burst'] and process.exitcode == 0:
+                    pool[i] = None
+                else:
+                    # Its job (if any) is picked up again when the lease runs out
+                    self.stderr.write(f'Worker {process.pid} exited with {process.exitcode}, restarting')
+                    pool[i] = self._start(options['burst'])
+            pool = [process for process in pool if process is not None]
+
+        for process in pool:
+            process.terminate()  # SIGTERM: workers finish their current job first
+        for process in pool:
+            process.join()
+        self.stdout.write(self.style.SUCCESS(f'Workers stopped after {time.perf_counter() - started:.1f}s'))
+
+    def _start(self, burst):
+        process = multiprocessing.Process(target=_worker_main, args=(burst,), daemon=False)
+        process.start()
+        return process
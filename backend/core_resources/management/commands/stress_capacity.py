@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core_resources import audit, shards
+from core_resources.capacity import apply_capacity_delta
+from core_resources.models import Resource, ResourceUpdate, User
+
+REGION = 'stress-test'
+
+
+class Command(BaseCommand):
+    help = 'Hammer check-in/check-out from many threads and verify no capacity update is lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help='Operations per thread')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch resource afterwards')
+
+    def handle(self, *args, **options):
+        with shards.use_for_region(REGION):
+            self._stress(options)
+
+    def _stress(self, options):
+        threads = options['threads']
+        operations = options['operations']
+
+        user = User.objects.filter(role='admin').first()
+        if user is None:
+            raise CommandError('An admin user is required to run the stress test')
+
+        # Capacity is large enough that the bounds are never hit, so the
+        # final value must equal the start value plus every applied delta.
+        total_ops = threads * operations
+        start = total_ops
+        resource = Resource.objects.create(
+            name='Capacity stress test', type='shelter', description='scratch',
+            latitude=0, longitude=0, address='-', region=REGION,
+            capacity=start * 2, available_capacity=start, contact='-',
+        )
+
+        applied = [0] * threads
+        errors = []
+
+        def worker(index):
+            rng = random.Random(index)
+            try:
+                with shards.use_for_id(resource.pk):
+                    for _ in range(operations):
+                        delta = rng.choice([-3, -2, -1, 1, 2, 3])
+                        apply_capacity_delta(resource.pk, delta, user, 'stress')
+                        applied[index] += delta
+            except Exception as exc:  # surfaced after join
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            if errors:
+                raise CommandError(f'{len(errors)} worker(s) failed: {errors[0]!r}')
+
+            audit.flush()
+            resource.refresh_from_db()
+            expected = start + sum(applied)
+            audits = list(
+                ResourceUpdate.objects.filter(resource=resource)
+                .order_by('id').values_list('previous_capacity', 'new_capacity')
+            )
+            chained = all(a[1] == b[0] for a, b in zip(audits, audits[1:]))
+
+            self.stdout.write(f'{total_ops} operations in {elapsed:.2f}s ({total_ops / elapsed:.0f} ops/s)')
+            self.stdout.write(f'expected={expected} actual={resource.available_capacity} audit_rows={len(audits)}')
+
+            if resource.available_capacity != expected:
+                raise CommandError('Lost update detected: final capacity does not match applied deltas')
+            if len(audits) != total_ops or not chained:
+                raise CommandError('Audit trail is incomplete or does not chain previous -> new')
+            self.stdout.write(self.style.SUCCESS('No lost updates'))
+        finally:
+            if not options['keep']:
+                resource.delete()
@@ -0,0 +1,289 @@
+"""Per-route request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records, per URL name, request counts by method
+and status, a latency histogram, a response size histogram, and the
+number and time of database queries (recorded by an execute wrapper on
+every connection, see ``signals.py``), including the queries a streamed
+export runs while it is sent. Queries run by shard threads in
+``shards.gather()`` are not attributed to the request.
+
+Each thread writes to its own ``_Shard``, so recording takes no lock;
+``render()`` sums the shards when ``/metrics`` is scraped. Figures are
+per worker process. Cache hit rates and surge state come from the
+modules that own them.
+"""
+import bisect
+import contextlib
+import contextvars
+import hmac
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.authentication import BaseAuthentication
+
+from . import coverage, singleflight, surge
+from .middleware import after_streaming, route_name
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)  # bytes
+SCRAPER = 'metrics-token'  # request.auth for METRICS_TOKEN requests
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """``Authorization: Bearer <METRICS_TOKEN>``, for Prometheus scrapers"""
+
+    def authenticate(self, request):
+        token = settings.METRICS_TOKEN
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return AnonymousUser(), SCRAPER
+        return None
+
+    def authenticate_header(self, request):
+        # DRF answers 403 instead of 401 when the first authenticator has none
+        return 'Bearer realm="api"'
+
+
+class _Shard:
+    """One thread's figures; only that thread writes to it"""
+
+    def __init__(self):
+        self.requests = {}  # (route, method, status) -> count
+        self.latency = {}  # route -> [count per bucket..., sum]
+        self.size = {}
+        self.queries = {}  # route -> [queries, seconds]
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def _observe(histograms, route, buckets, value):
+    histogram = histograms.get(route)
+    if histogram is None:
+        histogram = histograms[route] = [0] * (len(buckets) + 2)
+    histogram[bisect.bisect_left(buckets, value)] += 1
+    histogram[-1] += value
+
+
+class _Queries:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+_queries = contextvars.ContextVar('metrics_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper counting the current request's queries"""
+    queries = _queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        # The object is shared with the ORM's sync_to_async threads
+        queries.count += 1
+        queries.seconds += time.perf_counter() - started
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _record(route, method, status, elapsed, size, queries):
+    shard = _shard()
+    key = (route, method, status)
+    shard.requests[key] = shard.requests.get(key, 0) + 1
+    _observe(shard.latency, route, LATENCY_BUCKETS, elapsed)
+    if size is not None:
+        _observe(shard.size, route, SIZE_BUCKETS, size)
+    totals = shard.queries.get(route)
+    if totals is None:
+        totals = shard.queries[route] = [0, 0.0]
+    totals[0] += queries.count
+    totals[1] += queries.seconds
+
+
+@contextlib.contextmanager
+def _counting(queries):
+    """Attribute the queries run inside the block to a request"""
+    token = _queries.set(queries)
+    try:
+        yield
+    finally:
+        _queries.reset(token)
+
+
+class MetricsMiddleware:
+    """Time every request and record it under its URL name"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = _Queries()
+        started = time.perf_counter()
+        with _counting(queries):
+            response = self.get_response(request)
+        return self._finish(request, response, started, queries)
+
+    async def __acall__(self, request):
+        queries = _Queries()
+        started = time.perf_counter()
+        with _counting(queries):
+            response = await self.get_response(request)
+        return self._finish(request, response, started, queries)
+
+    def _finish(self, request, response, started, queries):
+        elapsed = time.perf_counter() - started
+        route = route_name(request) or 'unmatched'
+        args = (route, request.method, response.status_code, elapsed)
+        if not response.streaming:
+            _record(*args, len(response.content), queries)
+        else:
+            # Exports query while they stream; size and queries are
+            # known once the last chunk is sent
+            after_streaming(
+                response, lambda size: _record(*args, size, queries), lambda: _counting(queries),
+            )
+        return response
+
+
+def _merged():
+    requests, latency, size, queries = {}, {}, {}, {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        # Copies: the owning thread may add keys meanwhile
+        for key, count in list(shard.requests.items()):
+            requests[key] = requests.get(key, 0) + count
+        for merged, histograms in ((latency, shard.latency), (size, shard.size)):
+            for route, histogram in list(histograms.items()):
+                total = merged.setdefault(route, [0] * len(histogram))
+                for i, value in enumerate(list(histogram)):
+                    total[i] += value
+        for route, (count, seconds) in list(shard.queries.items()):
+            total = queries.setdefault(route, [0, 0.0])
+            total[0] += count
+            total[1] += seconds
+    return requests, latency, size, queries
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_label(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram(lines, name, help_text, buckets, histograms):
+    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for route, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip((*buckets, '+Inf'), histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(route=route, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(route=route)} {histogram[-1]}')
+        lines.append(f'{name}_count{_labels(route=route)} {cumulative}')
+
+
+def _caches():
+    """``[(cache, hits, misses)]``"""
+    from user_alerts.geofence import index as geofence_index
+
+    caches = [
+        ('coverage_grid', coverage.cache_stats['hit'], coverage.cache_stats['miss']),
+        ('geofence_index', geofence_index.hits, geofence_index.rebuilds),
+    ]
+    for route, counts in sorted(singleflight.stats().items()):
+        caches.append((
+            f'single_flight:{route}', counts['shared'] + counts['shared_across_workers'], counts['computed'],
+        ))
+    return caches
+
+
+def render():
+    """All metrics of this worker in the Prometheus text format"""
+    requests, latency, size, queries = _merged()
+    lines = [
+        '# HELP cerl_http_requests_total Requests by route, method and status',
+        '# TYPE cerl_http_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f'cerl_http_requests_total{_labels(route=route, method=method, status=status)} {count}')
+    _histogram(lines, 'cerl_http_request_duration_seconds', 'Request latency by route', LATENCY_BUCKETS, latency)
+    _histogram(lines, 'cerl_http_response_size_bytes', 'Response body size by route', SIZE_BUCKETS, size)
+
+    lines += ['# HELP cerl_db_queries_total Database queries by route', '# TYPE cerl_db_queries_total counter']
+    lines += [f'cerl_db_queries_total{_labels(route=route)} {count}' for route, (count, _) in sorted(queries.items())]
+    lines += [
+        '# HELP cerl_db_query_seconds_total Time spent in database queries by route',
+        '# TYPE cerl_db_query_seconds_total counter',
+    ]
+    lines += [
+        f'cerl_db_query_seconds_total{_labels(route=route)} {seconds}' for route, (_, seconds) in sorted(queries.items())
+    ]
+
+    lines += ['# HELP cerl_cache_requests_total Cache lookups by result', '# TYPE cerl_cache_requests_total counter']
+    for cache, hits, misses in _caches():
+        lines.append(f'cerl_cache_requests_total{_labels(cache=cache, result="hit")} {hits}')
+        lines.append(f'cerl_cache_requests_total{_labels(cache=cache, result="miss")} {misses}')
+    saved = sum(counts['saved_seconds'] for counts in singleflight.stats().values())
+    lines += [
+        '# HELP cerl_single_flight_saved_seconds_total Compute time saved by sharing responses',
+        '# TYPE cerl_single_flight_saved_seconds_total counter',
+        f'cerl_single_flight_saved_seconds_total {saved}',
+    ]
+
+    state = surge.tracker.status()
+    lines += [
+        '# HELP cerl_surge_active Whether this worker is in surge mode',
+        '# TYPE cerl_surge_active gauge',
+        f'cerl_surge_active {int(state["surge"])}',
+        '# HELP cerl_requests_in_flight Requests in flight by surge class',
+        '# TYPE cerl_requests_in_flight gauge',
+    ]
+    lines += [f'cerl_requests_in_flight{_labels(**{"class": cls})} {n}' for cls, n in state['in_flight'].items()]
+    lines += [
+        '# HELP cerl_surge_latency_seconds Moving average latency by surge class',
+        '# TYPE cerl_surge_latency_seconds gauge',
+    ]
+    lines += [f'cerl_surge_latency_seconds{_labels(**{"class": cls})} {s}' for cls, s in state['latency'].items()]
+    lines += [
+        '# HELP cerl_surge_shed_total Requests refused with 503 in surge mode',
+        '# TYPE cerl_surge_shed_total counter',
+        f'cerl_surge_shed_total {state["shed"]}',
+        '# HELP cerl_surge_stale_total Critical requests answered with a stale copy',
+        '# TYPE cerl_surge_stale_total counter',
+        f'cerl_surge_stale_total {state["stale"]}',
+    ]
+    return '\n'.join(lines) + '\n'
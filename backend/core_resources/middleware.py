@@ -0,0 +1,136 @@
+import contextlib
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .snapshots import BUNDLE_RE
+
+
+def route_name(request):
+    """URL name the request resolves to (``None`` if none), resolved once per request"""
+    try:
+        return request._route_name
+    except AttributeError:
+        pass
+    try:
+        name = resolve(request.path_info, getattr(request, 'urlconf', settings.ROOT_URLCONF)).url_name
+    except Resolver404:
+        name = None
+    request._route_name = name
+    return name
+
+
+class _Stream:
+    """Streamed content that calls ``done(size)`` once, after the last chunk or on close.
+
+    Responses register ``close`` with the server, so ``done`` also runs
+    for a client that disconnects, even before the first chunk.
+    """
+
+    def __init__(self, chunks, done, context):
+        self.chunks = chunks
+        self.done = done
+        self.context = context
+        self.size = 0
+        self.finished = False
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.done(self.size)
+
+
+class _SyncStream(_Stream):
+    def __iter__(self):
+        self.chunks = iter(self.chunks)
+        return self
+
+    def __next__(self):
+        try:
+            with self.context():
+                chunk = next(self.chunks)
+        except StopIteration:
+            self.close()
+            raise
+        self.size += len(chunk)
+        return chunk
+
+
+class _AsyncStream(_Stream):
+    def __aiter__(self):
+        self.chunks = aiter(self.chunks)
+        return self
+
+    async def __anext__(self):
+        try:
+            with self.context():
+                chunk = await anext(self.chunks)
+        except StopAsyncIteration:
+            self.close()
+            raise
+        self.size += len(chunk)
+        return chunk
+
+
+def after_streaming(response, done, context=contextlib.nullcontext):
+    """Call ``done(size)`` once a streaming response's content has been sent or closed.
+
+    Each chunk is produced inside ``context()``.
+    """
+    stream = _AsyncStream if response.is_async else _SyncStream
+    response.streaming_content = stream(response.streaming_content, done, context)
+
+
+class SnapshotWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that also serves offline snapshot bundles.
+
+    Bundles are created after startup, so they are registered on first
+    request instead of by WhiteNoise's startup scan. Their names are
+    content-hashed, which makes them safe to cache as immutable.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings=settings)
+        self.snapshot_prefix = settings.SNAPSHOT_URL
+        self.snapshot_root = str(settings.SNAPSHOT_ROOT)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self._serve(request)
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        response = self._serve(request)
+        return response if response is not None else await self.get_response(request)
+
+    def _serve(self, request):
+        """A static file or snapshot response, or ``None`` to pass the request on"""
+        path = request.path_info
+        if path.startswith(self.snapshot_prefix):
+            name = path[len(self.snapshot_prefix):]
+            file_path = os.path.join(self.snapshot_root, name)
+            if BUNDLE_RE.match(name) and os.path.isfile(file_path):
+                if path not in self.files:
+                    self.add_file_to_dictionary(path, file_path)
+                return self.serve(self.files[path], request)
+            # Pruned bundles must not be served from the stale registry
+            self.files.pop(path, None)
+        # WhiteNoiseMiddleware.__call__, which only runs synchronously
+        static_file = self.find_file(path) if self.autorefresh else self.files.get(path)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return None
+
+    def immutable_file_test(self, path, url):
+        if url.startswith(self.snapshot_prefix):
+            return True
+        return super().immutable_file_test(path, url)
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="resourceupdate",
+            name="timestamp",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0002_resourceupdate_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resource",
+            name="external_id",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
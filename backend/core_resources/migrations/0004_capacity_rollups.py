@@ -0,0 +1,71 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0003_resource_external_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RollupCursor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("position", models.BigIntegerField(default=0)),
+                ("state", models.JSONField(default=dict)),
+            ],
+            options={
+                "db_table": "rollup_cursors",
+            },
+        ),
+        migrations.CreateModel(
+            name="CapacityRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("series", models.CharField(max_length=120)),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[
+                            ("minute", "Minute"),
+                            ("hour", "Hour"),
+                            ("day", "Day"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("min_available", models.IntegerField()),
+                ("max_available", models.IntegerField()),
+                ("last_available", models.IntegerField()),
+                ("sum_available", models.BigIntegerField()),
+                ("update_count", models.IntegerField()),
+                ("last_at", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "capacity_rollups",
+                "ordering": ["bucket"],
+                "unique_together": {("series", "resolution", "bucket")},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0004_capacity_rollups"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="resourceupdate",
+            index=models.Index(
+                fields=["resource", "timestamp"], name="resource_up_resourc_111bab_idx"
+            ),
+        ),
+    ]
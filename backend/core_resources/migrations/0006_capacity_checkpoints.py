@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0005_resourceupdate_resource_timestamp_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CapacityCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("taken_at", models.DateTimeField(db_index=True)),
+                ("state", models.JSONField(default=dict)),
+            ],
+            options={
+                "db_table": "capacity_checkpoints",
+                "ordering": ["-taken_at"],
+            },
+        ),
+    ]
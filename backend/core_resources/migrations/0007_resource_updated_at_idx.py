@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0006_capacity_checkpoints"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="resource",
+            index=models.Index(
+                fields=["updated_at"], name="resources_updated_f6f6cb_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0008_duplicate_candidates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="region",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0010_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resource",
+            name="image_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
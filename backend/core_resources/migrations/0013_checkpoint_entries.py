@@ -0,0 +1,69 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_state(apps, schema_editor):
+    """Move each checkpoint's ``state`` JSON into entry rows"""
+    db = schema_editor.connection.alias
+    Checkpoint = apps.get_model("core_resources", "CapacityCheckpoint")
+    Entry = apps.get_model("core_resources", "CapacityCheckpointEntry")
+    for pk in Checkpoint.objects.using(db).values_list("pk", flat=True):
+        state = Checkpoint.objects.using(db).values_list("state", flat=True).get(pk=pk)
+        Entry.objects.using(db).bulk_create(
+            [
+                Entry(checkpoint_id=pk, resource_id=int(resource_id), available_capacity=available, status=status)
+                for resource_id, (available, status) in state.items()
+            ],
+            batch_size=5000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_resources", "0012_user_references_without_constraints"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CapacityCheckpointEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resource_id", models.BigIntegerField()),
+                ("available_capacity", models.IntegerField()),
+                ("status", models.CharField(max_length=10)),
+                (
+                    "checkpoint",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entries",
+                        to="core_resources.capacitycheckpoint",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "capacity_checkpoint_entries",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="capacitycheckpointentry",
+            constraint=models.UniqueConstraint(
+                fields=("checkpoint", "resource_id"), name="checkpoint_entry_unique"
+            ),
+        ),
+        migrations.RunPython(copy_state, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="capacitycheckpoint",
+            name="state",
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class User(AbstractUser):
@@ -12,6 +13,7 @@ class User(AbstractUser):
     
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='citizen')
     phone_number = models.CharField(max_length=15, blank=True)
+    region = models.CharField(max_length=100, blank=True)  # For alert notifications
     is_approved = models.BooleanField(default=True)  # Auto-approve citizens
     
     class Meta:
@@ -41,6 +43,8 @@ class Resource(models.Model):
         ('full', 'At Full Capacity'),
     ]
     
+    # Identifier in an external facility registry, used to upsert imports
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
     type = models.CharField(max_length=20, choices=TYPE_CHOICES)
     description = models.TextField()
@@ -56,14 +60,19 @@ class Resource(models.Model):
     contact = models.CharField(max_length=15)
     helpline = models.CharField(max_length=15, blank=True)
     image = models.ImageField(upload_to='resources/', blank=True, null=True)
+    # SHA-256 of the upload once its variants are built (see core_resources.images)
+    image_hash = models.CharField(max_length=64, blank=True)
     
     verified = models.BooleanField(default=False)
+    # No database-level constraints on user references: with sharding
+    # (core_resources.shards) resources and users live in different databases
     verified_by = models.ForeignKey(
         User, 
         on_delete=models.SET_NULL, 
         null=True, 
         blank=True,
-        related_name='verified_resources'
+        related_name='verified_resources',
+        db_constraint=False,
     )
     coordinator = models.ForeignKey(
         User,
@@ -71,7 +80,8 @@ class Resource(models.Model):
         null=True,
         blank=True,
         related_name='managed_resources',
-        limit_choices_to={'role': 'coordinator'}
+        limit_choices_to={'role': 'coordinator'},
+        db_constraint=False,
     )
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -84,6 +94,8 @@ class Resource(models.Model):
             models.Index(fields=['type', 'status']),
             models.Index(fields=['latitude', 'longitude']),
             models.Index(fields=['region']),
+            # Incremental coverage grid sync reads recently changed rows
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -98,8 +110,9 @@ class Resource(models.Model):
 class ResourceUpdate(models.Model):
     """Audit log for resource updates"""
     resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='updates')
-    coordinator = models.ForeignKey(User, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    coordinator = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    # Set by the caller so write-behind audit rows keep their event time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     change_log = models.TextField()
     previous_capacity = models.IntegerField()
     new_capacity = models.IntegerField()
@@ -107,6 +120,162 @@ class ResourceUpdate(models.Model):
     class Meta:
         db_table = 'resource_updates'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['resource', 'timestamp']),
+        ]
     
     def __str__(self):
         return f"{self.resource.name} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class CapacityRollup(models.Model):
+    """Pre-aggregated available capacity per time bucket.
+
+    ``series`` is ``resource:<id>`` for a single resource or
+    ``region:<key>`` for the summed capacity of a region.
+    """
+    RESOLUTION_CHOICES = [
+        ('minute', 'Minute'),
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    series = models.CharField(max_length=120)
+    resolution = models.CharField(max_length=10, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField()
+    min_available = models.IntegerField()
+    max_available = models.IntegerField()
+    last_available = models.IntegerField()
+    sum_available = models.BigIntegerField()
+    update_count = models.IntegerField()
+    last_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'capacity_rollups'
+        ordering = ['bucket']
+        unique_together = [('series', 'resolution', 'bucket')]
+
+    @property
+    def avg_available(self):
+        return self.sum_available / self.update_count if self.update_count else None
+
+    def __str__(self):
+        return f"{self.series} {self.resolution} {self.bucket:%Y-%m-%d %H:%M}"
+
+
+class RollupCursor(models.Model):
+    """Last ResourceUpdate id folded into the rollups"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    # Running totals carried between batches (e.g. capacity per region)
+    state = models.JSONField(default=dict)
+
+    class Meta:
+        db_table = 'rollup_cursors'
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class CapacityCheckpoint(models.Model):
+    """Available capacity and status of every resource at one moment.
+
+    Each resource's values are a ``CapacityCheckpointEntry``; past state
+    is rebuilt from the nearest checkpoint plus later audit rows.
+    """
+    taken_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'capacity_checkpoints'
+        ordering = ['-taken_at']
+
+    def __str__(self):
+        return f"Checkpoint {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class CapacityCheckpointEntry(models.Model):
+    """One resource's available capacity and status in a checkpoint"""
+    checkpoint = models.ForeignKey(CapacityCheckpoint, on_delete=models.CASCADE, related_name='entries')
+    # Not a foreign key: entries outlive deleted resources
+    resource_id = models.BigIntegerField()
+    available_capacity = models.IntegerField()
+    status = models.CharField(max_length=10)
+
+    class Meta:
+        db_table = 'capacity_checkpoint_entries'
+        constraints = [
+            models.UniqueConstraint(fields=['checkpoint', 'resource_id'], name='checkpoint_entry_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.checkpoint} #{self.resource_id}"
+
+
+class DuplicateCandidate(models.Model):
+    """Two resources that look like the same facility.
+
+    ``resource`` is the newer entry and ``duplicate_of`` the older one it
+    would be merged into; ``score`` is the name similarity (0 to 1).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending Review'),
+        ('dismissed', 'Not a Duplicate'),
+    ]
+
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='duplicate_candidates')
+    duplicate_of = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    distance_m = models.FloatField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'duplicate_candidates'
+        ordering = ['-score']
+        unique_together = [('resource', 'duplicate_of')]
+        indexes = [
+            models.Index(fields=['status', 'score']),
+        ]
+
+    def __str__(self):
+        return f"{self.resource_id} ~ {self.duplicate_of_id} ({self.score:.2f})"
+
+
+class Job(models.Model):
+    """Background job queued in the database and run by `manage.py run_jobs`"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    task = models.CharField(max_length=100)
+    args = models.JSONField(default=dict, blank=True)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    # Set while queued; a second enqueue with the same key reuses the job
+    unique_key = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
@@ -0,0 +1,176 @@
+"""Candidate selection and ranking for the ``nearby`` endpoint.
+
+Filters run in the database: a bounding box around the search circle
+(served by the ``(latitude, longitude)`` index) plus status, minimum
+free capacity and verification. Only the surviving rows get an exact
+distance, and only the ranked rows that are returned are loaded in full
+and serialized.
+"""
+import math
+
+from . import shards
+from .coverage import KM_PER_DEGREE
+
+RANKINGS = ('distance', 'available', 'best')
+MAX_DISTANCE_KM = 200
+MAX_LIMIT = 500
+
+# Weights for ``rank=best``; lower scores rank first. Distance contributes
+# 0..1 across the search radius.
+STATUS_PENALTY = {'open': 0.0, 'full': 1.0, 'closed': 2.0}
+UNVERIFIED_PENALTY = 0.25
+CROWDING_WEIGHT = 0.5
+
+
+class NearbyError(ValueError):
+    pass
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points in kilometers"""
+    R = 6371  # Earth radius in km
+
+    lat1, lon1, lat2, lon2 = map(math.radians, [float(lat1), float(lon1), float(lat2), float(lon2)])
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return R * c
+
+
+def _flag(value, name):
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise NearbyError(f'{name} must be true or false')
+
+
+def parse_params(params):
+    """Validate the ``nearby`` query parameters into a dict"""
+    lat, lon = params.get('lat'), params.get('lon')
+    if not lat or not lon:
+        raise NearbyError('Latitude and longitude required')
+    try:
+        lat, lon = float(lat), float(lon)
+        max_distance = float(params.get('max_distance', 10))
+        min_available = params.get('min_available')
+        min_available = int(min_available) if min_available else None
+        limit = params.get('limit')
+        limit = int(limit) if limit else None
+    except ValueError:
+        raise NearbyError('lat, lon, max_distance, min_available and limit must be numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise NearbyError('lat or lon out of range')
+    if not 0 < max_distance <= MAX_DISTANCE_KM:
+        raise NearbyError(f'max_distance must be in (0, {MAX_DISTANCE_KM}]')
+    if min_available is not None and min_available < 0:
+        raise NearbyError('min_available must not be negative')
+    if limit is not None and not 1 <= limit <= MAX_LIMIT:
+        raise NearbyError(f'limit must be between 1 and {MAX_LIMIT}')
+    rank = params.get('rank', 'distance')
+    if rank not in RANKINGS:
+        raise NearbyError(f'rank must be one of {", ".join(RANKINGS)}')
+    verified = params.get('verified')
+    return {
+        'lat': lat,
+        'lon': lon,
+        'max_distance': max_distance,
+        'min_available': min_available,
+        'verified': _flag(verified, 'verified') if verified else None,
+        'rank': rank,
+        'limit': limit,
+    }
+
+
+def bounding_box(lat, lon, radius_km):
+    """``(south, north, west, east)`` enclosing the circle; longitudes may span everything"""
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(lat - dlat, -90), min(lat + dlat, 90)
+    # Longitude degrees are shortest at the box edge farthest from the equator
+    widest = max(abs(south), abs(north))
+    if widest >= 89.9:
+        return south, north, -180, 180
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+    if dlon >= 180:
+        return south, north, -180, 180
+    return south, north, lon - dlon, lon + dlon
+
+
+def candidates(queryset, options):
+    """Apply the pushed-down filters to ``queryset``"""
+    south, north, west, east = bounding_box(options['lat'], options['lon'], options['max_distance'])
+    queryset = queryset.filter(latitude__range=(south, north))
+    # A box that crosses the antimeridian leaves longitude to the exact check
+    if -180 < west and east < 180:
+        queryset = queryset.filter(longitude__range=(west, east))
+    if options['min_available'] is not None:
+        queryset = queryset.filter(available_capacity__gte=options['min_available'])
+    if options['verified'] is not None:
+        queryset = queryset.filter(verified=options['verified'])
+    return queryset
+
+
+def _sort_key(rank, max_distance):
+    if rank == 'available':
+        # Resources that can take people first, most room first
+        return lambda row: (STATUS_PENALTY[row[4]], -row[3], row[1])
+
+    if rank == 'best':
+        def score(row):
+            _, distance, capacity, available, status, verified = row
+            crowding = 1 - available / capacity if capacity else 1
+            return (
+                distance / max_distance
+                + STATUS_PENALTY[status]
+                + CROWDING_WEIGHT * crowding
+                + (0 if verified else UNVERIFIED_PENALTY),
+                distance,
+            )
+        return score
+
+    return lambda row: row[1]
+
+
+FIELDS = ('id', 'latitude', 'longitude', 'capacity', 'available_capacity', 'status', 'verified')
+
+
+def candidate_values(queryset, options):
+    """``FIELDS`` of the candidate rows, for ``within()``"""
+    return candidates(queryset, options).order_by().values_list(*FIELDS)
+
+
+def within(values, options):
+    """Rows of ``candidate_values()`` inside the search circle, with their distance"""
+    lat, lon, max_distance = options['lat'], options['lon'], options['max_distance']
+    rows = []
+    for pk, latitude, longitude, capacity, available, status, verified in values:
+        distance = haversine_distance(lat, lon, latitude, longitude)
+        if distance <= max_distance:
+            rows.append((pk, distance, capacity, available, status, verified))
+    return rows
+
+
+def _rows(queryset, options):
+    return within(candidate_values(queryset, options), options)
+
+
+def rank(rows, options):
+    rows.sort(key=_sort_key(options['rank'], options['max_distance']))
+    if options['limit']:
+        del rows[options['limit']:]
+    return [(row[0], round(row[1], 2)) for row in rows]
+
+
+def rank_nearby(queryset, options):
+    """Ids of matching resources in ranked order with their distances (km)"""
+    # The search circle can cross regions, so every shard is searched
+    return rank([row for _, part in shards.gather(_rows, queryset, options) for row in part], options)
+
+
+async def arank_nearby(queryset, options):
+    """``rank_nearby()`` with the async ORM; sharding must be off"""
+    return rank(within([row async for row in candidate_values(queryset, options)], options), options)
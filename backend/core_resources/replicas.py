@@ -0,0 +1,174 @@
+"""Route safe reads to read replicas.
+
+Only reads made while serving a GET, HEAD or OPTIONS request go to a
+replica (see ``ReplicaMiddleware``); management commands, job workers
+and unsafe requests use the primary. Each request picks one replica, so
+all of its reads come from the same snapshot.
+
+Read-your-writes: once a request writes, its remaining reads go to the
+primary, and the client is pinned to the primary by a cookie for
+``DB_REPLICA_MAX_LAG`` seconds. Replicas reporting more lag than that
+(or stopped replication) are skipped; with none left, reads fall back to
+the primary.
+"""
+import contextvars
+import logging
+import math
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_primary_until'
+LAG_CHECK_INTERVAL = 5  # seconds
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_UNSET = object()
+
+
+class _RequestState:
+    __slots__ = ('allowed', 'alias', 'wrote')
+
+    def __init__(self, allowed):
+        self.allowed = allowed
+        self.alias = _UNSET
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('replica_state', default=None)
+_lag = {}
+_lag_lock = threading.Lock()
+
+
+def replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind, or ``None`` if it is not replicating"""
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        return 0.0
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('SHOW REPLICA STATUS')
+        except DatabaseError:
+            cursor.execute('SHOW SLAVE STATUS')  # MySQL before 8.0.22
+        row = cursor.fetchone()
+        columns = [column[0] for column in cursor.description or ()]
+    if row is None:
+        # Not a classic async replica (e.g. a managed reader endpoint)
+        return 0.0
+    status = dict(zip(columns, row))
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+def _healthy(alias, now):
+    with _lag_lock:
+        checked = _lag.get(alias)
+        if checked and now - checked[0] < LAG_CHECK_INTERVAL:
+            return checked[1]
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError as exc:
+        logger.warning('Replica %s unavailable: %s', alias, exc)
+        lag = None
+    healthy = lag is not None and lag <= settings.DB_REPLICA_MAX_LAG
+    if not healthy:
+        logger.info('Skipping replica %s (lag %s)', alias, lag)
+    with _lag_lock:
+        _lag[alias] = (now, healthy)
+    return healthy
+
+
+def choose_replica():
+    """A random healthy replica alias, or ``None``"""
+    now = time.monotonic()
+    healthy = [alias for alias in replicas() if _healthy(alias, now)]
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.allowed or state.wrote:
+            return 'default'
+        if state.alias is _UNSET:
+            state.alias = choose_replica()
+        return state.alias or 'default'
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or instances loaded from a replica would be saved there
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {'default', *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """Allow replica reads for safe requests from clients not pinned to the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+        state = self._state(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(state, response)
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+        state = self._state(request)
+        # Context variables reach the ORM's sync_to_async threads
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(state, response)
+
+    def _state(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return _RequestState(allowed=request.method in SAFE_METHODS and not pinned)
+
+    def _pin(self, state, response):
+        if state.wrote:
+            lag = settings.DB_REPLICA_MAX_LAG
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + lag:.3f}', max_age=math.ceil(lag), httponly=True, samesite='Lax',
+            )
+        return response
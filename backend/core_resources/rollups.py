@@ -0,0 +1,248 @@
+"""Incremental capacity time-series rollups built from ResourceUpdate rows.
+
+New audit rows are folded, in id order, into minute/hour/day buckets
+for each resource and for each region, so charts read a few hundred
+pre-aggregated rows instead of scanning the raw audit log. A region's
+value is the summed available capacity of its resources, carried
+forward from update to update and reconciled with the live table at the
+start of every run (resources created, moved or changed without an
+audit row).
+
+Ids the cursor passes without a row may belong to inserts that commit
+later (a write-behind journal batch, a slow transaction). They are kept
+as gaps in the cursor state and re-checked on every run for
+``GAP_TTL``; ids that never show up (rolled back, deleted) then expire.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import shards
+from .models import CapacityRollup, Resource, ResourceUpdate, RollupCursor
+from .snapshots import region_key
+
+CURSOR_NAME = 'capacity'
+RESOLUTIONS = ('minute', 'hour', 'day')
+DEFAULT_SPAN = {
+    'minute': timedelta(hours=2),
+    'hour': timedelta(days=2),
+    'day': timedelta(days=60),
+}
+GAP_TTL = timedelta(minutes=10)
+MAX_GAPS = 1000  # the oldest are dropped beyond this
+ROW_FIELDS = ('id', 'resource_id', 'resource__region', 'timestamp', 'previous_capacity', 'new_capacity')
+
+STAT_FIELDS = [
+    'min_available', 'max_available', 'last_available',
+    'sum_available', 'update_count', 'last_at',
+]
+
+
+def resource_series(resource_id):
+    return f'resource:{resource_id}'
+
+
+def region_series(region):
+    return f'region:{region_key(region)}'
+
+
+def truncate(ts, resolution):
+    """Start of the bucket containing ``ts``, in the project time zone"""
+    local = timezone.localtime(ts).replace(second=0, microsecond=0)
+    if resolution in ('hour', 'day'):
+        local = local.replace(minute=0)
+    if resolution == 'day':
+        local = local.replace(hour=0)
+    return local
+
+
+class _Stats:
+    __slots__ = STAT_FIELDS
+
+    def __init__(self, value, at):
+        self.min_available = self.max_available = self.last_available = value
+        self.sum_available = value
+        self.update_count = 1
+        self.last_at = at
+
+    def add(self, value, at):
+        self.min_available = min(self.min_available, value)
+        self.max_available = max(self.max_available, value)
+        self.sum_available += value
+        self.update_count += 1
+        if at >= self.last_at:
+            self.last_available, self.last_at = value, at
+
+    def merge_into(self, row):
+        row.min_available = min(row.min_available, self.min_available)
+        row.max_available = max(row.max_available, self.max_available)
+        row.sum_available += self.sum_available
+        row.update_count += self.update_count
+        if self.last_at >= row.last_at:
+            row.last_available, row.last_at = self.last_available, self.last_at
+
+
+def _missing(low, high, ids):
+    """Ranges in ``[low, high]`` not covered by the sorted ``ids``"""
+    ranges, expected = [], low
+    for update_id in ids:
+        if update_id > expected:
+            ranges.append((expected, update_id - 1))
+        expected = max(expected, update_id + 1)
+    if expected <= high:
+        ranges.append((expected, high))
+    return ranges
+
+
+def _in_gaps(gaps):
+    query = Q(pk__in=[])
+    for low, high, _ in gaps:
+        query |= Q(id__range=(low, high))
+    return query
+
+
+def _region_totals(position, gaps):
+    """Capacity per region key as of the folded rows, from the live table"""
+    totals = {}
+    for region, total in Resource.objects.order_by().values_list('region').annotate(total=Sum('available_capacity')):
+        key = region_key(region)
+        totals[key] = totals.get(key, 0) + (total or 0)
+    # Committed changes whose audit rows are not folded yet
+    unfolded = ResourceUpdate.objects.filter(Q(id__gt=position) | _in_gaps(gaps))
+    for region, delta in unfolded.order_by().values_list('resource__region').annotate(
+        delta=Sum(F('new_capacity') - F('previous_capacity'))
+    ):
+        key = region_key(region)
+        totals[key] = totals.get(key, 0) - (delta or 0)
+    return totals
+
+
+def _refill(gaps):
+    """``(rows, gaps)``: rows that committed inside earlier gaps, and the gaps still open"""
+    if not gaps:
+        return [], []
+    rows = list(ResourceUpdate.objects.filter(_in_gaps(gaps)).order_by('id').values_list(*ROW_FIELDS))
+    ids = [row[0] for row in rows]
+    still_open = []
+    for low, high, seen in gaps:
+        inside = [update_id for update_id in ids if low <= update_id <= high]
+        still_open += [[start, end, seen] for start, end in _missing(low, high, inside)]
+    return rows, still_open
+
+
+def _fold(rows, totals):
+    buckets = {}
+
+    def add(series, value, at):
+        for resolution in RESOLUTIONS:
+            key = (series, resolution, truncate(at, resolution))
+            stats = buckets.get(key)
+            if stats is None:
+                buckets[key] = _Stats(value, at)
+            else:
+                stats.add(value, at)
+
+    for _, resource_id, region, at, previous, new in rows:
+        add(resource_series(resource_id), new, at)
+        key = region_key(region)
+        totals[key] = totals.get(key, 0) + new - previous
+        add(region_series(region), totals[key], at)
+
+    existing = {
+        (row.series, row.resolution, row.bucket): row
+        for row in CapacityRollup.objects.filter(
+            series__in={k[0] for k in buckets},
+            resolution__in=RESOLUTIONS,
+            bucket__in={k[2] for k in buckets},
+        )
+    }
+    to_create, to_update = [], []
+    for (series, resolution, bucket), stats in buckets.items():
+        row = existing.get((series, resolution, bucket))
+        if row is None:
+            to_create.append(CapacityRollup(
+                series=series, resolution=resolution, bucket=bucket,
+                **{field: getattr(stats, field) for field in STAT_FIELDS}
+            ))
+        else:
+            stats.merge_into(row)
+            to_update.append(row)
+    CapacityRollup.objects.bulk_create(to_create)
+    CapacityRollup.objects.bulk_update(to_update, STAT_FIELDS, batch_size=200)
+
+
+def update_rollups(batch_size=5000):
+    """Fold audit rows added since the last run; returns rows processed"""
+    processed = 0
+    reconciled = False
+    while True:
+        now = timezone.now()
+        with transaction.atomic(using=shards.db()):
+            cursor, _ = RollupCursor.objects.select_for_update().get_or_create(name=CURSOR_NAME)
+            state = cursor.state
+            refilled, gaps = [], state.get('gaps', [])
+            if not reconciled:
+                # Once per run, as this scans every unfolded row
+                cutoff = (now - GAP_TTL).isoformat()
+                gaps = [gap for gap in gaps if gap[2] > cutoff][-MAX_GAPS:]
+                state['region_totals'] = _region_totals(cursor.position, gaps)
+                refilled, gaps = _refill(gaps)
+                reconciled = True
+            new_rows = ResourceUpdate.objects.filter(id__gt=cursor.position).order_by('id')
+            rows = list(new_rows.values_list(*ROW_FIELDS)[:batch_size])
+            if rows:
+                seen = now.isoformat()
+                gaps += [
+                    [low, high, seen]
+                    for low, high in _missing(cursor.position + 1, rows[-1][0], [row[0] for row in rows])
+                ]
+                cursor.position = rows[-1][0]
+            if refilled or rows:
+                _fold(refilled + rows, state['region_totals'])
+            state['gaps'] = gaps[-MAX_GAPS:]
+            cursor.save(update_fields=['position', 'state'])
+        processed += len(refilled) + len(rows)
+        if len(rows) < batch_size:
+            return processed
+
+
+def parse_range(params):
+    """Read ``resolution``, ``start`` and ``end`` query parameters"""
+    resolution = params.get('resolution', 'hour')
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f'resolution must be one of {", ".join(RESOLUTIONS)}')
+    end = parse_datetime(params['end']) if params.get('end') else timezone.now()
+    if end is None:
+        raise ValueError('start and end must be ISO 8601 timestamps')
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    start = parse_datetime(params['start']) if params.get('start') else end - DEFAULT_SPAN[resolution]
+    if start is None:
+        raise ValueError('start and end must be ISO 8601 timestamps')
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if start > end:
+        raise ValueError('start must not be after end')
+    return resolution, start, end
+
+
+def series_points(series, resolution, start, end):
+    """Rollup points for one series in ``[start, end)``, oldest first"""
+    rows = CapacityRollup.objects.filter(
+        series=series, resolution=resolution,
+        bucket__gte=truncate(start, resolution), bucket__lt=end,
+    ).order_by('bucket').values_list('bucket', *STAT_FIELDS[:-1])
+    return [
+        {
+            'bucket': bucket,
+            'min': low,
+            'max': high,
+            'last': last,
+            'avg': round(total / count, 2) if count else None,
+            'count': count,
+        }
+        for bucket, low, high, last, total, count in rows
+    ]
@@ -1,12 +1,14 @@
 from rest_framework import serializers
-from .models import User, Resource, ResourceUpdate
+from .models import User, Resource, ResourceUpdate, DuplicateCandidate, Job
+from .capacity import coalescer
+from .images import variant_urls
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'password', 'role', 'phone_number', 
+        fields = ['id', 'username', 'email', 'password', 'role', 'phone_number', 'region',
                   'is_approved', 'date_joined', 'first_name', 'last_name']
         read_only_fields = ['id', 'date_joined']
     
@@ -17,6 +19,7 @@ class UserSerializer(serializers.ModelSerializer):
             password=validated_data['password'],
             role=validated_data.get('role', 'citizen'),
             phone_number=validated_data.get('phone_number', ''),
+            region=validated_data.get('region', ''),
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', '')
         )
@@ -41,8 +44,35 @@ class ResourceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Resource
         fields = '__all__'
-        read_only_fields = ['created_at', 'updated_at', 'verified', 'verified_by']
+        read_only_fields = ['created_at', 'updated_at', 'verified', 'verified_by', 'image_hash']
     
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['image_variants'] = self._image_variants(instance)
+        if data['image_variants'] and self.context.get('thumbnails'):
+            # List responses link the smallest variant rather than the full-size photo
+            smallest = list(data['image_variants'].values())[-1]
+            data['image'] = smallest['webp']
+        if 'as_of' in self.context:
+            # Historical view (see ResourceViewSet.list); capacity was rebuilt already
+            data['as_of'] = self.context['as_of']
+            return data
+        # Show coalesced capacity changes that are not written yet
+        pending = coalescer.peek(instance.pk)
+        if pending is not None:
+            data['available_capacity'], data['status'] = pending
+        return data
+    
+    def _image_variants(self, instance):
+        variants = variant_urls(instance)
+        request = self.context.get('request')
+        if variants and request is not None:
+            variants = {
+                name: {fmt: request.build_absolute_uri(url) for fmt, url in urls.items()}
+                for name, urls in variants.items()
+            }
+        return variants
+
     def get_distance(self, obj):
         # Distance will be calculated in the view
         return getattr(obj, 'distance', None)
@@ -68,3 +98,24 @@ class ResourceUpdateSerializer(serializers.ModelSerializer):
         model = ResourceUpdate
         fields = '__all__'
         read_only_fields = ['timestamp']
+
+
+class DuplicateCandidateSerializer(serializers.ModelSerializer):
+    resource_name = serializers.CharField(source='resource.name', read_only=True)
+    duplicate_of_name = serializers.CharField(source='duplicate_of.name', read_only=True)
+
+    class Meta:
+        model = DuplicateCandidate
+        fields = '__all__'
+
+
+class JobSerializer(serializers.ModelSerializer):
+    created_by_name = serializers.CharField(source='created_by.username', read_only=True, default=None)
+
+    class Meta:
+        model = Job
+        exclude = ['unique_key', 'locked_until']
+        read_only_fields = [
+            'status', 'attempts', 'max_attempts', 'run_at', 'worker', 'result', 'error',
+            'created_by', 'created_at', 'started_at', 'finished_at',
+        ]
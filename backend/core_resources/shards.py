@@ -0,0 +1,327 @@
+"""Optional sharding of resource data by region.
+
+With ``DB_SHARD_URLS`` set, resources and everything recorded about them
+(audit rows, rollups, checkpoints, duplicate candidates) live in one
+database per shard; users, alerts and jobs stay in ``default``. A region
+belongs to the shard ``SHARD_REGIONS`` names for its normalized key, or
+to one picked by a stable hash of the key.
+
+Each shard hands out ids from its own range (shard ``n`` starts at
+``n * ID_SPAN``, see ``manage.py init_shards``), so an id alone tells
+which shard holds a row. Code selects a shard with ``use()``; queries on
+sharded models without a selected shard raise ``ShardError`` instead of
+silently reading the wrong database. ``gather()`` runs a function on
+every shard in parallel for cross-region queries.
+"""
+import heapq
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+
+from .snapshots import region_key
+
+ID_SPAN = 10 ** 12
+STREAM_PREFETCH = 4  # chunks buffered per shard by stream()
+SHARDED_MODELS = {
+    'resource', 'resourceupdate', 'capacityrollup', 'rollupcursor', 'capacitycheckpoint', 'capacitycheckpointentry',
+    'duplicatecandidate',
+}
+
+_current = ContextVar('shard', default=None)
+
+
+class ShardError(Exception):
+    pass
+
+
+def enabled():
+    return bool(settings.DATABASE_SHARDS)
+
+
+def aliases():
+    return settings.DATABASE_SHARDS
+
+
+def is_sharded(model):
+    return enabled() and model._meta.app_label == 'core_resources' and model._meta.model_name in SHARDED_MODELS
+
+
+def shard_for_region(region):
+    key = region_key(region)
+    name = settings.SHARD_REGIONS.get(key)
+    if name is not None:
+        return f'shard_{name}'
+    return aliases()[zlib.crc32(key.encode()) % len(aliases())]
+
+
+def shard_for_id(pk):
+    """Shard holding the row with this id, or ``None`` for an id outside every range"""
+    try:
+        index = int(pk) // ID_SPAN - 1
+    except (TypeError, ValueError):
+        return None
+    return aliases()[index] if 0 <= index < len(aliases()) else None
+
+
+def id_range(alias):
+    start = (aliases().index(alias) + 1) * ID_SPAN
+    return start, start + ID_SPAN
+
+
+def sharded_models():
+    return [model for model in apps.get_app_config('core_resources').get_models()
+            if model._meta.model_name in SHARDED_MODELS]
+
+
+def start_ids(alias):
+    """Move every sharded table's id sequence on ``alias`` into the shard's range"""
+    start, end = id_range(alias)
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in sharded_models():
+            table = model._meta.db_table
+            cursor.execute(f'SELECT MAX(id) FROM {connection.ops.quote_name(table)}')
+            highest = cursor.fetchone()[0] or 0
+            if highest >= end:
+                raise ShardError(f'{alias}.{table} has ids past its range')
+            if highest >= start:
+                continue
+            if connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start - 1])
+            elif connection.vendor == 'mysql':
+                cursor.execute(f'ALTER TABLE {connection.ops.quote_name(table)} AUTO_INCREMENT = {start}')
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, false)", [table, start])
+            else:
+                raise ShardError(f'Cannot set id sequences on {connection.vendor}')
+    return start, end
+
+
+def current():
+    return _current.get()
+
+
+def db():
+    """Alias for transactions around sharded queries: the selected shard, else ``default``"""
+    return _current.get() or 'default'
+
+
+@contextmanager
+def use(alias):
+    """Send queries on sharded models to ``alias`` inside the block"""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def use_for_id(pk):
+    """``use()`` for the shard holding ``pk``; a no-op when sharding is off"""
+    if not enabled():
+        return nullcontext()
+    alias = shard_for_id(pk)
+    if alias is None:
+        raise ShardError(f'Id {pk} is outside every shard range')
+    return use(alias)
+
+
+def use_for_region(region):
+    if not enabled():
+        return nullcontext()
+    return use(shard_for_region(region))
+
+
+def _run(alias, func, args, kwargs):
+    with use(alias):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Pool threads are reused; do not leave connections open
+            connections.close_all()
+
+
+def gather(func, *args, **kwargs):
+    """``[(alias, func(*args, **kwargs))]`` for every shard, run in parallel.
+
+    With sharding off this is ``[(None, func(...))]`` in the calling thread.
+    """
+    if not enabled():
+        return [(None, func(*args, **kwargs))]
+    with ThreadPoolExecutor(max_workers=len(aliases()), thread_name_prefix='shard') as pool:
+        futures = [(alias, pool.submit(_run, alias, func, args, kwargs)) for alias in aliases()]
+        return [(alias, future.result()) for alias, future in futures]
+
+
+def by_shard(items, key=lambda item: item.pk):
+    """``{alias: [items]}`` grouped by the shard of ``key(item)`` (``{None: items}`` when off)"""
+    if not enabled():
+        return {None: list(items)}
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_for_id(key(item)), []).append(item)
+    return groups
+
+
+def _list(queryset):
+    # A copy: the same queryset is evaluated in several threads
+    return list(queryset.all())
+
+
+def gather_list(queryset):
+    """Rows of ``queryset`` from every shard, in shard order"""
+    return [row for _, rows in gather(_list, queryset) for row in rows]
+
+
+def _in_bulk(queryset, ids):
+    alias = current()
+    return queryset.in_bulk([pk for pk in ids if alias is None or shard_for_id(pk) == alias])
+
+
+def in_bulk(queryset, ids):
+    """``queryset.in_bulk(ids)`` with each shard asked for its own ids"""
+    found = {}
+    for _, part in gather(_in_bulk, queryset, ids):
+        found.update(part)
+    return found
+
+
+def _head(queryset, end):
+    return queryset.count(), list(queryset[:end])
+
+
+def gather_page(queryset, offset, limit, key):
+    """``(count, rows[offset:offset + limit])`` of ``queryset`` over every shard.
+
+    ``queryset`` must be ordered descending by ``key``. Each shard returns
+    its first ``offset + limit`` rows and the lists are merged, so deep
+    pages cost more than shallow ones.
+    """
+    if not enabled():
+        return queryset.count(), list(queryset[offset:offset + limit])
+    results = [part for _, part in gather(_head, queryset, offset + limit)]
+    merged = heapq.merge(*(rows for _, rows in results), key=key, reverse=True)
+    rows = [row for i, row in zip(range(offset + limit), merged) if i >= offset]
+    return sum(count for count, _ in results), rows
+
+
+def _produce(alias, func, args, out, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        with use(alias):
+            for chunk in func(*args):
+                if not put((True, chunk)):
+                    return
+        put((False, None))
+    except BaseException as exc:
+        put((False, exc))
+    finally:
+        connections.close_all()
+
+
+def stream(func, *args):
+    """Yield the chunks of ``func(*args)`` from every shard in shard order.
+
+    All shards are read at once in threads, each buffering at most
+    ``STREAM_PREFETCH`` chunks, so later shards are ready when the
+    earlier ones are done. With ids ranged by shard, shard order is id
+    order.
+    """
+    if not enabled():
+        yield from func(*args)
+        return
+    stop = threading.Event()
+    buffers = [queue.Queue(STREAM_PREFETCH) for _ in aliases()]
+    threads = [
+        threading.Thread(target=_produce, args=(alias, func, args, out, stop), name=f'stream-{alias}', daemon=True)
+        for alias, out in zip(aliases(), buffers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for out in buffers:
+            while True:
+                more, item = out.get()
+                if more:
+                    yield item
+                elif item is None:
+                    break
+                else:
+                    raise item
+    finally:
+        # Also runs when the client disconnects mid-download
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def related(queryset, *fields):
+    """``select_related`` for user foreign keys, which cannot be joined on a shard"""
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def each(func, *args, **kwargs):
+    """Run ``func`` once per shard, one shard at a time (or once when sharding is off)"""
+    if not enabled():
+        return [(None, func(*args, **kwargs))]
+    results = []
+    for alias in aliases():
+        with use(alias):
+            results.append((alias, func(*args, **kwargs)))
+    return results
+
+
+class ShardRouter:
+    """Route sharded models to the shard of the instance, its resource or ``use()``"""
+
+    def _route(self, model, hints):
+        if not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and not is_sharded(type(instance)):
+            # e.g. a user assigned to an unsaved resource; save() routes it again
+            return _current.get()
+        if instance is not None:
+            if instance._state.db in aliases():
+                return instance._state.db
+            if instance._meta.model_name == 'resource':
+                # A new resource goes to its region's shard
+                return shard_for_region(instance.region)
+            alias = shard_for_id(getattr(instance, 'resource_id', None))
+            if alias is not None:
+                return alias
+        alias = _current.get()
+        if alias is None:
+            raise ShardError(
+                f'No shard selected for {model.__name__}; wrap the query in core_resources.shards.use()'
+            )
+        return alias
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if enabled():
+            return True
+        return None
@@ -0,0 +1,47 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import metrics, shards
+from .models import Resource, ResourceUpdate, User
+from .snapshots import mark_dirty, rebuilds_on_change, region_key
+
+
+@receiver(pre_save, sender=Resource)
+def resource_saving(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    # Remember the stored region, so a moved resource leaves its old bundle
+    instance._stored_region = None
+    if instance.pk is None or raw or not rebuilds_on_change():
+        return
+    if update_fields is None or 'region' in update_fields:
+        instance._stored_region = (
+            sender.objects.using(using).filter(pk=instance.pk).values_list('region', flat=True).first()
+        )
+
+
+@receiver([post_save, post_delete], sender=Resource)
+def resource_changed(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_stored_region', None)
+    if previous is not None and region_key(previous) != region_key(instance.region):
+        mark_dirty(previous)
+    mark_dirty(instance.region)
+
+
+def _forget_user(user_id):
+    Resource.objects.filter(coordinator_id=user_id).update(coordinator=None)
+    Resource.objects.filter(verified_by_id=user_id).update(verified_by=None)
+    ResourceUpdate.objects.filter(coordinator_id=user_id).delete()
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # The deletion collector only sees the default database; apply the
+    # SET_NULL and CASCADE rules on the shards here
+    if shards.enabled():
+        shards.each(_forget_user, instance.pk)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Count each request's queries for /metrics
+    metrics.instrument(connection)
@@ -0,0 +1,304 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+Anonymous GETs of ``SINGLE_FLIGHT_ROUTES`` (``nearby``, the resource
+list, ``alerts/active``) are keyed by host, path, ``Accept`` and the
+sorted query, with ``lat``, ``lon`` and ``max_distance`` compared as
+numbers. While a response for a key is being computed, identical
+requests in the same worker wait for it and get a copy (marked
+``X-Single-Flight: shared``) instead of running the same queries.
+
+With ``SINGLE_FLIGHT_DIR`` set, the workers on a host coordinate too: the
+worker computing a key holds an ``flock`` on a file there and leaves the
+response next to it. A worker that had to wait for the lock uses that
+response if it was written after the worker's request arrived.
+
+Clients pinned to the primary by ``ReplicaMiddleware`` are not
+coalesced, so they keep reading their own writes. ``stats()`` reports
+per route how many responses were computed and shared, and the compute
+time the sharing saved.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+
+from .middleware import route_name
+from .replicas import PIN_COOKIE
+
+NUMERIC_PARAMS = ('lat', 'lon', 'max_distance')
+LOCK_POLL_INTERVAL = 0.005  # seconds
+SWEEP_AGE = 60  # seconds before files in SINGLE_FLIGHT_DIR are removed
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return repr(number) if math.isfinite(number) else value
+
+
+def flight_key(request):
+    """Key shared by requests with the same response, or ``None`` to skip coalescing"""
+    route = route_name(request)
+    if (
+        route not in settings.SINGLE_FLIGHT_ROUTES or request.method != 'GET'
+        or 'HTTP_AUTHORIZATION' in request.META or PIN_COOKIE in request.COOKIES
+    ):
+        return None
+    query = tuple(
+        (name, tuple(_number(value) for value in values) if name in NUMERIC_PARAMS else tuple(values))
+        for name, values in sorted(request.GET.lists())
+    )
+    # Responses hold absolute URLs, so the host is part of the key
+    return (
+        route, request.scheme, request.META.get('HTTP_HOST', ''), request.path_info,
+        request.headers.get('Accept', ''), query,
+    )
+
+
+class Result:
+    """A response that can be handed to other requests"""
+    __slots__ = ('status', 'headers', 'content', 'elapsed')
+
+    def __init__(self, status, headers, content, elapsed):
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    @classmethod
+    def of(cls, response, elapsed):
+        # Server errors may be transient; waiting requests try for themselves
+        if response.streaming or response.status_code >= 500:
+            return None
+        return cls(response.status_code, list(response.headers.items()), response.content, elapsed)
+
+    def response(self):
+        response = HttpResponse(self.content, status=self.status)
+        for name, value in self.headers:
+            response[name] = value
+        response['X-Single-Flight'] = 'shared'
+        return response
+
+
+def _path(key):
+    return os.path.join(settings.SINGLE_FLIGHT_DIR, hashlib.sha1(repr(key).encode()).hexdigest())
+
+
+_swept_at = 0.0
+
+
+def _sweep(now):
+    global _swept_at
+    if now - _swept_at < SWEEP_AGE:
+        return
+    _swept_at = now
+    with os.scandir(settings.SINGLE_FLIGHT_DIR) as entries:
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime > SWEEP_AGE:
+                    os.remove(entry.path)
+            except OSError:
+                pass  # another worker swept it first
+
+
+def _read(path, since):
+    try:
+        with open(path, 'rb') as fh:
+            header = json.loads(fh.readline())
+            content = fh.read()
+    except (OSError, ValueError):
+        return None
+    if header['written'] < since:
+        return None
+    return Result(header['status'], [tuple(item) for item in header['headers']], content, header['elapsed'])
+
+
+def _write(path, result):
+    header = {
+        'written': time.time(), 'status': result.status, 'headers': result.headers, 'elapsed': result.elapsed,
+    }
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as fh:
+        fh.write(json.dumps(header).encode() + b'\n')
+        fh.write(result.content)
+    os.replace(temporary, path)
+
+
+def _lock(path, arrived):
+    """``(fd, result)``: the key's lock held (``None`` on timeout) and a response another worker wrote"""
+    _sweep(time.time())
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_TIMEOUT
+    waited = False
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                os.close(fd)
+                return None, None
+            waited = True
+            time.sleep(LOCK_POLL_INTERVAL)
+    os.utime(fd)  # keeps a busy key's lock file from being swept
+    return fd, _read(path + '.response', arrived) if waited else None
+
+
+def _unlock(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+class _Call:
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class Flights:
+    """Responses being computed in this worker, by key"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # threads
+        self.futures = {}  # event loop
+        self.counts = {}
+
+    def _count(self, route, name, saved=0.0):
+        with self.lock:
+            counts = self.counts.setdefault(
+                route, {'computed': 0, 'shared': 0, 'shared_across_workers': 0, 'saved_seconds': 0.0},
+            )
+            counts[name] += 1
+            counts['saved_seconds'] += saved
+
+    def stats(self):
+        with self.lock:
+            return {route: dict(counts) for route, counts in self.counts.items()}
+
+    def run(self, key, compute):
+        """``compute()``'s response, or a copy of an identical one computed meanwhile"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        if not leader:
+            if call.done.wait(settings.SINGLE_FLIGHT_TIMEOUT) and call.result is not None:
+                self._count(key[0], 'shared', call.result.elapsed)
+                return call.result.response()
+            return self._compute(key, compute)[0]
+        try:
+            response, call.result = self._compute(key, compute)
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return response
+
+    def _compute(self, key, compute):
+        fd = None
+        if settings.SINGLE_FLIGHT_DIR:
+            fd, result = _lock(_path(key), time.time())
+            if result is not None:
+                _unlock(fd)
+                self._count(key[0], 'shared_across_workers', result.elapsed)
+                return result.response(), result
+        try:
+            started = time.perf_counter()
+            response = compute()
+            result = Result.of(response, time.perf_counter() - started)
+            if fd is not None and result is not None:
+                _write(_path(key) + '.response', result)
+        finally:
+            if fd is not None:
+                _unlock(fd)
+        self._count(key[0], 'computed')
+        return response, result
+
+    async def arun(self, key, compute):
+        """``run()`` for the event loop; ``compute`` is a coroutine function"""
+        future = self.futures.get(key)
+        if future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), settings.SINGLE_FLIGHT_TIMEOUT)
+            except asyncio.TimeoutError:
+                result = None
+            if result is not None:
+                self._count(key[0], 'shared', result.elapsed)
+                return result.response()
+            return (await self._acompute(key, compute))[0]
+        future = self.futures[key] = asyncio.get_running_loop().create_future()
+        result = None
+        try:
+            response, result = await self._acompute(key, compute)
+        finally:
+            del self.futures[key]
+            future.set_result(result)
+        return response
+
+    async def _acompute(self, key, compute):
+        fd = None
+        if settings.SINGLE_FLIGHT_DIR:
+            fd, result = await sync_to_async(_lock, thread_sensitive=False)(_path(key), time.time())
+            if result is not None:
+                _unlock(fd)
+                self._count(key[0], 'shared_across_workers', result.elapsed)
+                return result.response(), result
+        try:
+            started = time.perf_counter()
+            response = await compute()
+            result = Result.of(response, time.perf_counter() - started)
+            if fd is not None and result is not None:
+                await sync_to_async(_write, thread_sensitive=False)(_path(key) + '.response', result)
+        finally:
+            if fd is not None:
+                _unlock(fd)
+        self._count(key[0], 'computed')
+        return response, result
+
+
+flights = Flights()
+
+
+def stats():
+    """``{route: {computed, shared, shared_across_workers, saved_seconds}}`` for this worker"""
+    return flights.stats()
+
+
+class SingleFlightMiddleware:
+    """Share one response among identical concurrent anonymous reads"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        key = flight_key(request)
+        if key is None:
+            return self.get_response(request)
+        return flights.run(key, lambda: self.get_response(request))
+
+    async def __acall__(self, request):
+        key = flight_key(request)
+        if key is None:
+            return await self.get_response(request)
+        return await flights.arun(key, lambda: self.get_response(request))
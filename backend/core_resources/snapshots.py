@@ -0,0 +1,246 @@
+"""Precomputed offline snapshot bundles, one per region.
+
+Each bundle holds every verified resource and active alert for a region
+as gzip-compressed JSON. File names carry a content hash, so bundles are
+immutable and can be cached forever; ``manifest.json`` maps each region
+to its current file. Bundles are served by WhiteNoise (see
+``core_resources.middleware.SnapshotWhiteNoiseMiddleware``).
+
+Every worker process may rebuild; an ``flock`` on ``.build.lock`` in the
+snapshot directory runs one rebuild at a time, so manifests are
+replaced in order and pruning never races another worker's build.
+"""
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+
+from django.conf import settings
+from django.db import connections, models
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Resource
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.build.lock'
+BUNDLE_RE = re.compile(r'^[a-z0-9-]+\.[0-9a-f]{16}\.json(\.gz)?$')
+
+
+def region_key(region):
+    """Normalized region identifier used for bundle names"""
+    return slugify(region or '') or 'unknown'
+
+
+def _root():
+    return str(settings.SNAPSHOT_ROOT)
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def read_manifest():
+    try:
+        with open(os.path.join(_root(), MANIFEST_NAME)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {'regions': {}}
+
+
+def _active_alerts(region_names):
+    # Imported lazily: user_alerts depends on core_resources, not vice versa
+    from user_alerts.models import Alert
+    from user_alerts.serializers import AlertSerializer
+
+    now = timezone.now()
+    region_filter = models.Q()
+    for name in region_names:
+        region_filter |= models.Q(region__icontains=name)
+    alerts = Alert.objects.select_related('created_by').filter(is_active=True).filter(
+        models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=now)
+    ).filter(region_filter).order_by('id')
+    return AlertSerializer(alerts, many=True).data
+
+
+def build_region(key, region_names):
+    """Serialize one region; returns ``(payload_bytes, resource_count, alert_count)``"""
+    from . import shards
+    from .serializers import ResourceSerializer
+
+    with shards.use_for_region(key):
+        resources = shards.related(Resource.objects.all(), 'coordinator', 'verified_by').filter(
+            verified=True, region__in=region_names
+        ).order_by('id')
+        resource_data = ResourceSerializer(resources, many=True).data
+    alert_data = _active_alerts(region_names)
+    payload = json.dumps(
+        {'region': key, 'resources': resource_data, 'alerts': alert_data},
+        sort_keys=True, separators=(',', ':'), default=str,
+    ).encode()
+    return payload, len(resource_data), len(alert_data)
+
+
+@contextlib.contextmanager
+def _build_lock(root):
+    """Hold the snapshot directory's lock, waiting for another worker's build"""
+    fd = os.open(os.path.join(root, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def build_snapshots(keys=None):
+    """(Re)build bundles for the given region keys, or all regions.
+
+    Unchanged regions keep their existing file; only the manifest entry is
+    carried over. Returns the list of region keys whose bundle changed.
+    """
+    root = _root()
+    os.makedirs(root, exist_ok=True)
+    with _build_lock(root):
+        return _build(root, keys)
+
+
+def _build(root, keys):
+    from . import shards
+
+    regions = {}
+    names = Resource.objects.filter(verified=True).values_list('region', flat=True).order_by().distinct()
+    for name in shards.gather_list(names):
+        regions.setdefault(region_key(name), []).append(name)
+
+    old = read_manifest()
+    manifest = {'regions': {}}
+    changed = []
+    for key, names in sorted(regions.items()):
+        previous = old['regions'].get(key)
+        if keys is not None and key not in keys and previous:
+            manifest['regions'][key] = previous
+            continue
+        payload, resource_count, alert_count = build_region(key, names)
+        digest = hashlib.sha256(payload).hexdigest()
+        if previous and previous['sha256'] == digest:
+            manifest['regions'][key] = previous
+            continue
+        filename = f'{key}.{digest[:16]}.json'
+        _write_atomic(os.path.join(root, filename), payload)
+        # mtime=0 keeps the compressed bytes reproducible for equal content
+        _write_atomic(os.path.join(root, filename + '.gz'), gzip.compress(payload, mtime=0))
+        manifest['regions'][key] = {
+            'file': filename + '.gz',
+            'url': settings.SNAPSHOT_URL + filename,
+            'sha256': digest,
+            'size': os.path.getsize(os.path.join(root, filename + '.gz')),
+            'resources': resource_count,
+            'alerts': alert_count,
+            'generated_at': timezone.now().isoformat(),
+        }
+        changed.append(key)
+
+    if changed or set(manifest['regions']) != set(old['regions']):
+        _write_atomic(
+            os.path.join(root, MANIFEST_NAME),
+            json.dumps(manifest, indent=2, sort_keys=True).encode(),
+        )
+        _prune(root, old, manifest)
+    return changed
+
+
+def _prune(root, old, new):
+    """Delete bundles referenced by neither the new nor the previous manifest.
+
+    The previous generation is kept so clients that fetched the old
+    manifest can still finish their download.
+    """
+    keep = set()
+    for manifest in (old, new):
+        for entry in manifest['regions'].values():
+            keep.add(entry['file'])
+            keep.add(entry['file'][:-len('.gz')])
+    for name in os.listdir(root):
+        if BUNDLE_RE.match(name) and name not in keep:
+            os.remove(os.path.join(root, name))
+
+
+class SnapshotScheduler:
+    """Batch data changes into at most one rebuild per ``delay`` seconds.
+
+    The timer is not reset by later changes, so a steady stream of
+    updates during a surge still produces fresh bundles.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._all = False
+        self._timer = None
+
+    def mark_dirty(self, region=None):
+        """Schedule a rebuild of ``region`` (``None`` rebuilds every region)"""
+        with self._lock:
+            if region is None:
+                self._all = True
+            else:
+                self._dirty.add(region_key(region))
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._rebuild)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _rebuild(self):
+        with self._lock:
+            keys = None if self._all else set(self._dirty)
+            self._dirty.clear()
+            self._all = False
+            self._timer = None
+        try:
+            build_snapshots(keys)
+        except Exception:
+            logger.exception('Snapshot rebuild failed')
+        finally:
+            connections.close_all()
+
+
+scheduler = SnapshotScheduler(settings.SNAPSHOT_DEBOUNCE)
+
+
+def _queue_rebuild(region):
+    from .jobs import enqueue
+    from .models import Job
+
+    job = enqueue('build_snapshots', {'regions': [region_key(region)] if region else None},
+                  delay=settings.SNAPSHOT_DEBOUNCE, unique_key='build_snapshots')
+    regions = job.args.get('regions')
+    if regions is not None and (region is None or region_key(region) not in regions):
+        # Joining an already queued rebuild; widen it to every region
+        # rather than risk losing a region to a concurrent edit of args
+        Job.objects.filter(pk=job.pk, status='queued').update(args={'regions': None})
+
+
+def rebuilds_on_change():
+    """Whether :func:`mark_dirty` schedules anything"""
+    return settings.SNAPSHOT_REBUILD_AS_JOB or settings.SNAPSHOT_AUTO_REBUILD
+
+
+def mark_dirty(region=None):
+    """Note that data for ``region`` changed (no-op unless auto rebuild is on)"""
+    if settings.SNAPSHOT_REBUILD_AS_JOB:
+        _queue_rebuild(region)
+    elif settings.SNAPSHOT_AUTO_REBUILD:
+        scheduler.mark_dirty(region)
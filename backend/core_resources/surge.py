@@ -0,0 +1,221 @@
+"""Surge mode: keep life-critical reads flowing when a worker is overloaded.
+
+Requests are classed by URL name: ``SURGE_CRITICAL_ROUTES`` (``nearby``,
+``alerts/active``), ``SURGE_LOW_PRIORITY_ROUTES`` (exports, ``stats``,
+user lists...) and normal. Each worker tracks the requests in flight and
+a moving average of latency per class. It is in surge mode while more
+than ``SURGE_MAX_IN_FLIGHT`` requests are in flight or the critical or
+normal average is above ``SURGE_LATENCY_TARGET``, and for
+``SURGE_COOLDOWN`` seconds after (``SURGE_MODE=on`` or ``off`` overrides
+the detection).
+
+In surge mode, low-priority requests beyond ``SURGE_LOW_PRIORITY_SLOTS``
+in flight get ``503`` with ``Retry-After``, and anonymous critical GETs
+are answered with the last good response for the same URL while it is
+at most ``SURGE_STALE_TTL`` seconds old (with an ``Age`` header). A stale
+copy also stands in for a critical request that fails with a 5xx.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from .middleware import after_streaming, route_name
+
+CRITICAL, NORMAL, LOW = 'critical', 'normal', 'low'
+CLASSES = (CRITICAL, NORMAL, LOW)
+LATENCY_WEIGHT = 0.2  # of each new sample in the moving average
+STALE_ENTRIES = 1000
+
+
+def classify(request):
+    name = route_name(request)
+    if name in settings.SURGE_CRITICAL_ROUTES:
+        return CRITICAL
+    if name in settings.SURGE_LOW_PRIORITY_ROUTES:
+        return LOW
+    return NORMAL
+
+
+class Tracker:
+    """In-flight requests and latency per class for this worker"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = dict.fromkeys(CLASSES, 0)
+        self.latency = dict.fromkeys(CLASSES, 0.0)  # seconds, moving average
+        self.sampled_at = dict.fromkeys(CLASSES, None)
+        self.shed = 0
+        self.stale = 0
+        self.surge_until = 0.0
+
+    def surging(self, now):
+        if settings.SURGE_MODE != 'auto':
+            return settings.SURGE_MODE == 'on'
+        return now < self.surge_until
+
+    def _check(self, now):
+        busy = sum(self.in_flight.values()) > settings.SURGE_MAX_IN_FLIGHT
+        target = settings.SURGE_LATENCY_TARGET
+        slow = target and any(
+            self.sampled_at[cls] is not None and now - self.sampled_at[cls] < settings.SURGE_COOLDOWN
+            and self.latency[cls] > target
+            for cls in (CRITICAL, NORMAL)
+        )
+        if busy or slow:
+            self.surge_until = now + settings.SURGE_COOLDOWN
+
+    def admit(self, cls, now):
+        """Count a request in, or return ``False`` if it is shed"""
+        with self.lock:
+            self._check(now)
+            if cls == LOW and self.surging(now) and self.in_flight[LOW] >= settings.SURGE_LOW_PRIORITY_SLOTS:
+                self.shed += 1
+                return False
+            self.in_flight[cls] += 1
+            return True
+
+    def finish(self, cls, started, now, failed=False):
+        with self.lock:
+            self.in_flight[cls] -= 1
+            if not failed:
+                elapsed = now - started
+                sampled_at = self.sampled_at[cls]
+                if sampled_at is None or now - sampled_at > settings.SURGE_COOLDOWN:
+                    # An old average says nothing about the current load
+                    self.latency[cls] = elapsed
+                else:
+                    self.latency[cls] += LATENCY_WEIGHT * (elapsed - self.latency[cls])
+                self.sampled_at[cls] = now
+            self._check(now)
+
+    def served_stale(self):
+        with self.lock:
+            self.stale += 1
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'surge': self.surging(now),
+                'in_flight': dict(self.in_flight),
+                'latency': dict(self.latency),
+                'shed': self.shed,
+                'stale': self.stale,
+            }
+
+
+class StaleCache:
+    """Last good response per critical URL, for serving stale in surge mode"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def put(self, key, response, now):
+        entry = (now, response.content, response['Content-Type'])
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > STALE_ENTRIES:
+                self.entries.popitem(last=False)
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or now - entry[0] > settings.SURGE_STALE_TTL:
+            return None
+        stored_at, content, content_type = entry
+        response = HttpResponse(content, content_type=content_type)
+        response['Age'] = str(int(now - stored_at))
+        return response
+
+
+tracker = Tracker()
+stale = StaleCache()
+
+
+def _stale_key(request):
+    # Authenticated responses depend on the user (e.g. coordinator filtering)
+    if request.method != 'GET' or 'HTTP_AUTHORIZATION' in request.META:
+        return None
+    query = tuple(sorted((name, tuple(values)) for name, values in request.GET.lists()))
+    # Responses hold absolute URLs, so the host is part of the key
+    return request.META.get('HTTP_HOST', ''), request.path_info, query, request.headers.get('Accept', '')
+
+
+def _busy():
+    response = JsonResponse({'error': 'Server is busy with emergency traffic; try again later'}, status=503)
+    response['Retry-After'] = str(settings.SURGE_RETRY_AFTER)
+    return response
+
+
+class SurgeMiddleware:
+    """Shed low-priority requests and serve critical reads stale during a surge"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        cls, key, started, response = self._start(request)
+        if response is not None:
+            return response
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            tracker.finish(cls, started, time.monotonic(), failed=True)
+            raise
+        return self._finish(cls, key, started, response)
+
+    async def __acall__(self, request):
+        cls, key, started, response = self._start(request)
+        if response is not None:
+            return response
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            tracker.finish(cls, started, time.monotonic(), failed=True)
+            raise
+        return self._finish(cls, key, started, response)
+
+    def _start(self, request):
+        """``(class, stale key, start time, response)``; a response ends the request here"""
+        now = time.monotonic()
+        cls = classify(request)
+        key = _stale_key(request) if cls == CRITICAL else None
+        if key is not None and tracker.surging(now):
+            response = stale.get(key, now)
+            if response is not None:
+                tracker.served_stale()
+                return cls, key, None, response
+        if not tracker.admit(cls, now):
+            return cls, key, None, _busy()
+        return cls, key, now, None
+
+    def _finish(self, cls, key, started, response):
+        if response.streaming:
+            # Exports hold their slot and are timed until the last row is sent
+            after_streaming(response, lambda size: tracker.finish(cls, started, time.monotonic()))
+            return response
+        now = time.monotonic()
+        tracker.finish(cls, started, now)
+        if key is None:
+            return response
+        if response.status_code == 200:
+            stale.put(key, response, now)
+        elif response.status_code >= 500:
+            fallback = stale.get(key, now)
+            if fallback is not None:
+                tracker.served_stale()
+                return fallback
+        return response
@@ -0,0 +1,50 @@
+"""Background job tasks; see ``core_resources.jobs``"""
+import io
+
+from django.conf import settings
+from django.core.management import call_command
+
+from . import archive, checkpoints, duplicates, images, rollups, shards, snapshots
+from .jobs import task
+
+
+@task(priority=5)
+def build_snapshots(regions=None):
+    return {'changed': snapshots.build_snapshots(set(regions) if regions else None)}
+
+
+@task(priority=3)
+def process_resource_image(resource):
+    return {'hash': images.process_resource(resource)}
+
+
+@task(max_attempts=1)
+def import_resources(path, format=None, id_field='external_id', batch_size=2000, find_duplicates=False):
+    """Import a registry file already on the server; a retry would repeat a partial import"""
+    out = io.StringIO()
+    options = {'id_field': id_field, 'batch_size': batch_size, 'find_duplicates': find_duplicates, 'stdout': out}
+    if format:
+        options['format'] = format
+    call_command('import_resources', path, **options)
+    return {'output': out.getvalue().strip().splitlines()[-2:]}
+
+
+@task(priority=-5)
+def find_duplicates():
+    return {'flagged': sum(found for _, found in shards.each(duplicates.flag_all))}
+
+
+@task(priority=-5)
+def archive_updates(days=None):
+    results = shards.each(archive.archive_updates, days or settings.AUDIT_RETENTION_DAYS)
+    return {'archived': sum(r[0] for _, r in results), 'files': sum(r[1] for _, r in results)}
+
+
+@task()
+def rollup_capacity():
+    return {'processed': sum(processed for _, processed in shards.each(rollups.update_rollups))}
+
+
+@task()
+def checkpoint_capacity():
+    return {'checkpoints': [checkpoint.pk for _, checkpoint in shards.each(checkpoints.take_checkpoint)]}
@@ -4,19 +4,23 @@ from .views import (
     ResourceViewSet, 
     ResourceUpdateViewSet,
     UserViewSet,
+    JobViewSet,
     register_user,
     login_user,
-    get_current_user
+    get_current_user,
+    snapshot_manifest
 )
 
 router = DefaultRouter()
 router.register('resources', ResourceViewSet)
 router.register('resource-updates', ResourceUpdateViewSet)
 router.register('users', UserViewSet)
+router.register('jobs', JobViewSet)
 
 urlpatterns = [
     path('auth/register/', register_user, name='register'),
     path('auth/login/', login_user, name='login'),
     path('auth/me/', get_current_user, name='current-user'),
+    path('snapshots/manifest/', snapshot_manifest, name='snapshot-manifest'),
     path('', include(router.urls)),
 ]
@@ -1,32 +1,35 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
+from rest_framework.exceptions import NotAuthenticated, NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from django.db import models
 from django.db.models import Q
-from django.http import HttpResponse
-import csv
-import math
+from django.http import HttpResponse, StreamingHttpResponse
 
-from .models import User, Resource, ResourceUpdate
-from .serializers import UserSerializer, ResourceSerializer, ResourceUpdateSerializer
-
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points in kilometers"""
-    R = 6371  # Earth radius in km
-    
-    lat1, lon1, lat2, lon2 = map(math.radians, [float(lat1), float(lon1), float(lat2), float(lon2)])
-    
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+from . import shards
+from .models import User, Resource, ResourceUpdate, DuplicateCandidate, Job
+from .serializers import (
+    UserSerializer, ResourceSerializer, ResourceUpdateSerializer, DuplicateCandidateSerializer, JobSerializer,
+)
+from .capacity import submit_capacity_delta, submit_available_capacity
+from .exports import EXPORTERS
+from .snapshots import read_manifest
+from .rollups import parse_range, region_series, resource_series, series_points
+from .allocation import CANDIDATES, MAX_DISTANCE_KM, AllocationError, allocate, parse_demand
+from .archive import ArchiveBusy, recent_archived
+from .checkpoints import capacity_as_of, parse_as_of
+from .coverage import DEFAULT_TYPES, CoverageError, get_grid
+from .duplicates import flag_resource, merge
+from .jobs import cancel as cancel_job, enqueue, load_tasks, retry as retry_job
+from .images import queue as queue_image
+from .history import DEFAULT_POINTS, MAX_POINTS, count_history, iter_history, lttb, parse_bounds
+from .nearby import NearbyError, parse_params as parse_nearby, rank_nearby
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, SCRAPER, MetricsTokenAuthentication, render as render_metrics
 
 
 @api_view(['POST'])
@@ -102,6 +105,26 @@ def get_current_user(request):
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def snapshot_manifest(request):
+    """Current offline snapshot bundle per region"""
+    return Response(read_manifest())
+
+
+@api_view(['GET'])
+@authentication_classes([MetricsTokenAuthentication, JWTAuthentication])
+@permission_classes([AllowAny])
+def metrics(request):
+    """Prometheus metrics of the worker serving the request (admins or ``METRICS_TOKEN``)"""
+    if request.auth != SCRAPER:
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can view metrics'}, status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """Admin user management"""
     queryset = User.objects.all().order_by('-date_joined')
@@ -110,7 +133,7 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Only return essential fields for list view
         return User.objects.all().order_by('-date_joined').only(
-            'id', 'username', 'email', 'role', 'phone_number', 
+            'id', 'username', 'email', 'role', 'phone_number', 'region',
             'is_approved', 'date_joined', 'first_name', 'last_name'
         )
 
@@ -147,7 +170,95 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(UserSerializer(user).data)
 
 
-class ResourceViewSet(viewsets.ModelViewSet):
+class ShardedViewMixin:
+    """Send a request's queries to the shard its rows live on (see ``core_resources.shards``)"""
+    _shard = None
+
+    def get_shard(self, request):
+        """Shard for this request, or ``None`` when the view gathers from every shard"""
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if pk is None:
+            return None
+        alias = shards.shard_for_id(pk)
+        if alias is None:
+            raise NotFound()
+        return alias
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if shards.enabled():
+            alias = self.get_shard(request)
+            if alias is not None:
+                self._shard = shards.use(alias)
+                self._shard.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._shard is not None:
+            self._shard.__exit__(None, None, None)
+            self._shard = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def gather_page(self, request, queryset, key, serialize):
+        """Paginated response merged from every shard; ``queryset`` is ordered descending by ``key``"""
+        page_size = self.paginator.get_page_size(request)
+        try:
+            page = int(request.query_params.get(self.paginator.page_query_param, 1))
+        except ValueError:
+            page = 0
+        if page < 1:
+            raise NotFound('Invalid page.')
+        count, rows = shards.gather_page(queryset, (page - 1) * page_size, page_size, key)
+        if page > 1 and not rows:
+            raise NotFound('Invalid page.')
+        url = request.build_absolute_uri()
+        previous = None
+        if page == 2:
+            previous = remove_query_param(url, self.paginator.page_query_param)
+        elif page > 2:
+            previous = replace_query_param(url, self.paginator.page_query_param, page - 1)
+        return Response({
+            'count': count,
+            'next': replace_query_param(url, self.paginator.page_query_param, page + 1)
+            if page * page_size < count else None,
+            'previous': previous,
+            'results': serialize(rows),
+        })
+
+
+def filter_resources(queryset, params):
+    """Apply the ``type``, ``status``, ``region`` and ``search`` list filters"""
+    resource_type = params.get('type')
+    if resource_type:
+        queryset = queryset.filter(type=resource_type)
+
+    resource_status = params.get('status')
+    if resource_status:
+        queryset = queryset.filter(status=resource_status)
+
+    region = params.get('region')
+    if region:
+        queryset = queryset.filter(region__icontains=region)
+
+    # Search by name
+    search = params.get('search')
+    if search:
+        queryset = queryset.filter(
+            Q(name__icontains=search) | Q(description__icontains=search)
+        )
+    return queryset
+
+
+def resource_counts():
+    """``(total, verified, [(type, count)], [(status, count)])`` on the selected shard"""
+    return (
+        Resource.objects.count(),
+        Resource.objects.filter(verified=True).count(),
+        list(Resource.objects.values_list('type').annotate(count=models.Count('id')).order_by()),
+        list(Resource.objects.values_list('status').annotate(count=models.Count('id')).order_by()),
+    )
+
+
+class ResourceViewSet(ShardedViewMixin, viewsets.ModelViewSet):
     """Resource management endpoints"""
     queryset = Resource.objects.all()
     serializer_class = ResourceSerializer
@@ -159,62 +270,118 @@ class ResourceViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         # Optimize queries with select_related to avoid N+1 queries
-        queryset = Resource.objects.select_related('coordinator', 'verified_by').all()
+        queryset = shards.related(Resource.objects.all(), 'coordinator', 'verified_by')
         
         # Filter by coordinator (for coordinator dashboard)
         if self.request.user.is_authenticated and self.request.user.role == 'coordinator':
             queryset = queryset.filter(coordinator=self.request.user)
         
-        # Filter by type
-        resource_type = self.request.query_params.get('type')
-        if resource_type:
-            queryset = queryset.filter(type=resource_type)
-        
-        # Filter by status
-        resource_status = self.request.query_params.get('status')
-        if resource_status:
-            queryset = queryset.filter(status=resource_status)
-        
-        # Filter by region
-        region = self.request.query_params.get('region')
-        if region:
-            queryset = queryset.filter(region__icontains=region)
-        
-        # Search by name
-        search = self.request.query_params.get('search')
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
+        return filter_resources(queryset, self.request.query_params)
+
+    def get_shard(self, request):
+        if self.action == 'create':
+            return shards.shard_for_region(request.data.get('region'))
+        if self.action in ('region_timeseries', 'coverage') and request.query_params.get('region'):
+            return shards.shard_for_region(request.query_params['region'])
+        return super().get_shard(request)
+
+    def list(self, request, *args, **kwargs):
+        try:
+            as_of = parse_as_of(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if shards.enabled():
+            queryset = self.filter_queryset(self.get_queryset())
+            if as_of is not None:
+                queryset = queryset.filter(created_at__lte=as_of)
+            return self.gather_page(
+                request, queryset.order_by('-created_at', '-id'), lambda r: (r.created_at, r.pk),
+                lambda page: self.get_serializer(page, many=True).data if as_of is None
+                else self._serialize_as_of(page, as_of),
             )
-        
-        return queryset
-    
-    @action(detail=False, methods=['get'])
-    def nearby(self, request):
-        """Find nearby resources within radius"""
-        lat = request.query_params.get('lat')
-        lon = request.query_params.get('lon')
-        max_distance = float(request.query_params.get('max_distance', 10))  # km
-        
-        if not lat or not lon:
+        if as_of is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(created_at__lte=as_of)
+        page = self.paginate_queryset(queryset)
+        resources = page if page is not None else list(queryset)
+        data = self._serialize_as_of(resources, as_of)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            as_of = parse_as_of(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if as_of is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        resource = self.get_object()
+        if resource.created_at > as_of:
+            return Response({'error': 'Resource did not exist at as_of'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._serialize_as_of([resource], as_of)[0])
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['thumbnails'] = self.action in ('list', 'nearby')
+        return context
+
+    def update(self, request, *args, **kwargs):
+        region = request.data.get('region')
+        if region is not None and shards.enabled() and shards.shard_for_region(region) != shards.current():
             return Response(
-                {'error': 'Latitude and longitude required'},
+                {'error': 'Cannot move a resource to a region on another shard'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        resources = self.get_queryset()
-        nearby_resources = []
-        
+        return super().update(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        resource = serializer.save()
+        # Likely duplicates are flagged for admin review; creation goes ahead
+        flag_resource(resource)
+        if resource.image:
+            queue_image(resource)
+
+    def perform_update(self, serializer):
+        if 'image' not in serializer.validated_data:
+            serializer.save()
+            return
+        # A new upload is served as-is until its variants are built
+        resource = serializer.save(image_hash='')
+        if resource.image:
+            queue_image(resource)
+
+    def _serialize_as_of(self, resources, as_of):
+        """Serialize resources with capacity and status rebuilt for ``as_of``"""
+        state = {}
+        for alias, group in shards.by_shard(resources).items():
+            with shards.use(alias):
+                state.update(capacity_as_of(group, as_of))
         for resource in resources:
-            distance = haversine_distance(lat, lon, resource.latitude, resource.longitude)
-            
-            if distance <= max_distance:
-                resource.distance = round(distance, 2)
-                nearby_resources.append(resource)
-        
-        # Sort by distance
-        nearby_resources.sort(key=lambda x: x.distance)
-        
+            resource.available_capacity, resource.status = state[resource.pk]
+        context = self.get_serializer_context()
+        context['as_of'] = as_of
+        return self.get_serializer(resources, many=True, context=context).data
+    
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """Find nearby resources within radius, ranked by ``rank``"""
+        try:
+            options = parse_nearby(request.query_params)
+        except NearbyError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranked = rank_nearby(self.get_queryset(), options)
+        # Load and serialize only the rows that made the cut
+        resources = shards.in_bulk(self.get_queryset(), [pk for pk, _ in ranked])
+        nearby_resources = []
+        for pk, distance in ranked:
+            resource = resources[pk]
+            resource.distance = distance
+            nearby_resources.append(resource)
+
         serializer = self.get_serializer(nearby_resources, many=True)
         return Response(serializer.data)
     
@@ -235,23 +402,29 @@ class ResourceViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(resource)
         return Response(serializer.data)
     
-    @action(detail=True, methods=['post'])
-    def update_capacity(self, request, pk=None):
-        """Update resource capacity (coordinator/admin)"""
+    def _check_capacity_permission(self, request, resource):
+        """Return an error response if the user may not change capacity"""
         if request.user.role not in ['coordinator', 'admin']:
             return Response(
                 {'error': 'Permission denied'},
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        resource = self.get_object()
-        
         # Coordinators can only update their assigned resources
-        if request.user.role == 'coordinator' and resource.coordinator != request.user:
+        if request.user.role == 'coordinator' and resource.coordinator_id != request.user.id:
             return Response(
                 {'error': 'You can only update your assigned resources'},
                 status=status.HTTP_403_FORBIDDEN
             )
+        return None
+    
+    @action(detail=True, methods=['post'])
+    def update_capacity(self, request, pk=None):
+        """Update resource capacity (coordinator/admin)"""
+        resource = self.get_object()
+        denied = self._check_capacity_permission(request, resource)
+        if denied:
+            return denied
         
         new_capacity = request.data.get('available_capacity')
         
@@ -261,27 +434,61 @@ class ResourceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create audit log
-        ResourceUpdate.objects.create(
-            resource=resource,
-            coordinator=request.user,
-            change_log=request.data.get('change_log', 'Capacity updated'),
-            previous_capacity=resource.available_capacity,
-            new_capacity=new_capacity
+        try:
+            new_capacity = int(new_capacity)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'available_capacity must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Audit row and status change are applied atomically with the new value
+        submit_available_capacity(
+            resource, new_capacity, request.user,
+            request.data.get('change_log', 'Capacity updated')
         )
+        resource.refresh_from_db()
         
-        resource.available_capacity = new_capacity
+        serializer = self.get_serializer(resource)
+        return Response(serializer.data)
+    
+    def _shift_capacity(self, request, sign, default_log):
+        resource = self.get_object()
+        denied = self._check_capacity_permission(request, resource)
+        if denied:
+            return denied
         
-        # Auto-update status based on capacity
-        if new_capacity == 0:
-            resource.status = 'full'
-        elif resource.status == 'full' and new_capacity > 0:
-            resource.status = 'open'
+        try:
+            count = int(request.data.get('count', 1))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'count must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if count <= 0:
+            return Response(
+                {'error': 'count must be positive'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        resource.save()
+        submit_capacity_delta(
+            resource, sign * count, request.user,
+            request.data.get('change_log', default_log)
+        )
+        resource.refresh_from_db()
         
         serializer = self.get_serializer(resource)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'])
+    def check_in(self, request, pk=None):
+        """Admit people, decreasing available capacity (coordinator/admin)"""
+        return self._shift_capacity(request, -1, 'Checked in')
+    
+    @action(detail=True, methods=['post'])
+    def check_out(self, request, pk=None):
+        """Release people, increasing available capacity (coordinator/admin)"""
+        return self._shift_capacity(request, 1, 'Checked out')
 
     @action(detail=True, methods=['post'])
     def assign_coordinator(self, request, pk=None):
@@ -304,53 +511,200 @@ class ResourceViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(resource)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def duplicates(self, request):
+        """Flagged near-duplicate pairs, most similar first (admin)"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can review duplicates'}, status=status.HTTP_403_FORBIDDEN)
+        queryset = DuplicateCandidate.objects.select_related('resource', 'duplicate_of').filter(
+            status=request.query_params.get('status', 'pending')
+        )
+        if shards.enabled():
+            return self.gather_page(
+                request, queryset.order_by('-score', '-id'), lambda c: (c.score, c.pk),
+                lambda page: DuplicateCandidateSerializer(page, many=True).data,
+            )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(DuplicateCandidateSerializer(page, many=True).data)
+        return Response(DuplicateCandidateSerializer(queryset, many=True).data)
+
+    def _other_resource(self, request, key):
+        try:
+            return Resource.objects.get(id=request.data.get(key))
+        except (Resource.DoesNotExist, ValueError, TypeError):
+            return None
+
+    @action(detail=True, methods=['post'])
+    def merge(self, request, pk=None):
+        """Merge this resource into the one given as ``into`` and delete it (admin)"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can merge resources'}, status=status.HTTP_403_FORBIDDEN)
+        duplicate = self.get_object()
+        if shards.enabled() and shards.shard_for_id(request.data.get('into')) not in (None, shards.current()):
+            return Response({'error': 'Cannot merge resources on different shards'}, status=status.HTTP_400_BAD_REQUEST)
+        into = self._other_resource(request, 'into')
+        if into is None:
+            return Response({'error': 'into must be an existing resource id'}, status=status.HTTP_400_BAD_REQUEST)
+        if into.pk == duplicate.pk:
+            return Response({'error': 'Cannot merge a resource into itself'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            into = merge(duplicate, into, request.user)
+        except ArchiveBusy:
+            return Response(
+                {'error': 'An archive run is in progress; try again shortly'}, status=status.HTTP_409_CONFLICT
+            )
+        serializer = self.get_serializer(into)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def not_duplicate(self, request, pk=None):
+        """Dismiss a flagged pair so it is not reported again (admin)"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can review duplicates'}, status=status.HTTP_403_FORBIDDEN)
+        resource = self.get_object()
+        other = self._other_resource(request, 'of')
+        if other is None:
+            return Response({'error': 'of must be an existing resource id'}, status=status.HTTP_400_BAD_REQUEST)
+        pair = Q(resource=resource, duplicate_of=other) | Q(resource=other, duplicate_of=resource)
+        if not DuplicateCandidate.objects.filter(pair).update(status='dismissed'):
+            return Response({'error': 'These resources are not flagged as duplicates'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'status': 'dismissed'})
+
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Basic analytics summary (admin)"""
         if request.user.role != 'admin':
             return Response({'error': 'Only admins can view stats'}, status=status.HTTP_403_FORBIDDEN)
-        # Use single query with aggregation for better performance
-        total = Resource.objects.count()
-        by_type = Resource.objects.values('type').annotate(count=models.Count('id')).order_by('type')
-        by_status = Resource.objects.values('status').annotate(count=models.Count('id')).order_by('status')
-        verified = Resource.objects.filter(verified=True).count()
+        # Counted on every shard in parallel and summed
+        total, verified, by_type, by_status = 0, 0, {}, {}
+        for _, (shard_total, shard_verified, shard_types, shard_statuses) in shards.gather(resource_counts):
+            total += shard_total
+            verified += shard_verified
+            for name, count in shard_types:
+                by_type[name] = by_type.get(name, 0) + count
+            for name, count in shard_statuses:
+                by_status[name] = by_status.get(name, 0) + count
         return Response({
             'total_resources': total,
             'verified_resources': verified,
-            'by_type': list(by_type),
-            'by_status': list(by_status),
+            'by_type': [{'type': name, 'count': by_type[name]} for name in sorted(by_type)],
+            'by_status': [{'status': name, 'count': by_status[name]} for name in sorted(by_status)],
+        })
+
+    def _timeseries(self, request, series):
+        try:
+            resolution, start, end = parse_range(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'series': series,
+            'resolution': resolution,
+            'start': start,
+            'end': end,
+            'points': series_points(series, resolution, start, end),
         })
 
+    @action(detail=True, methods=['get'])
+    def timeseries(self, request, pk=None):
+        """Capacity over time from the rollups (resolution, start, end)"""
+        resource = self.get_object()
+        return self._timeseries(request, resource_series(resource.pk))
+
     @action(detail=False, methods=['get'])
-    def export_csv(self, request):
-        """Export resources as CSV (admin)"""
+    def region_timeseries(self, request):
+        """Summed regional capacity over time from the rollups"""
+        region = request.query_params.get('region')
+        if not region:
+            return Response({'error': 'region required'}, status=status.HTTP_400_BAD_REQUEST)
+        return self._timeseries(request, region_series(region))
+
+    @action(detail=False, methods=['get'])
+    def coverage(self, request):
+        """Grid of distances from each cell of a region to the nearest qualifying resource"""
+        region = request.query_params.get('region')
+        if not region:
+            return Response({'error': 'region required'}, status=status.HTTP_400_BAD_REQUEST)
+        types = request.query_params.get('type')
+        types = types.split(',') if types else DEFAULT_TYPES
+        valid_types = {choice for choice, _ in Resource.TYPE_CHOICES}
+        if not set(types) <= valid_types:
+            return Response({'error': f'type must be among {", ".join(sorted(valid_types))}'}, status=status.HTTP_400_BAD_REQUEST)
+        status_filter = request.query_params.get('status', 'open')
+        if status_filter not in {choice for choice, _ in Resource.STATUS_CHOICES}:
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            cell_km = float(request.query_params.get('cell_km', 1))
+            threshold = request.query_params.get('threshold_km')
+            threshold = float(threshold) if threshold else None
+        except ValueError:
+            return Response({'error': 'cell_km and threshold_km must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0.1 <= cell_km <= 10:
+            return Response({'error': 'cell_km must be between 0.1 and 10'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            grid = get_grid(region, types, status_filter, cell_km)
+        except CoverageError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(grid.as_dict(threshold))
+
+    @action(detail=False, methods=['post'])
+    def allocate(self, request):
+        """Assign evacuee groups at pickup points to shelters, minimizing total travel"""
+        try:
+            demand = parse_demand(request.data.get('demand'))
+        except AllocationError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        types = request.data.get('type', 'shelter')
+        types = types.split(',') if isinstance(types, str) else types
+        valid_types = {choice for choice, _ in Resource.TYPE_CHOICES}
+        if not isinstance(types, list) or not set(types) <= valid_types:
+            return Response({'error': f'type must be among {", ".join(sorted(valid_types))}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            max_distance = float(request.data.get('max_distance_km', MAX_DISTANCE_KM))
+            candidates = int(request.data.get('candidates', CANDIDATES))
+        except (TypeError, ValueError):
+            return Response({'error': 'max_distance_km and candidates must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < max_distance <= 200 or not 1 <= candidates <= 50:
+            return Response({'error': 'max_distance_km must be in (0, 200] and candidates in [1, 50]'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(allocate(demand, types, max_distance, candidates))
+
+    def _export(self, request, export_format):
         if request.user.role != 'admin':
             return Response({'error': 'Only admins can export'}, status=status.HTTP_403_FORBIDDEN)
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="resources.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(['Name', 'Type', 'Status', 'Latitude', 'Longitude', 'Region', 'Capacity', 'Available', 'Verified', 'Coordinator'])
-        # Optimize query with select_related to avoid N+1 queries
-        for r in Resource.objects.select_related('coordinator').all():
-            writer.writerow([
-                r.name, r.type, r.status, r.latitude, r.longitude, r.region,
-                r.capacity, r.available_capacity, r.verified,
-                r.coordinator.get_full_name() if r.coordinator else ''
-            ])
+        generator, content_type, filename = EXPORTERS[export_format]
+        # Same filters as the list endpoint, streamed in keyset chunks
+        response = StreamingHttpResponse(generator(self.get_queryset()), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
+    @action(detail=False, methods=['get'])
+    def export_csv(self, request):
+        """Export resources as CSV (admin)"""
+        return self._export(request, 'csv')
+
+    @action(detail=False, methods=['get'])
+    def export_ndjson(self, request):
+        """Export resources as newline-delimited JSON (admin)"""
+        return self._export(request, 'ndjson')
+
+    @action(detail=False, methods=['get'])
+    def export_geojson(self, request):
+        """Export resources as a GeoJSON FeatureCollection (admin)"""
+        return self._export(request, 'geojson')
+
 
-class ResourceUpdateViewSet(viewsets.ReadOnlyModelViewSet):
+class ResourceUpdateViewSet(ShardedViewMixin, viewsets.ReadOnlyModelViewSet):
     """Resource update history"""
     queryset = ResourceUpdate.objects.select_related('coordinator', 'resource').all()
     serializer_class = ResourceUpdateSerializer
     permission_classes = [IsAuthenticated]
+    max_limit = 1000  # also applies to limit=0
     
     def get_queryset(self):
-        # Optimize with select_related and limit results
-        queryset = ResourceUpdate.objects.select_related('coordinator', 'resource').all()
+        # Optimize with select_related
+        queryset = shards.related(ResourceUpdate.objects.select_related('resource'), 'coordinator')
         
         # Filter by resource
         resource_id = self.request.query_params.get('resource')
@@ -358,11 +712,143 @@ class ResourceUpdateViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(resource_id=resource_id)
         
         # Order by timestamp descending
-        queryset = queryset.order_by('-timestamp')
-        
+        return queryset.order_by('-timestamp')
+
+    def get_shard(self, request):
+        resource_id = request.query_params.get('resource')
+        if resource_id and resource_id.isdigit() and self.kwargs.get('pk') is None:
+            alias = shards.shard_for_id(resource_id)
+            if alias is None:
+                raise NotFound()
+            return alias
+        return super().get_shard(request)
+
+    def list(self, request, *args, **kwargs):
+        """Latest ``limit`` updates (50 by default), paginated; a resource's are topped up from the archive"""
+        try:
+            limit = int(request.query_params.get('limit') or 50)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         # Limit to latest 50 by default for performance
-        limit = int(self.request.query_params.get('limit', 50))
-        if limit > 0:
-            queryset = queryset[:limit]
-        
+        limit = self.max_limit if limit <= 0 else min(limit, self.max_limit)
+        updates = self.get_queryset()[:limit]
+        if shards.enabled() and shards.current() is None:
+            # Each shard's latest, merged
+            updates = sorted(shards.gather_list(updates), key=lambda u: (u.timestamp, u.pk), reverse=True)[:limit]
+        resource_id = request.query_params.get('resource')
+        if resource_id and resource_id.isdigit():
+            updates = list(updates)
+            if len(updates) < limit:
+                updates.extend(self._archived_updates(int(resource_id), limit, {u.id for u in updates}))
+                updates = updates[:limit]
+        page = self.paginate_queryset(updates)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    def _archived_updates(self, resource_id, limit, seen):
+        resource = Resource.objects.filter(pk=resource_id).first()
+        if resource is None:
+            return []
+        rows = [row for row in recent_archived(resource_id, limit) if row['id'] not in seen]
+        users = User.objects.in_bulk({row['coordinator_id'] for row in rows})
+        return [
+            ResourceUpdate(
+                id=row['id'], resource=resource, coordinator=users.get(row['coordinator_id']),
+                timestamp=row['timestamp'], change_log=row['change_log'],
+                previous_capacity=row['previous_capacity'], new_capacity=row['new_capacity'],
+            )
+            for row in rows
+        ]
+
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """Capacity history for one resource, downsampled for charting"""
+        resource_id = request.query_params.get('resource')
+        if not resource_id or not resource_id.isdigit():
+            return Response({'error': 'resource query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            points = int(request.query_params.get('points') or DEFAULT_POINTS)
+        except ValueError:
+            return Response({'error': 'points must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start, end = parse_bounds(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if points < 3:
+            return Response({'error': 'points must be at least 3'}, status=status.HTTP_400_BAD_REQUEST)
+        points = min(points, MAX_POINTS)
+
+        resource_id = int(resource_id)
+        total = count_history(resource_id, start, end)
+        series = lttb(iter_history(resource_id, start, end), total, points)
+        return Response({
+            'resource': resource_id,
+            'start': start,
+            'end': end,
+            'total': total,
+            'points': [{'timestamp': ts, 'available': value} for ts, value in series],
+        })
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Background job status; admins can queue, cancel and retry jobs"""
+    queryset = Job.objects.select_related('created_by').all()
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Job.objects.select_related('created_by').order_by('-created_at')
+        # Non-admins only see jobs they started
+        if self.request.user.role != 'admin':
+            queryset = queryset.filter(created_by=self.request.user)
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        task = self.request.query_params.get('task')
+        if task:
+            queryset = queryset.filter(task=task)
         return queryset
+
+    def create(self, request):
+        """Queue a job: ``{"task", "args", "priority", "delay"}``"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can queue jobs'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            priority = request.data.get('priority')
+            delay = float(request.data.get('delay', 0))
+            job = enqueue(
+                request.data.get('task'), request.data.get('args'),
+                priority=None if priority is None else int(priority), delay=max(delay, 0), user=request.user,
+            )
+        except (TypeError, ValueError) as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(JobSerializer(job).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def tasks(self, request):
+        """Registered task names with their default priority and attempts"""
+        return Response([
+            {'name': name, 'priority': task.priority, 'max_attempts': task.max_attempts}
+            for name, task in sorted(load_tasks().items())
+        ])
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancel a job that has not started yet"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can cancel jobs'}, status=status.HTTP_403_FORBIDDEN)
+        job = self.get_object()
+        if not cancel_job(job):
+            return Response({'error': f'Cannot cancel a job that is {job.status}'}, status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data)
+
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """Queue a failed or cancelled job again"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can retry jobs'}, status=status.HTTP_403_FORBIDDEN)
+        job = self.get_object()
+        if not retry_job(job):
+            return Response({'error': f'Cannot retry a job that is {job.status}'}, status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Alert
+from .models import Alert, AlertDelivery
 
 @admin.register(Alert)
 class AlertAdmin(admin.ModelAdmin):
@@ -7,3 +7,10 @@ class AlertAdmin(admin.ModelAdmin):
     list_filter = ['severity', 'is_active', 'region']
     search_fields = ['title', 'description']
     readonly_fields = ['created_at']
+
+
+@admin.register(AlertDelivery)
+class AlertDeliveryAdmin(admin.ModelAdmin):
+    list_display = ['alert', 'channel', 'status', 'sent', 'failed', 'attempts', 'updated_at']
+    list_filter = ['channel', 'status']
+    readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,24 @@
+"""Async ``GET /api/alerts/active/`` (see ``core_resources.async_views``)"""
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+
+from core_resources.async_views import fallback, json_response, needs_drf
+
+from .geofence import index as geofence_index
+from .serializers import AlertSerializer
+from .views import active_alerts, parse_point
+
+
+@csrf_exempt
+async def active(request):
+    """``AlertViewSet.active`` for anonymous clients"""
+    if needs_drf(request):
+        return await fallback(request)
+    try:
+        point = parse_point(request.GET)
+    except ValueError as exc:
+        return json_response({'error': str(exc)}, status=400)
+    # The index may reload itself from the database under its lock
+    covering = await sync_to_async(geofence_index.covering)(*point) if point else None
+    alerts = [alert async for alert in active_alerts(request.GET.get('region'), covering)]
+    return json_response(AlertSerializer(alerts, many=True, context={'request': request}).data)
@@ -0,0 +1,160 @@
+"""Notification channels for alert fan-out.
+
+A channel narrows the recipient queryset to users it can reach and
+sends one batch at a time. ``send`` returns the ids of users the channel
+rejected (they are retried later) and raises to fail the whole batch.
+Any ``Channel`` subclass can be enabled by dotted path in
+``NOTIFY_CHANNELS``.
+"""
+import json
+import logging
+import random
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class Channel:
+    name = None
+    # Messages per second unless NOTIFY_RATE_LIMITS says otherwise
+    rate = None
+
+    def recipients(self, users):
+        return users
+
+    def send(self, alert, users):
+        raise NotImplementedError
+
+
+def _message(alert):
+    return f'[{alert.get_severity_display()}] {alert.title}: {alert.description}'
+
+
+def _post_json(url, payload, timeout=10):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read() or b'{}')
+
+
+class StubChannel(Channel):
+    """Sends nothing, for load tests; latency and failures are configurable.
+
+    With ``NOTIFY_STUB_RECORD`` on, deliveries are kept in ``delivered``
+    for the test to check (and clear).
+    """
+    name = 'stub'
+    delivered = []
+    _lock = threading.Lock()
+
+    def send(self, alert, users):
+        if settings.NOTIFY_STUB_LATENCY:
+            time.sleep(settings.NOTIFY_STUB_LATENCY)
+        rejected = [user.pk for user in users if random.random() < settings.NOTIFY_STUB_FAILURE_RATE]
+        if settings.NOTIFY_STUB_RECORD:
+            rejected_set = set(rejected)
+            with self._lock:
+                self.delivered.extend((alert.pk, user.pk) for user in users if user.pk not in rejected_set)
+        return rejected
+
+
+class EmailChannel(Channel):
+    name = 'email'
+    rate = 50
+
+    def recipients(self, users):
+        return users.exclude(email='')
+
+    def send(self, alert, users):
+        rejected = []
+        with get_connection() as connection:
+            for user in users:
+                message = EmailMessage(
+                    subject=f'Alert: {alert.title}', body=_message(alert), to=[user.email], connection=connection,
+                )
+                try:
+                    message.send()
+                except Exception as exc:
+                    logger.warning('Email to user %s failed: %s', user.pk, exc)
+                    rejected.append(user.pk)
+        return rejected
+
+
+class WebhookChannel(Channel):
+    """One POST per batch to ``NOTIFY_WEBHOOK_URL``"""
+    name = 'webhook'
+
+    def send(self, alert, users):
+        if not settings.NOTIFY_WEBHOOK_URL:
+            raise RuntimeError('NOTIFY_WEBHOOK_URL is not set')
+        response = _post_json(settings.NOTIFY_WEBHOOK_URL, {
+            'alert': {'id': alert.pk, 'title': alert.title, 'severity': alert.severity, 'region': alert.region},
+            'users': [user.pk for user in users],
+        })
+        return response.get('rejected', [])
+
+
+class SmsChannel(Channel):
+    """Batches of phone numbers to an HTTP SMS gateway at ``NOTIFY_SMS_URL``"""
+    name = 'sms'
+    rate = 10
+
+    def recipients(self, users):
+        return users.exclude(phone_number='')
+
+    def send(self, alert, users):
+        if not settings.NOTIFY_SMS_URL:
+            raise RuntimeError('NOTIFY_SMS_URL is not set')
+        by_number = {user.phone_number: user.pk for user in users}
+        response = _post_json(settings.NOTIFY_SMS_URL, {'to': list(by_number), 'message': _message(alert)[:160]})
+        return [by_number[number] for number in response.get('rejected', []) if number in by_number]
+
+
+CHANNELS = {cls.name: cls for cls in (StubChannel, EmailChannel, WebhookChannel, SmsChannel)}
+
+
+def get_channel(name):
+    if name in CHANNELS:
+        return CHANNELS[name]()
+    return import_string(name)()
+
+
+class RateLimiter:
+    """Token bucket: ``acquire(n)`` sleeps until ``n`` messages may go out"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.checked = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                # Allow a burst of up to one second's worth, or one whole batch
+                self.tokens = min(max(self.rate, count), self.tokens + (now - self.checked) * self.rate)
+                self.checked = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                time.sleep((count - self.tokens) / self.rate)
+
+
+_limiters = {}
+
+
+def rate_limiter(name, channel):
+    """Per-process limiter for a channel, or ``None`` when unlimited"""
+    if name not in _limiters:
+        limits = dict(item.split('=', 1) for item in settings.NOTIFY_RATE_LIMITS if '=' in item)
+        rate = float(limits[name]) if name in limits else channel.rate
+        _limiters[name] = RateLimiter(rate) if rate else None
+    return _limiters[name]
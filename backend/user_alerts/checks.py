@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def notify_channels(app_configs, **kwargs):
+    """Alerts that notify nobody should not go unnoticed"""
+    if not settings.NOTIFY_CHANNELS:
+        return [Warning(
+            'NOTIFY_CHANNELS is empty: alerts are shown in the app but nobody is notified',
+            hint='Set NOTIFY_CHANNELS, e.g. "email,sms".',
+            id='user_alerts.W001',
+        )]
+    if 'stub' in settings.NOTIFY_CHANNELS and not settings.DEBUG:
+        return [Warning(
+            'NOTIFY_CHANNELS includes "stub", which marks deliveries done without sending anything',
+            hint='Use the stub channel only for load tests.',
+            id='user_alerts.W002',
+        )]
+    return []
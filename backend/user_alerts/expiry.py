@@ -0,0 +1,81 @@
+"""Deactivate alerts when they expire.
+
+The scheduler keeps a min-heap of ``(expires_at, alert_id)`` for active
+alerts, sleeps until the earliest one is due and deactivates everything
+due in one UPDATE. New or edited alerts are picked up by polling
+``updated_at``; a heap entry whose alert was extended since is skipped
+by the ``expires_at`` condition on the update.
+"""
+import heapq
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from core_resources.snapshots import mark_dirty
+
+from .models import Alert
+
+
+def expire_due(now=None):
+    """Deactivate every active alert past its expiry; returns the count"""
+    now = now or timezone.now()
+    count = Alert.objects.filter(is_active=True, expires_at__lte=now).update(is_active=False, updated_at=now)
+    if count:
+        mark_dirty()
+    return count
+
+
+class ExpiryScheduler:
+    def __init__(self, sync_interval=5.0):
+        self.sync_interval = sync_interval
+        self.heap = []
+        self.synced_at = None
+
+    def sync(self):
+        """Queue expiries of alerts created or changed since the last sync"""
+        now = timezone.now()
+        alerts = Alert.objects.filter(is_active=True, expires_at__isnull=False)
+        if self.synced_at is not None:
+            # updated_at is set before the row commits; the overlap catches late commits
+            alerts = alerts.filter(updated_at__gte=self.synced_at - timedelta(seconds=self.sync_interval))
+        for alert_id, expires_at in alerts.values_list('id', 'expires_at'):
+            heapq.heappush(self.heap, (expires_at, alert_id))
+        self.synced_at = now
+
+    def run_due(self):
+        """Deactivate the alerts at the top of the heap that are due"""
+        now = timezone.now()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[1])
+        if not due:
+            return 0
+        count = Alert.objects.filter(id__in=due, is_active=True, expires_at__lte=now).update(
+            is_active=False, updated_at=now
+        )
+        if count:
+            mark_dirty()
+        return count
+
+    def wait(self):
+        """Seconds until the next expiry or sync, whichever is sooner"""
+        delay = self.sync_interval
+        if self.heap:
+            delay = min(delay, (self.heap[0][0] - timezone.now()).total_seconds())
+        return max(delay, 0)
+
+    def run_forever(self, on_expire=None):
+        expired = expire_due()
+        if expired and on_expire:
+            on_expire(expired)
+        self.sync()
+        while True:
+            time.sleep(self.wait())
+            expired = self.run_due()
+            if expired and on_expire:
+                on_expire(expired)
+            if (timezone.now() - self.synced_at).total_seconds() >= self.sync_interval:
+                self.sync()
+                connection.close()
@@ -0,0 +1,181 @@
+"""In-memory spatial index over active geofenced alerts.
+
+Each alert's bounding box is registered in a grid of ``CELL_DEG``
+cells; a lookup reads the caller's cell and runs the exact circle or
+polygon test on those few alerts only. Alerts whose box would cover
+more than ``MAX_CELLS_PER_ALERT`` cells are kept in a short list that
+every lookup checks.
+
+The index is rebuilt lazily: saving or deleting an alert in this process
+marks it stale, and passing the earliest ``expires_at`` drops expired
+alerts. Other processes' changes show up as a new alert count or latest
+``updated_at``; that aggregate runs at most every
+``GEOFENCE_RECHECK_INTERVAL`` seconds, not on every lookup.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from core_resources.coverage import KM_PER_DEGREE
+from core_resources.nearby import haversine_distance
+
+from .models import Alert
+
+CELL_DEG = 0.25
+MAX_CELLS_PER_ALERT = 400
+MAX_RADIUS_KM = 500
+MAX_POLYGON_POINTS = 1000
+
+
+class GeofenceError(ValueError):
+    pass
+
+
+def validate(latitude, longitude, radius_km, polygon):
+    """Check geofence fields; returns the polygon as float pairs (or None)"""
+    circle = [value is not None for value in (latitude, longitude, radius_km)]
+    if any(circle) and not all(circle):
+        raise GeofenceError('latitude, longitude and radius_km must be given together')
+    if radius_km is not None and not 0 < radius_km <= MAX_RADIUS_KM:
+        raise GeofenceError(f'radius_km must be in (0, {MAX_RADIUS_KM}]')
+    if not polygon:
+        return None
+    if not isinstance(polygon, list) or not 3 <= len(polygon) <= MAX_POLYGON_POINTS:
+        raise GeofenceError(f'polygon must be a list of 3 to {MAX_POLYGON_POINTS} [latitude, longitude] points')
+    points = []
+    for point in polygon:
+        try:
+            lat, lon = (float(value) for value in point)
+        except (TypeError, ValueError):
+            raise GeofenceError('polygon points must be [latitude, longitude] pairs')
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise GeofenceError('polygon point out of range')
+        points.append((lat, lon))
+    return points
+
+
+def _in_polygon(lat, lon, points):
+    """Even-odd ray casting in latitude/longitude space"""
+    inside = False
+    j = len(points) - 1
+    for i in range(len(points)):
+        lat_i, lon_i = points[i]
+        lat_j, lon_j = points[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+class _Fence:
+    __slots__ = ('alert_id', 'expires_at', 'centre', 'radius_km', 'polygon', 'box')
+
+    def __init__(self, alert_id, expires_at, latitude, longitude, radius_km, polygon):
+        self.alert_id = alert_id
+        self.expires_at = expires_at
+        self.centre = (float(latitude), float(longitude)) if radius_km is not None else None
+        self.radius_km = radius_km
+        self.polygon = [tuple(map(float, point)) for point in polygon] if polygon else None
+
+        boxes = []
+        if self.centre:
+            lat, lon = self.centre
+            dlat = radius_km / KM_PER_DEGREE
+            widest = min(abs(lat) + dlat, 89.9)
+            dlon = min(radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest))), 180)
+            boxes.append((lat - dlat, lat + dlat, lon - dlon, lon + dlon))
+        if self.polygon:
+            lats = [lat for lat, _ in self.polygon]
+            lons = [lon for _, lon in self.polygon]
+            boxes.append((min(lats), max(lats), min(lons), max(lons)))
+        self.box = (
+            min(box[0] for box in boxes), max(box[1] for box in boxes),
+            min(box[2] for box in boxes), max(box[3] for box in boxes),
+        )
+
+    def covers(self, lat, lon):
+        if self.centre and haversine_distance(lat, lon, *self.centre) <= self.radius_km:
+            return True
+        return bool(self.polygon) and _in_polygon(lat, lon, self.polygon)
+
+
+def _cell(lat, lon):
+    return math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG)
+
+
+class GeofenceIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cells = {}
+        self.wide = []
+        self.signature = None
+        self.next_expiry = None
+        self.stale = True
+        self.recheck_at = 0.0  # time.monotonic() of the next signature check
+        self.hits = 0  # lookups served without a rebuild, for /metrics
+        self.rebuilds = 0
+
+    def invalidate(self):
+        self.stale = True
+
+    def _signature(self):
+        stats = Alert.objects.aggregate(count=Count('id'), latest=Max('updated_at'))
+        return stats['count'], stats['latest']
+
+    def _rebuild(self, now, signature):
+        cells, wide, expiries = {}, [], []
+        rows = Alert.objects.filter(is_active=True).filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+        ).filter(Q(radius_km__isnull=False) | Q(polygon__isnull=False)).values_list(
+            'id', 'expires_at', 'latitude', 'longitude', 'radius_km', 'polygon'
+        )
+        for row in rows:
+            if row[4] is None and not row[5]:
+                continue
+            fence = _Fence(*row)
+            if fence.expires_at:
+                expiries.append(fence.expires_at)
+            south, west = _cell(fence.box[0], fence.box[2])
+            north, east = _cell(fence.box[1], fence.box[3])
+            if (north - south + 1) * (east - west + 1) > MAX_CELLS_PER_ALERT:
+                wide.append(fence)
+                continue
+            for i in range(south, north + 1):
+                for j in range(west, east + 1):
+                    # Boxes past the antimeridian wrap onto the other side
+                    key = (i, (j + int(180 / CELL_DEG)) % int(360 / CELL_DEG) - int(180 / CELL_DEG))
+                    cells.setdefault(key, []).append(fence)
+        self.cells, self.wide = cells, wide
+        self.next_expiry = min(expiries) if expiries else None
+        self.signature = signature
+        self.stale = False
+
+    def covering(self, lat, lon):
+        """Ids of active alerts whose geofence contains the point"""
+        now = timezone.now()
+        with self.lock:
+            expired = self.next_expiry and now >= self.next_expiry
+            changed = self.stale or expired
+            if changed or time.monotonic() >= self.recheck_at:
+                signature = self._signature()
+                self.recheck_at = time.monotonic() + settings.GEOFENCE_RECHECK_INTERVAL
+                changed = changed or signature != self.signature
+            if changed:
+                self._rebuild(now, signature)
+                self.rebuilds += 1
+            else:
+                self.hits += 1
+            candidates = self.cells.get(_cell(lat, lon), []) + self.wide
+        return [
+            fence.alert_id for fence in candidates
+            if (fence.expires_at is None or fence.expires_at > now) and fence.covers(lat, lon)
+        ]
+
+
+index = GeofenceIndex()
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from user_alerts.outbox import run_once
+
+
+class Command(BaseCommand):
+    help = 'Send queued alert notifications from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, metavar='SECONDS',
+                            help='Keep running, polling the outbox at this interval')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_once()
+            if processed:
+                self.stdout.write(f'Processed {processed} deliveries')
+            if not options['loop']:
+                return
+            connection.close()
+            time.sleep(options['loop'])
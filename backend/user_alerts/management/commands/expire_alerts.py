@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from user_alerts.expiry import ExpiryScheduler, expire_due
+
+
+class Command(BaseCommand):
+    help = 'Deactivate alerts past their expires_at'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and deactivate each alert at its expiry time')
+        parser.add_argument('--sync', type=float, default=5.0, metavar='SECONDS',
+                            help='How often --loop looks for new or edited alerts')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.stdout.write(f'Deactivated {expire_due()} expired alerts')
+            return
+        if options['sync'] <= 0:
+            raise CommandError('--sync must be positive')
+        scheduler = ExpiryScheduler(options['sync'])
+        scheduler.run_forever(lambda count: self.stdout.write(f'Deactivated {count} expired alerts'))
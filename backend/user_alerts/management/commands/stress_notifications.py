@@ -0,0 +1,105 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from core_resources.models import User
+from user_alerts.channels import StubChannel
+from user_alerts.models import Alert, AlertDelivery
+from user_alerts.outbox import enqueue, run_once
+
+REGION = 'notify-stress-test'
+
+
+class Command(BaseCommand):
+    help = 'Fan alerts out to synthetic users through the stub channel and verify every user is reached'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--alerts', type=int, default=4)
+        parser.add_argument('--workers', type=int, default=4, help='Worker threads draining the outbox')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--failure-rate', type=float, default=0.02, help='Share of sends the stub rejects')
+        parser.add_argument('--latency', type=float, default=0, help='Stub seconds per batch')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch users and alerts afterwards')
+
+    def handle(self, *args, **options):
+        admin = User.objects.filter(role='admin').first()
+        if admin is None:
+            raise CommandError('An admin user is required to run the stress test')
+        if User.objects.filter(region=REGION).exists() or Alert.objects.filter(region=REGION).exists():
+            raise CommandError(f'Remove the users and alerts left in region "{REGION}" first')
+
+        User.objects.bulk_create(
+            [
+                User(username=f'notify-stress-{i}', password='!', region=REGION, phone_number=f'{i:010d}')
+                for i in range(options['users'])
+            ],
+            batch_size=2000,
+        )
+        user_ids = set(User.objects.filter(region=REGION).values_list('id', flat=True))
+
+        stress = override_settings(
+            NOTIFY_CHANNELS=['stub'],
+            NOTIFY_STUB_RECORD=True,
+            NOTIFY_BATCH_SIZE=options['batch_size'],
+            NOTIFY_RETRY_BACKOFF=0,
+            NOTIFY_MAX_ATTEMPTS=10,
+            NOTIFY_STUB_FAILURE_RATE=options['failure_rate'],
+            NOTIFY_STUB_LATENCY=options['latency'],
+        )
+        errors = []
+        try:
+            with stress:
+                StubChannel.delivered.clear()
+                alert_ids = []
+                for i in range(options['alerts']):
+                    with transaction.atomic():
+                        alert = Alert.objects.create(
+                            title=f'Stress alert {i}', description='scratch', region=REGION, created_by=admin,
+                        )
+                        enqueue(alert)
+                    alert_ids.append(alert.pk)
+
+                def worker():
+                    try:
+                        while AlertDelivery.objects.filter(
+                            alert_id__in=alert_ids, status__in=['pending', 'sending'],
+                        ).exists():
+                            if not run_once():
+                                time.sleep(0.05)
+                    except Exception as exc:  # surfaced after join
+                        errors.append(exc)
+                    finally:
+                        connection.close()
+
+                started = time.perf_counter()
+                pool = [threading.Thread(target=worker) for _ in range(options['workers'])]
+                for t in pool:
+                    t.start()
+                for t in pool:
+                    t.join()
+                elapsed = time.perf_counter() - started
+
+            if errors:
+                raise CommandError(f'{len(errors)} workers failed, first error: {errors[0]!r}')
+            delivered = [pair for pair in StubChannel.delivered if pair[0] in alert_ids]
+            unique = set(delivered)
+            expected = {(alert_id, user_id) for alert_id in alert_ids for user_id in user_ids}
+            deliveries = AlertDelivery.objects.filter(alert_id__in=alert_ids)
+            failed = sum(d.failed for d in deliveries)
+            self.stdout.write(
+                f'{len(delivered)} messages in {elapsed:.2f}s ({len(delivered) / elapsed:.0f}/s) '
+                f'with {options["workers"]} workers; {len(delivered) - len(unique)} duplicates, '
+                f'{failed} given up after retries'
+            )
+            missing = len(expected - unique) - failed
+            if missing:
+                raise CommandError(f'{missing} users were never notified')
+            self.stdout.write(self.style.SUCCESS('Every user was notified or reported as failed'))
+        finally:
+            if not options['keep']:
+                Alert.objects.filter(region=REGION).delete()
+                User.objects.filter(region=REGION).delete()
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_alerts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="alert",
+            name="latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=8, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=8, max_digits=11, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="polygon",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="radius_km",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
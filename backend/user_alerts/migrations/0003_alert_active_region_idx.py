@@ -0,0 +1,22 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_alerts", "0002_alert_geofence"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(
+                fields=["is_active", "region", "created_at"],
+                name="alerts_is_acti_d371d2_idx",
+            ),
+        ),
+    ]
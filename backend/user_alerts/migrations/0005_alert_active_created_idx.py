@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_alerts", "0004_alert_deliveries"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="alert",
+            name="alerts_is_acti_d371d2_idx",
+        ),
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(
+                fields=["is_active", "created_at"], name="alerts_is_acti_792cc1_idx"
+            ),
+        ),
+    ]
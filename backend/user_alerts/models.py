@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from core_resources.models import User
 
 class Alert(models.Model):
@@ -17,10 +18,70 @@ class Alert(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_alerts')
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Optional geofence: a circle (centre + radius_km) and/or a polygon
+    # given as [[latitude, longitude], ...]
+    latitude = models.DecimalField(max_digits=10, decimal_places=8, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=11, decimal_places=8, null=True, blank=True)
+    radius_km = models.FloatField(null=True, blank=True)
+    polygon = models.JSONField(null=True, blank=True)
     
     class Meta:
         db_table = 'alerts'
         ordering = ['-created_at']
+        indexes = [
+            # Active-alert queries: active rows newest first. Regions are
+            # matched by substring, which no index can serve
+            models.Index(fields=['is_active', 'created_at']),
+        ]
+
+    @property
+    def geofenced(self):
+        return self.radius_km is not None or bool(self.polygon)
     
     def __str__(self):
         return f"{self.title} ({self.get_severity_display()})"
+
+
+class AlertDelivery(models.Model):
+    """Outbox row: notifying an alert's region over one channel.
+
+    Written in the same transaction as the alert; ``deliver_alerts``
+    claims it and walks the matching users in id order, so ``cursor``
+    (the last user id handed to the channel) lets a restarted worker
+    resume where the previous one stopped.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    alert = models.ForeignKey(Alert, on_delete=models.CASCADE, related_name='deliveries')
+    channel = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    cursor = models.BigIntegerField(default=0)
+    # Recipients the channel rejected, retried after the first pass
+    retry_ids = models.JSONField(default=list, blank=True)
+    retry_round = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    # Consecutive failed batches; the job fails after NOTIFY_MAX_ATTEMPTS
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'alert_deliveries'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"Alert {self.alert_id} via {self.channel} ({self.status})"
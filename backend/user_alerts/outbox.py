@@ -0,0 +1,141 @@
+"""Transactional outbox for alert notifications.
+
+Creating an alert writes one ``AlertDelivery`` row per enabled channel
+in the same transaction, so a notification is queued if and only if the
+alert exists. ``deliver_alerts`` workers claim rows with a time-limited
+lease (a conditional UPDATE, which works on every database backend),
+then fan out to the region's users in batches, saving the cursor after
+each batch. Sending is at-least-once: a worker that dies mid-batch
+leaves the lease to expire and the batch is sent again.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core_resources.models import User
+
+from .channels import get_channel, rate_limiter
+from .models import AlertDelivery
+
+logger = logging.getLogger(__name__)
+
+LEASE = timedelta(minutes=2)
+BACKOFF_MAX = 600  # seconds
+
+
+def enqueue(alert):
+    """Queue the alert's deliveries; call inside the transaction that saves it"""
+    if not settings.NOTIFY_CHANNELS:
+        logger.error('Alert %s notifies nobody: NOTIFY_CHANNELS is empty', alert.pk)
+    AlertDelivery.objects.bulk_create([
+        AlertDelivery(alert=alert, channel=channel) for channel in settings.NOTIFY_CHANNELS
+    ])
+
+
+def recipients(alert):
+    """Active users registered in the alert's region"""
+    return User.objects.filter(is_active=True, region__iexact=alert.region.strip())
+
+
+def _backoff(attempt):
+    return timedelta(seconds=min(settings.NOTIFY_RETRY_BACKOFF * 2 ** (attempt - 1), BACKOFF_MAX))
+
+
+def claim():
+    """Lease the next due delivery to this worker, or return ``None``"""
+    now = timezone.now()
+    due = AlertDelivery.objects.filter(
+        status__in=['pending', 'sending'], next_attempt_at__lte=now,
+    ).filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now)).order_by('next_attempt_at', 'id')
+    for delivery in due.values('id', 'locked_until')[:10]:
+        # Only one worker's UPDATE matches the lease value it read
+        won = AlertDelivery.objects.filter(id=delivery['id'], locked_until=delivery['locked_until']).update(
+            locked_until=now + LEASE, status='sending',
+        )
+        if won:
+            return AlertDelivery.objects.select_related('alert').get(id=delivery['id'])
+    return None
+
+
+def _save(delivery, *fields):
+    delivery.locked_until = timezone.now() + LEASE
+    delivery.save(update_fields=[*fields, 'locked_until', 'updated_at'])
+
+
+def _send(delivery, channel, limiter, users):
+    if limiter:
+        limiter.acquire(len(users))
+    rejected = set(channel.send(delivery.alert, users))
+    delivery.sent += len(users) - len(rejected)
+    return [user.pk for user in users if user.pk in rejected]
+
+
+def process(delivery):
+    """Work through a claimed delivery until it is done or has to wait"""
+    channel = get_channel(delivery.channel)
+    limiter = rate_limiter(delivery.channel, channel)
+    users = channel.recipients(recipients(delivery.alert)).order_by('id')
+    batch_size = settings.NOTIFY_BATCH_SIZE
+
+    try:
+        while True:
+            batch = list(users.filter(id__gt=delivery.cursor)[:batch_size])
+            if not batch:
+                break
+            delivery.retry_ids.extend(_send(delivery, channel, limiter, batch))
+            delivery.cursor = batch[-1].pk
+            delivery.attempts = 0
+            _save(delivery, 'cursor', 'retry_ids', 'sent', 'attempts')
+
+        # Recipients the channel rejected get retried with backoff
+        if delivery.retry_ids and delivery.retry_round == 0:
+            delivery.retry_round = 1
+            delivery.next_attempt_at = timezone.now() + _backoff(1)
+            _save(delivery, 'retry_round', 'next_attempt_at')
+        while delivery.retry_ids:
+            if delivery.retry_round >= settings.NOTIFY_MAX_ATTEMPTS:
+                delivery.failed += len(delivery.retry_ids)
+                delivery.retry_ids = []
+                break
+            if delivery.next_attempt_at > timezone.now():
+                # Release the lease; the next claim after the backoff resumes here
+                delivery.locked_until = None
+                delivery.save(update_fields=['locked_until', 'updated_at'])
+                return
+            pending, rejected = delivery.retry_ids, []
+            for start in range(0, len(pending), batch_size):
+                # Users who left the region or lost their address drop out here
+                retry = list(users.filter(id__in=pending[start:start + batch_size]))
+                rejected += _send(delivery, channel, limiter, retry)
+            delivery.retry_ids = rejected
+            delivery.retry_round += 1
+            delivery.next_attempt_at = timezone.now() + _backoff(delivery.retry_round)
+            _save(delivery, 'retry_ids', 'retry_round', 'sent', 'next_attempt_at')
+    except Exception as exc:
+        delivery.attempts += 1
+        delivery.last_error = f'{type(exc).__name__}: {exc}'[:1000]
+        if delivery.attempts >= settings.NOTIFY_MAX_ATTEMPTS:
+            delivery.status = 'failed'
+        delivery.next_attempt_at = timezone.now() + _backoff(delivery.attempts)
+        delivery.locked_until = None
+        delivery.save()
+        logger.warning('Delivery %s (%s) attempt %s failed: %s', delivery.pk, delivery.channel, delivery.attempts, exc)
+        return
+
+    delivery.status = 'done'
+    delivery.locked_until = None
+    delivery.save()
+
+
+def run_once():
+    """Process every due delivery; returns how many were claimed"""
+    count = 0
+    while True:
+        delivery = claim()
+        if delivery is None:
+            return count
+        process(delivery)
+        count += 1
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Alert
+from .geofence import GeofenceError, validate as validate_geofence
+from .models import Alert, AlertDelivery
 
 class AlertSerializer(serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.get_full_name', read_only=True)
@@ -8,3 +9,31 @@ class AlertSerializer(serializers.ModelSerializer):
         model = Alert
         fields = '__all__'
         read_only_fields = ['created_at', 'created_by']
+
+    def validate(self, data):
+        def current(field):
+            # Partial updates only carry the changed fields
+            if field in data:
+                return data[field]
+            return getattr(self.instance, field, None)
+
+        try:
+            polygon = validate_geofence(
+                current('latitude'), current('longitude'), current('radius_km'), current('polygon')
+            )
+        except GeofenceError as exc:
+            raise serializers.ValidationError(str(exc))
+        if 'polygon' in data:
+            data['polygon'] = [list(point) for point in polygon] if polygon else None
+        return data
+
+
+class AlertDeliverySerializer(serializers.ModelSerializer):
+    pending_retries = serializers.SerializerMethodField()
+
+    def get_pending_retries(self, obj):
+        return len(obj.retry_ids)
+
+    class Meta:
+        model = AlertDelivery
+        exclude = ['retry_ids', 'locked_until']
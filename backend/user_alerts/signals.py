@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core_resources.snapshots import mark_dirty
+
+from .geofence import index as geofence_index
+from .models import Alert
+
+
+@receiver([post_save, post_delete], sender=Alert)
+def alert_changed(sender, instance, **kwargs):
+    # Alert regions are matched by substring, so any bundle may include it
+    mark_dirty()
+    geofence_index.invalidate()
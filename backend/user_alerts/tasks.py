@@ -0,0 +1,15 @@
+"""Background job tasks; see ``core_resources.jobs``"""
+from core_resources.jobs import task
+
+from .expiry import expire_due
+from .outbox import run_once
+
+
+@task(priority=10)
+def deliver_alerts():
+    return {'deliveries': run_once()}
+
+
+@task(priority=10)
+def expire_alerts():
+    return {'expired': expire_due()}
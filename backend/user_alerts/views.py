@@ -3,10 +3,12 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 
+from .geofence import index as geofence_index
 from .models import Alert
-from .serializers import AlertSerializer
+from .outbox import enqueue
+from .serializers import AlertDeliverySerializer, AlertSerializer
 
 class AlertViewSet(viewsets.ModelViewSet):
     """Alert management endpoints"""
@@ -22,22 +24,62 @@ class AlertViewSet(viewsets.ModelViewSet):
         # Only admins can create alerts
         if self.request.user.role != 'admin':
             raise PermissionError('Only admins can create alerts')
-        serializer.save(created_by=self.request.user)
+        # The alert and its notification jobs commit together; workers
+        # running `manage.py deliver_alerts` do the sending
+        with transaction.atomic():
+            alert = serializer.save(created_by=self.request.user)
+            if alert.is_active:
+                enqueue(alert)
+
+    @action(detail=True, methods=['get'])
+    def deliveries(self, request, pk=None):
+        """Notification progress per channel (admin)"""
+        if request.user.role != 'admin':
+            return Response({'error': 'Only admins can view deliveries'}, status=status.HTTP_403_FORBIDDEN)
+        alert = self.get_object()
+        return Response(AlertDeliverySerializer(alert.deliveries.all(), many=True).data)
     
     @action(detail=False, methods=['get'])
     def active(self, request):
-        """Get active alerts"""
-        now = timezone.now()
-        alerts = Alert.objects.filter(
-            is_active=True
-        ).filter(
-            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=now)
-        )
-        
-        # Filter by region if provided
-        region = request.query_params.get('region')
-        if region:
-            alerts = alerts.filter(region__icontains=region)
-        
+        """Get active alerts, optionally only those covering a point"""
+        try:
+            point = parse_point(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        covering = geofence_index.covering(*point) if point else None
+        alerts = active_alerts(request.query_params.get('region'), covering)
         serializer = self.get_serializer(alerts, many=True)
         return Response(serializer.data)
+
+
+def parse_point(params):
+    """``(lat, lon)`` from the query, or ``None`` when neither is given"""
+    lat, lon = params.get('lat'), params.get('lon')
+    if not (lat or lon):
+        return None
+    try:
+        return float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError('lat and lon must both be numbers')
+
+
+def active_alerts(region=None, covering=None):
+    """Active, unexpired alerts; ``covering`` holds the geofenced alert ids containing the caller's point"""
+    if covering is not None:
+        # Geofenced alerts that contain the point, plus region-wide
+        # alerts when the caller names a region
+        condition = models.Q(id__in=covering)
+        if region:
+            condition |= models.Q(region__icontains=region, radius_km__isnull=True, polygon__isnull=True)
+        alerts = Alert.objects.filter(condition)
+    else:
+        alerts = Alert.objects.all()
+        if region:
+            alerts = alerts.filter(region__icontains=region)
+
+    now = timezone.now()
+    return alerts.filter(
+        is_active=True
+    ).filter(
+        models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=now)
+    ).select_related('created_by')